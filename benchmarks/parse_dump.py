@@ -0,0 +1,144 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+"""
+parse_dump.py
+
+compare the regex based parsing of ipvsadm -Sn output, as pylvs did it up
+to now, with LVSSnapshot and its single pass tokenizer
+
+    python benchmarks/parse_dump.py --services 10000 --dests 100
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pylvs
+
+regex_mask = re.compile(r".*-M (\S{1,})")
+regex_pers = re.compile(r".*-p (\S{1,})")
+regex_sched = re.compile(r".*-s (rr|wrr|lc|wlc|lblc|lblcr|dh|sh|sed|nq).*")
+regex_rs = re.compile(r".*-r (\S{1,}) (-(g|i|m)) -w (\S{1,})")
+regex_upper = re.compile(r".*-x (\S{1,})")
+regex_lower = re.compile(r".*-y (\S{1,})")
+METHODS = {'-m': 'masq', '-g': 'route', '-i': 'ipip'}
+PROTOS = {'-t': 'tcp', '-u': 'udp'}
+
+
+def regex_parse(dump):
+    """the parser LVSSnapshot used before the tokenizer
+    """
+    services = {}
+    servers = {}
+    for line in dump.split("\n"):
+        fields = line.split(None, 5)
+        if len(fields) < 3 or fields[1] not in PROTOS:
+            continue
+        key = (PROTOS[fields[1]], fields[2])
+        if fields[0] == "-A":
+            scheduler = regex_sched.match(line)
+            persistence = regex_pers.match(line)
+            netmask = persistence and regex_mask.match(line)
+            services[key] = (scheduler and scheduler.group(1),
+                             persistence and persistence.group(1),
+                             netmask and netmask.group(1))
+            servers[key] = []
+        elif fields[0] == "-a":
+            match = regex_rs.match(line)
+            upper = regex_upper.match(line)
+            lower = regex_lower.match(line)
+            servers[key].append((match.group(1), METHODS[match.group(2)],
+                                 match.group(4), upper and upper.group(1),
+                                 lower and lower.group(1)))
+    return services, servers
+
+
+def regex_snapshot(dump):
+    """the LVSSnapshot parser before the tokenizer, building the same
+    VirtualService and RealServer objects
+    """
+    services = {}
+    servers = {}
+    real_servers = {}
+    for line in dump.split("\n"):
+        fields = line.split(None, 5)
+        if len(fields) < 3 or fields[1] not in PROTOS:
+            continue
+        key = (PROTOS[fields[1]], fields[2])
+        if fields[0] == "-A":
+            scheduler = regex_sched.match(line)
+            persistence = regex_pers.match(line)
+            netmask = persistence and regex_mask.match(line)
+            services[key] = pylvs.VirtualService(key[0], key[1],
+                scheduler and scheduler.group(1),
+                persistence and int(persistence.group(1)),
+                netmask and netmask.group(1))
+            servers[key] = []
+        elif fields[0] == "-a":
+            match = regex_rs.match(line)
+            upper = regex_upper.match(line)
+            lower = regex_lower.match(line)
+            server = pylvs.RealServer(match.group(1), METHODS[match.group(2)],
+                                      match.group(4),
+                                      upper and int(upper.group(1)),
+                                      lower and int(lower.group(1)))
+            servers[key].append(server)
+            real_servers[key + (match.group(1),)] = server
+    return services, servers, real_servers
+
+
+def make_dump(services, dests):
+    lines = []
+    for service in range(services):
+        addr = "10.{0}.{1}.{2}:80".format(service >> 16, (service >> 8) & 255,
+                                          service & 255)
+        lines.append("-A -t {0} -s wlc -p 300".format(addr))
+        for dest in range(dests):
+            lines.append("-a -t {0} -r 192.168.{1}.{2}:8080 -m -w 1 -x 1000 "
+                         "-y 500".format(addr, dest >> 8, dest & 255))
+    return "\n".join(lines) + "\n"
+
+
+def measure(name, func, dump, rounds):
+    best = None
+    for index in range(rounds):
+        start = time.time()
+        func(dump)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print("{0:<12} {1:8.3f}s".format(name, best))
+    sys.stdout.flush()
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--services", type=int, default=10000)
+    parser.add_argument("--dests", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    dump = make_dump(args.services, args.dests)
+    print("{0} services x {1} dests, {2} lines, best of {3}".format(
+        args.services, args.dests, dump.count("\n"), args.rounds))
+    old = measure("regex", regex_parse, dump, args.rounds)
+    tokens = measure("tokenizer",
+                     lambda dump: sum(1 for record in pylvs.pylvs.parse_dump(dump)),
+                     dump, args.rounds)
+    old_snapshot = measure("regex objs", regex_snapshot, dump, args.rounds)
+    new_snapshot = measure("LVSSnapshot", pylvs.LVSSnapshot, dump, args.rounds)
+    print("tokenizing is {0:.1f}x faster than matching the regexes, building "
+          "the snapshot objects {1:.1f}x".format(old / tokens,
+                                                 old_snapshot / new_snapshot))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+"""
+scale.py
+
+measure how the LVSManager and LVSInstance calls scale with the size of the
+IPVS table, without root and without the IPVS module
+
+a stub ipvsadm is put first on PATH, it keeps the table as ipvsadm -Sn
+output in a state file and logs every call, so the wall time and the
+number of ipvsadm processes of every call can be measured. The results are
+printed as JSON, with --baseline they are compared to an earlier run and
+the exit code is 1 if a call got slower or forks more often.
+
+    python benchmarks/scale.py --output baseline.json
+    python benchmarks/scale.py --baseline baseline.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pylvs
+
+_timer = getattr(time, "perf_counter", time.time)
+
+# keeps just enough of the ipvsadm semantics for the measured calls,
+# the table is only read and written as a whole, like ipvsadm -Sn/-R would
+STUB = """#!{python}
+import sys
+
+STATE = {state!r}
+LOG = {log!r}
+METHODS = ("-g", "-m", "-i")
+
+
+def find(lines, command, proto, addr, real_server=None):
+    for index, line in enumerate(lines):
+        fields = line.split()
+        if (fields[0] == command and fields[1] == proto and
+                fields[2] == addr and
+                (real_server is None or fields[4] == real_server)):
+            return index
+    return None
+
+
+def options(args, *flags):
+    result = []
+    for flag in flags:
+        if flag in args:
+            result += [flag, args[args.index(flag) + 1]]
+    return result
+
+
+def service_line(args):
+    line = args[1:3] + ["-s", "wlc"]
+    if "-s" in args:
+        line = args[1:3] + options(args, "-s")
+    if "-p" in args:
+        line += options(args, "-p", "-M")
+    return " ".join(["-A"] + line)
+
+
+def server_line(args):
+    method = [flag for flag in args if flag in METHODS] or ["-g"]
+    weight = options(args, "-w") or ["-w", "1"]
+    return " ".join(["-a"] + args[1:5] + method + weight +
+                    options(args, "-x", "-y"))
+
+
+def apply(lines, args):
+    action = args[0]
+    if action == "-C":
+        del lines[:]
+        return None
+    if action in ("-Z", "--set"):
+        return None
+    service = find(lines, "-A", args[1], args[2])
+    if action == "-A":
+        if service is not None:
+            return "Service already exists"
+        lines.append(service_line(args))
+        return None
+    if service is None:
+        return "No such service"
+    end = service + 1
+    while end < len(lines) and lines[end].startswith("-a "):
+        end += 1
+    if action == "-E":
+        lines[service] = service_line(args)
+    elif action == "-D":
+        del lines[service:end]
+    elif action in ("-a", "-e", "-d"):
+        index = find(lines[service:end], "-a", args[1], args[2], args[4])
+        if action == "-a":
+            if index is not None:
+                return "Destination already exists"
+            lines.insert(end, server_line(args))
+        elif index is None:
+            return "No such destination"
+        elif action == "-e":
+            lines[service + index] = server_line(args)
+        else:
+            del lines[service + index]
+    else:
+        return "not supported by the stub: " + action
+    return None
+
+
+def main(args):
+    with open(LOG, "a") as log:
+        log.write(" ".join(args) + "\\n")
+    if args in (["-Sn"], ["-S", "-n"]):
+        with open(STATE) as state:
+            sys.stdout.write(state.read())
+        return 0
+    if args == ["-R"]:
+        commands = [line.split() for line in sys.stdin if line.strip()]
+    else:
+        commands = [args]
+    with open(STATE) as state:
+        lines = state.read().splitlines()
+    status = 0
+    for command in commands:
+        error = apply(lines, command)
+        if error:
+            sys.stderr.write(error + "\\n")
+            status = 2
+    with open(STATE, "w") as state:
+        state.write("".join(line + "\\n" for line in lines))
+    return status
+
+
+sys.exit(main(sys.argv[1:]))
+"""
+
+
+def _addr(prefix, index, port=80):
+    return "{0}.{1}.{2}:{3}".format(prefix, (index >> 8) & 255, index & 255,
+                                    port)
+
+
+def make_dump(services, dests):
+    """a table of services with dests direct routing RealServers each
+    """
+    lines = []
+    for service in range(services):
+        addr = "10.{0}.{1}.{2}:80".format(service >> 16, (service >> 8) & 255,
+                                          service & 255)
+        lines.append("-A -t {0} -s wlc".format(addr))
+        for dest in range(dests):
+            lines.append("-a -t {0} -r {1} -g -w 1".format(
+                         addr, _addr("192.168", dest)))
+    return "".join(line + "\n" for line in lines)
+
+
+class Stub(object):
+    """a stub ipvsadm in a temporary directory, first on PATH
+    """
+
+    def __init__(self, dump):
+        self.path = tempfile.mkdtemp(prefix="pylvs-scale-")
+        self.state = os.path.join(self.path, "state")
+        self.log = os.path.join(self.path, "log")
+        with open(self.state, "w") as state:
+            state.write(dump)
+        open(self.log, "w").close()
+        script = os.path.join(self.path, "ipvsadm")
+        with open(script, "w") as stub:
+            stub.write(STUB.format(python=sys.executable, state=self.state,
+                                   log=self.log))
+        os.chmod(script, os.stat(script).st_mode | stat.S_IEXEC)
+        self.old_path = os.environ.get("PATH", "")
+        os.environ["PATH"] = self.path + os.pathsep + self.old_path
+
+    def forks(self):
+        """number of times the stub was run so far
+        """
+        with open(self.log) as log:
+            return sum(1 for line in log)
+
+    def close(self):
+        os.environ["PATH"] = self.old_path
+        shutil.rmtree(self.path)
+
+
+def _calls(manager, services, calls):
+    """the measured calls as (name, list of argument-less callables)
+    """
+    name = "tcp_" + _addr("10.0", services // 2)
+    instance = pylvs.LVSInstance(_addr("10.0", 0), "tcp", manager)
+    target = pylvs.LVSInstance(name.split("_")[1], "tcp", manager)
+    return [
+        ("add_lvs_instance", [
+            (lambda index=index: manager.add_lvs_instance(
+                _addr("172.16", index), "tcp", "wlc"))
+            for index in range(calls)]),
+        ("add_server", [
+            (lambda index=index: instance.add_server(
+                _addr("192.200", index), "route"))
+            for index in range(calls)]),
+        ("list_servers", [target.list_servers] * calls),
+        ("get_lvs_instance", [lambda: manager.get_lvs_instance(name)] * calls),
+        ("get_opts", [target.get_opts] * calls),
+    ]
+
+
+def measure(services, dests, calls, ttl):
+    """run the calls against a table of services, returns a result dict
+    per call
+    """
+    stub = Stub(make_dump(services, dests))
+    empty = tempfile.mkdtemp(prefix="pylvs-proc-")
+    try:
+        # an empty proc_root, so reads can not skip the stub
+        manager = pylvs.LVSManager(ttl=ttl, proc_root=empty)
+        results = []
+        for name, funcs in _calls(manager, services, calls):
+            forks = stub.forks()
+            elapsed = []
+            for func in funcs:
+                start = _timer()
+                func()
+                elapsed.append(_timer() - start)
+            elapsed.sort()
+            results.append({"size": services, "call": name,
+                            "calls": len(funcs),
+                            "seconds": elapsed[len(elapsed) // 2],
+                            "best": elapsed[0],
+                            "forks": float(stub.forks() - forks) / len(funcs)})
+            sys.stderr.write("{0:>6} services  {1:<17} {2:9.4f}s  {3:5.1f} "
+                             "forks\n".format(services, name,
+                                              results[-1]["seconds"],
+                                              results[-1]["forks"]))
+        return results
+    finally:
+        stub.close()
+        shutil.rmtree(empty)
+
+
+def compare(results, baseline, tolerance):
+    """list the calls that got slower than tolerance allows, or fork more
+    often than in baseline
+    """
+    old = dict(((entry["size"], entry["call"]), entry)
+               for entry in baseline["results"])
+    regressions = []
+    for entry in results:
+        before = old.get((entry["size"], entry["call"]))
+        if before is None:
+            continue
+        reasons = []
+        if entry["seconds"] > before["seconds"] * (1 + tolerance):
+            reasons.append("seconds")
+        if entry["forks"] > before["forks"]:
+            reasons.append("forks")
+        if reasons:
+            regressions.append({"size": entry["size"], "call": entry["call"],
+                                "reasons": reasons,
+                                "seconds": [before["seconds"],
+                                            entry["seconds"]],
+                                "forks": [before["forks"], entry["forks"]]})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10,1000,50000",
+                        help="comma separated numbers of services")
+    parser.add_argument("--dests", type=int, default=2,
+                        help="RealServers per service")
+    parser.add_argument("--calls", type=int, default=5,
+                        help="calls per measurement, the median is reported")
+    parser.add_argument("--ttl", type=float, default=0,
+                        help="snapshot ttl of the LVSManager")
+    parser.add_argument("--baseline", help="JSON of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown against the baseline")
+    parser.add_argument("--output", help="also write the JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes.split(","):
+        results += measure(int(size), args.dests, args.calls, args.ttl)
+    report = {"python": sys.version.split()[0], "dests": args.dests,
+              "ttl": args.ttl, "results": results}
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            report["regressions"] = compare(results, json.load(baseline),
+                                            args.tolerance)
+    out = json.dumps(report, indent=2, sort_keys=True)
+    print(out)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(out + "\n")
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
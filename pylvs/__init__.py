@@ -1 +1,6 @@
-from pylvs import LVSManager, LVSInstance
\ No newline at end of file
+from .pylvs import LVSManager, LVSInstance, LVSSnapshot, LVSStats, \
+                   LVSDaemon, LVSChange, LVSWatcher, LVSViolation, \
+                   LVSValidationError, LVSTransaction, LVSTransactionError, \
+                   IpvsadmBackend, IpvsadmError, Address, VirtualService, \
+                   RealServer, validate_state, netns_command, \
+                   LVSCheckpoint, diff_snapshots
@@ -0,0 +1,674 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+"""
+aio.py
+
+asyncio front-end for pylvs, python 3 only
+
+AsyncLVSManager and AsyncLVSInstance have the methods of LVSManager and
+LVSInstance as coroutines. ipvsadm runs as an asyncio subprocess, so the
+event loop is never blocked. The synchronous classes still validate the
+arguments and build the ipvsadm commands, so both behave the same.
+
+    >>> from pylvs.aio import AsyncLVSManager
+    >>> manager = AsyncLVSManager(limit=4)
+    >>> instance = await manager.add_lvs_instance("207.175.44.10:80", "tcp")
+    >>> await instance.add_server("192.168.10.1:81", "masq")
+"""
+
+import asyncio
+import subprocess
+
+from . import procfs
+from .instrument import InstrumentedBackend, _isasync
+from .pylvs import IPVSADM, LVSManager, LVSInstance, LVSSnapshot, \
+                   LVSTransaction, LVSTransactionError, IpvsadmError, \
+                   _commanderror, _ipvsadmerror, _parse_info, _prtcmd, \
+                   _svccmd, _RATE_LISTING, _CONN_LISTING, _STATS_LISTING
+
+
+class AsyncIpvsadmBackend(object):
+    """backend running ipvsadm as an asyncio subprocess
+
+    limit: maximum number of ipvsadm processes running at the same time
+    ipvsadm: path of the ipvsadm binary, IPVSADM if omitted
+
+    a cancelled call does not kill its ipvsadm process, the command may
+    already be applied, so it keeps running and its slot is only freed
+    once it exited
+    """
+
+    procfs = True
+
+    def __init__(self, limit=4, ipvsadm=None):
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        if ipvsadm is None:
+            ipvsadm = IPVSADM
+        self.limit = limit
+        self.ipvsadm = ipvsadm
+        self._semaphore = None
+
+    async def _run(self, args, stream=None):
+        """run ipvsadm, return (returncode, stdout, stderr)
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        semaphore = self._semaphore
+        await semaphore.acquire()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self.ipvsadm, *args,
+                stdin=subprocess.PIPE if stream is not None else
+                      subprocess.DEVNULL,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except BaseException as error:
+            semaphore.release()
+            if isinstance(error, OSError):
+                raise IpvsadmError("ipvsadm failed: {0}".format(error))
+            raise
+
+        if stream is not None:
+            stream = stream.encode()
+        communicate = asyncio.ensure_future(process.communicate(stream))
+        communicate.add_done_callback(lambda future: semaphore.release())
+        out, err = await asyncio.shield(communicate)
+        return (process.returncode, out.decode(errors="replace"),
+                err.decode(errors="replace"))
+
+    async def execute(self, args):
+        """run a command that changes the IPVS table
+        """
+        returncode, out, err = await self._run(args)
+        if returncode:
+            raise _ipvsadmerror(returncode, err)
+        return True
+
+    async def output(self, args):
+        """run a command and return what it printed
+        """
+        returncode, out, err = await self._run(args)
+        if returncode:
+            raise _ipvsadmerror(returncode, err)
+        return out
+
+    async def restore(self, commands):
+        """apply a list of commands with a single ipvsadm -R call
+
+        returns a list of (index, message) tuples like
+        IpvsadmBackend.restore()
+        """
+        stream = "".join(" ".join(args) + "\n" for args in commands)
+        returncode, out, err = await self._run(["-R"], stream)
+        errors = [(None, line) for line in err.split("\n") if line]
+        if returncode and not errors:
+            errors.append((None, "ipvsadm -R failed with exit code "
+                                 "{0}".format(returncode)))
+        return errors
+
+
+class AsyncInstrumentedBackend(InstrumentedBackend):
+    """asyncio version of InstrumentedBackend, wrapping
+    AsyncIpvsadmBackend or any backend with execute, output and restore
+    coroutines
+
+    the calls are timed until the coroutines of the wrapped backend are
+    done, hooks are still plain callables
+    """
+
+    # asyncio backends have no stream method
+    stream = None
+
+    def __init__(self, backend=None, slow=None, logger=None):
+        if backend is None:
+            backend = AsyncIpvsadmBackend()
+        InstrumentedBackend.__init__(self, backend, slow, logger)
+
+    def _check(self, backend):
+        if not _isasync(backend):
+            raise ValueError("{0} is not an asyncio backend, wrap it with "
+                             "pylvs.instrument.InstrumentedBackend".format(
+                             type(backend).__name__))
+
+    async def _call(self, method, args):
+        call, start = self._start(method, args)
+        try:
+            return await getattr(self.backend, method)(args)
+        except ValueError as error:
+            self._failed(call, error)
+            raise
+        finally:
+            self._finish(call, start)
+
+    async def execute(self, args):
+        """run a command that changes the IPVS table
+        """
+        return await self._call("execute", args)
+
+    async def output(self, args):
+        """run a command and return what it printed
+        """
+        return await self._call("output", args)
+
+    async def restore(self, commands):
+        """apply a list of commands, see AsyncIpvsadmBackend.restore()
+        """
+        call, start = self._start("restore", commands)
+        try:
+            return self._restored(call, commands,
+                                  await self.backend.restore(commands))
+        except ValueError as error:
+            self._failed(call, error)
+            raise
+        finally:
+            self._finish(call, start)
+
+
+class _Recorder(LVSManager):
+    """LVSManager recording the commands instead of running them
+
+    the synchronous methods validate the arguments and build the commands,
+    reads are answered from a snapshot and listings fetched beforehand
+    """
+
+    def __init__(self, snapshot=None, outputs=None, proc_root=None):
+        LVSManager.__init__(self, proc_root=proc_root)
+        self.commands = []
+        self.preloaded = snapshot
+        self.outputs = outputs or {}
+
+    def _execute(self, args, errmsg):
+        self.commands.append((list(args), errmsg))
+        return True
+
+    def _output(self, args):
+        return self.outputs[tuple(args)]
+
+    def snapshot(self, max_age=None, partial=False):
+        return self.preloaded
+
+    def transaction(self):
+        return self
+
+
+class AsyncLVSManager(object):
+    """asyncio version of LVSManager
+
+    backend: AsyncIpvsadmBackend if omitted, or any object with execute,
+             output and restore coroutines
+    ttl: seconds a snapshot of the IPVS table is reused, see LVSManager
+    proc_root: where procfs is mounted, /proc if omitted
+    limit: maximum number of ipvsadm processes of the default backend
+
+    concurrent reads of the same listing share one ipvsadm call
+    """
+
+    def __init__(self, backend=None, ttl=0, proc_root=None, limit=4):
+        if backend is None:
+            backend = AsyncIpvsadmBackend(limit)
+        self.backend = backend
+        self.ttl = ttl
+        self.proc_root = proc_root
+        self._snapshot = None
+        self._generation = 0
+        self._reads = {}
+
+    async def _run(self, recorder):
+        """run the commands collected by a _Recorder, one after the other
+
+        raises IpvsadmError with the errmsg of the first failing command,
+        see LVSManager._execute()
+        """
+        try:
+            for args, errmsg in recorder.commands:
+                try:
+                    await self.backend.execute(args)
+                except ValueError as error:
+                    raise _commanderror(errmsg, error)
+        finally:
+            self.invalidate()
+        return True
+
+    async def _read(self, args):
+        try:
+            return await self.backend.output(args)
+        except ValueError as error:
+            raise ValueError("something has failed: {0}".format(error))
+
+    async def _output(self, args):
+        """run a read-only command, joining a running call with the same
+        arguments instead of starting another one
+        """
+        key = tuple(args)
+        read = self._reads.get(key)
+        if read is None:
+            read = asyncio.ensure_future(self._read(args))
+            self._reads[key] = read
+            read.add_done_callback(lambda future: self._done(key, future))
+        return await asyncio.shield(read)
+
+    def _done(self, key, read):
+        if self._reads.get(key) is read:
+            del self._reads[key]
+        if not read.cancelled():
+            # retrieve the error, the awaiters might all be cancelled
+            read.exception()
+
+    async def _read_procfs(self):
+        """the IPVS table from procfs, see LVSManager._read_procfs()
+        """
+        if not getattr(self.backend, "procfs", False):
+            return None
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(None, procfs.dump_services,
+                                              self.proc_root)
+        except (IOError, OSError, ValueError):
+            return None
+
+    async def snapshot(self, max_age=None, partial=False):
+        """return a LVSSnapshot of the IPVS table, see LVSManager.snapshot()
+        """
+        if max_age is None:
+            max_age = self.ttl
+        snapshot = self._snapshot
+        if (snapshot is not None and snapshot.age() <= max_age and
+                max_age > 0 and (partial or not snapshot.partial)):
+            return snapshot
+
+        generation = self._generation
+        dump = None
+        if partial:
+            dump = await self._read_procfs()
+        if dump is None:
+            snapshot = LVSSnapshot(await self._output(["-Sn"]))
+        else:
+            snapshot = LVSSnapshot(dump, partial=True)
+        # a change made while we were reading makes the snapshot stale
+        if generation == self._generation:
+            self._snapshot = snapshot
+        return snapshot
+
+    def invalidate(self):
+        """drop the cached snapshot, reads started before are not joined
+        by later callers
+        """
+        self._snapshot = None
+        self._generation += 1
+        self._reads.clear()
+
+    def transaction(self):
+        """start a new AsyncLVSTransaction, use it with async with
+        """
+        return AsyncLVSTransaction(self)
+
+    async def add_lvs_instance(self, service_addr, proto, scheduler=None,
+                               **kwargs):
+        """see LVSManager.add_lvs_instance(), returns an AsyncLVSInstance
+        """
+        recorder = _Recorder()
+        instance = recorder.add_lvs_instance(service_addr, proto, scheduler,
+                                             **kwargs)
+        await self._run(recorder)
+        return AsyncLVSInstance(instance.service_addr, proto, self)
+
+    async def del_lvs_instance(self, service_addr, proto):
+        """see LVSManager.del_lvs_instance()
+        """
+        recorder = _Recorder()
+        recorder.del_lvs_instance(service_addr, proto)
+        return await self._run(recorder)
+
+    async def get_lvs_instance(self, name):
+        """see LVSManager.get_lvs_instance(), returns an AsyncLVSInstance
+        """
+        recorder = _Recorder(await self.snapshot(partial=True))
+        instance = recorder.get_lvs_instance(name)
+        return AsyncLVSInstance(instance.service_addr, instance.proto, self)
+
+    async def list_lvs_instances(self):
+        """see LVSManager.list_lvs_instances(), returns AsyncLVSInstances
+        """
+        snapshot = await self.snapshot(partial=True)
+        return [AsyncLVSInstance(service_addr, proto, self) for
+                proto, service_addr in snapshot.list_services()]
+
+    async def apply(self, desired_state, dry_run=False):
+        """see LVSManager.apply()
+        """
+        recorder = _Recorder(await self.snapshot(0))
+        plan = recorder.apply(desired_state, dry_run=True)
+        if not dry_run and plan:
+            txn = self.transaction()
+            txn.commands = recorder.commands
+            await txn.commit()
+        return plan
+
+    async def clear_ipvs(self):
+        """see LVSManager.clear_ipvs()
+        """
+        recorder = _Recorder()
+        recorder.clear_ipvs()
+        return await self._run(recorder)
+
+    async def set_timeouts(self, tcp, tcpfin, udp):
+        """see LVSManager.set_timeouts()
+        """
+        recorder = _Recorder()
+        recorder.set_timeouts(tcp, tcpfin, udp)
+        return await self._run(recorder)
+
+    async def get_timeouts(self):
+        """see LVSManager.get_timeouts()
+        """
+        args = ["-L", "--timeout"]
+        recorder = _Recorder(outputs={tuple(args): await self._output(args)})
+        return recorder.get_timeouts()
+
+    async def get_info(self):
+        """see LVSManager.get_info(), the procfs header is read in a thread
+        """
+        if getattr(self.backend, "procfs", False):
+            loop = asyncio.get_event_loop()
+            try:
+                return _parse_info(await loop.run_in_executor(None,
+                    procfs.read_header, self.proc_root))
+            except (IOError, OSError):
+                pass
+        out = await self._output(["-Ln"])
+        return _parse_info(out.split("\n", 1)[0])
+
+    async def start_daemon(self, state, mcast_interface, syncid=0, **kwargs):
+        """see LVSManager.start_daemon()
+        """
+        recorder = _Recorder()
+        recorder.start_daemon(state, mcast_interface, syncid, **kwargs)
+        return await self._run(recorder)
+
+    async def stop_daemon(self, state):
+        """see LVSManager.stop_daemon()
+        """
+        recorder = _Recorder()
+        recorder.stop_daemon(state)
+        return await self._run(recorder)
+
+    async def list_daemons(self):
+        """see LVSManager.list_daemons()
+        """
+        args = ["-L", "--daemon"]
+        recorder = _Recorder(outputs={tuple(args): await self._output(args)})
+        return recorder.list_daemons()
+
+    async def get_sync_stats(self):
+        """see LVSManager.get_sync_stats(), the connection table is read in
+        a thread
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None,
+            _Recorder(proc_root=self.proc_root).get_sync_stats)
+
+    async def get_schedulers(self):
+        """see LVSManager.get_schedulers(), procfs and the module lists
+        are read in a thread
+        """
+        recorder = _Recorder(proc_root=self.proc_root)
+        recorder.backend = self.backend
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, recorder.get_schedulers)
+
+    async def get_sync_tunables(self):
+        """see LVSManager.get_sync_tunables(), the sysctls are read in a
+        thread
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None,
+            _Recorder(proc_root=self.proc_root).get_sync_tunables)
+
+    async def get_tunables(self):
+        """see LVSManager.get_tunables(), the sysctls are read in a thread
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None,
+            _Recorder(proc_root=self.proc_root).get_tunables)
+
+    async def diff_tunables(self, profile):
+        """see LVSManager.diff_tunables(), the sysctls are read in a thread
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None,
+            _Recorder(proc_root=self.proc_root).diff_tunables, profile)
+
+    async def set_tunables(self, profile, dry_run=False):
+        """see LVSManager.set_tunables(), the sysctls are read and written
+        in a thread
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None,
+            _Recorder(proc_root=self.proc_root).set_tunables, profile,
+            dry_run)
+
+    async def _get_stats(self, selector=()):
+        """see LVSManager._get_stats(), the listings are read concurrently
+        """
+        selector = list(selector)
+        listings = [_RATE_LISTING + selector, _CONN_LISTING + selector,
+                    _STATS_LISTING + selector]
+        outputs = await asyncio.gather(*[self._output(args)
+                                         for args in listings])
+        recorder = _Recorder(outputs=dict(zip(map(tuple, listings), outputs)))
+        return recorder._get_stats(selector)
+
+    async def get_stats(self, zero=False):
+        """see LVSManager.get_stats()
+        """
+        stats = await self._get_stats()
+        if zero:
+            await self.zero()
+        return stats
+
+    async def zero(self):
+        """see LVSManager.zero()
+        """
+        recorder = _Recorder()
+        recorder.zero()
+        return await self._run(recorder)
+
+
+class AsyncLVSTransaction(AsyncLVSManager):
+    """asyncio version of LVSTransaction
+
+    >>> async with manager.transaction() as txn:
+    ...     instance = await txn.add_lvs_instance("207.175.44.10:80", "tcp")
+    ...     await instance.add_server("192.168.10.1:81", "masq")
+    """
+
+    def __init__(self, parent):
+        AsyncLVSManager.__init__(self, parent.backend, proc_root=parent.proc_root)
+        self.parent = parent
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            await self.commit()
+        else:
+            self.rollback()
+        return False
+
+    def __len__(self):
+        return len(self.commands)
+
+    async def _run(self, recorder):
+        """queue the commands instead of running them
+        """
+        self.commands.extend(recorder.commands)
+        return True
+
+    def transaction(self):
+        raise ValueError("transactions can not be nested")
+
+    async def get_lvs_instance(self, name):
+        """see LVSTransaction.get_lvs_instance()
+        """
+        instance = LVSTransaction().get_lvs_instance(name)
+        return AsyncLVSInstance(instance.service_addr, instance.proto, self)
+
+    def invalidate(self):
+        AsyncLVSManager.invalidate(self)
+        self.parent.invalidate()
+
+    def rollback(self):
+        """discard all queued commands
+        """
+        self.commands = []
+        return True
+
+    async def commit(self):
+        """apply all queued commands with a single batch, see
+        LVSTransaction.commit()
+        """
+        if not self.commands:
+            return True
+
+        checker = LVSTransaction()
+        checker.commands = self.commands
+        try:
+            snapshot = await self.snapshot(0)
+        except ValueError as error:
+            raise LVSTransactionError("could not read IPVS table: {0}, "
+                                      "nothing was applied".format(error),
+                                      applied=0)
+        checker._check(checker._table(snapshot))
+
+        try:
+            failed = await self.backend.restore([args for args, errmsg
+                                                 in self.commands])
+        except ValueError as error:
+            raise LVSTransactionError("could not apply batch: {0}, "
+                                      "nothing was applied".format(error),
+                                      applied=0)
+        finally:
+            self.invalidate()
+
+        checker._raise_failed(failed)
+        self.commands = []
+        return True
+
+
+class AsyncLVSInstance(object):
+    """asyncio version of LVSInstance
+    """
+
+    def __init__(self, service_addr, proto, manager):
+        self.service_addr = service_addr
+        self.proto = proto
+        self.prtcmd = _prtcmd(proto)
+        self.svccmd = _svccmd(proto, service_addr)
+        self.manager = manager
+
+    def __str__(self):
+        return self.proto + "_" + self.service_addr
+
+    def __repr__(self):
+        return self.proto + "_" + self.service_addr
+
+    def __eq__(self, other):
+        return str(self) == str(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(str(self))
+
+    async def _record(self, method, *args, **kwargs):
+        """run a LVSInstance method against a _Recorder, then run the
+        recorded commands
+        """
+        recorder = _Recorder()
+        getattr(LVSInstance(self.service_addr, self.proto, recorder),
+                method)(*args, **kwargs)
+        return await self.manager._run(recorder)
+
+    async def add_server(self, real_server, method, **kwargs):
+        """see LVSInstance.add_server()
+        """
+        return await self._record("add_server", real_server, method,
+                                  **kwargs)
+
+    async def del_server(self, real_server):
+        """see LVSInstance.del_server()
+        """
+        return await self._record("del_server", real_server)
+
+    async def edit_server(self, real_server, method, **kwargs):
+        """see LVSInstance.edit_server()
+        """
+        return await self._record("edit_server", real_server, method,
+                                  **kwargs)
+
+    async def set_opts(self, scheduler, **kwargs):
+        """see LVSInstance.set_opts()
+        """
+        return await self._record("set_opts", scheduler, **kwargs)
+
+    async def zero(self):
+        """see LVSInstance.zero()
+        """
+        return await self._record("zero")
+
+    async def list_servers(self):
+        """see LVSInstance.list_servers()
+        """
+        snapshot = await self.manager.snapshot(partial=True)
+        return snapshot.list_servers(self.proto, self.service_addr)
+
+    async def get_servers(self):
+        """see LVSInstance.get_servers()
+        """
+        snapshot = await self.manager.snapshot()
+        return snapshot.get_servers(self.proto, self.service_addr)
+
+    async def get_service(self):
+        """see LVSInstance.get_service()
+        """
+        snapshot = await self.manager.snapshot()
+        return snapshot.get_service(self.proto, self.service_addr)
+
+    async def get_opts(self, flags=False):
+        """see LVSInstance.get_opts()
+        """
+        snapshot = await self.manager.snapshot(partial=True)
+        opts = snapshot.get_opts(self.proto, self.service_addr, flags)
+        if snapshot.partial and opts is not None and (
+                flags or opts[1] is not None):
+            # procfs shows the persistence timeout in jiffies and does
+            # not show the scheduler flags
+            snapshot = await self.manager.snapshot()
+            opts = snapshot.get_opts(self.proto, self.service_addr, flags)
+        return opts
+
+    async def get_stats(self, zero=False):
+        """see LVSInstance.get_stats()
+        """
+        stats = await self.manager._get_stats(self.svccmd)
+        if zero:
+            await self.zero()
+        for name, result in stats.items():
+            return result
+        raise ValueError("{0} not found in IPVS table".format(self))
+
+    async def get_conn_distribution(self, sync=False):
+        """see LVSInstance.get_conn_distribution(), the connection table is
+        read in a thread
+        """
+        instance = LVSInstance(self.service_addr, self.proto,
+                               _Recorder(proc_root=self.manager.proc_root))
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None,
+            instance.get_conn_distribution, sync)
@@ -0,0 +1,181 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+"""
+cluster.py
+
+the same changes for a fleet of directors
+
+every director is an LVSManager with its own backend: IpvsadmBackend for
+this host, IpvsadmBackend with a command like ["ssh", "lb1", "ipvsadm"]
+for another one, or a SimulatedBackend. ClusterManager runs a change on
+all of them, at most workers at the same time, and collects the result,
+duration and error of every director.
+
+    >>> import pylvs
+    >>> from pylvs.cluster import ClusterManager
+    >>> cluster = ClusterManager(dict((host, pylvs.IpvsadmBackend(
+    ...     ["ssh", host, "sudo", "ipvsadm"])) for host in ("lb1", "lb2")),
+    ...     workers=8, policy="quorum")
+    >>> results = cluster.apply(desired_state)
+"""
+
+import collections
+import threading
+
+from .pylvs import LVSManager, LVSValidationError, validate_state, _now
+
+POLICIES = ("all", "quorum", "abort")
+STATUSES = ("ok", "failed", "skipped")
+
+# status is one of STATUSES, duration is None for skipped directors
+LVSDirectorResult = collections.namedtuple("LVSDirectorResult",
+    ("director", "status", "result", "error", "duration"))
+
+
+class LVSClusterError(ValueError):
+    """raised when a change did not reach the directors the policy wants
+
+    results: dict mapping every director to its LVSDirectorResult
+    """
+
+    def __init__(self, message, results):
+        ValueError.__init__(self, message)
+        self.results = results
+
+
+class ClusterManager(object):
+    """runs the same changes on many directors concurrently
+
+    directors: dict mapping the names of the directors to their
+               LVSManager, or to the backend of one
+    workers: at most this many directors are changed at the same time
+    policy: one of POLICIES. "all" fails if any director failed, "quorum"
+            if fewer than quorum directors succeeded, and "abort" does not
+            start any more directors after the first failure
+    quorum: directors that must succeed with the quorum policy, the
+            majority if omitted. A run on some of the directors needs
+            the majority of them, or all of them if they are fewer than
+            quorum
+    """
+
+    def __init__(self, directors, workers=4, policy="all", quorum=None):
+        if policy not in POLICIES:
+            raise ValueError("invalid policy: {0}".format(policy))
+        if workers < 1:
+            raise ValueError("workers must be at least 1, was "
+                             "{0}".format(workers))
+        self.managers = {}
+        for name, director in directors.items():
+            if not isinstance(director, LVSManager):
+                director = LVSManager(backend=director)
+            self.managers[name] = director
+        if quorum is not None and not 1 <= quorum <= len(self.managers):
+            raise ValueError("quorum must be within 1 and {0}, was "
+                             "{1}".format(len(self.managers), quorum))
+        self.workers = workers
+        self.policy = policy
+        self.quorum = quorum
+
+    def run(self, change, directors=None):
+        """call change with the LVSManager of every director
+
+        change: callable taking an LVSManager, like
+                lambda manager: manager.set_timeouts(900, 120, 300)
+        directors: names of the directors to change, all if omitted
+
+        returns a dict mapping the names of the directors to their
+        LVSDirectorResult, raises LVSClusterError with it if the policy
+        is not met
+        """
+        if directors is None:
+            directors = self.managers
+        names = sorted(directors)
+        for name in names:
+            if name not in self.managers:
+                raise ValueError("unknown director: {0}".format(name))
+        results = {}
+        lock = threading.Lock()
+        abort = threading.Event()
+        todo = list(reversed(names))
+
+        def worker():
+            while True:
+                with lock:
+                    if not todo:
+                        return
+                    name = todo.pop()
+                if abort.is_set():
+                    result = LVSDirectorResult(name, "skipped", None, None,
+                                               None)
+                else:
+                    result = self._change(name, change)
+                    if result.status == "failed" and self.policy == "abort":
+                        abort.set()
+                with lock:
+                    results[name] = result
+
+        threads = [threading.Thread(target=worker)
+                   for index in range(min(self.workers, len(names)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._check(results)
+        return results
+
+    def _change(self, name, change):
+        """run change on a single director, returns its LVSDirectorResult
+        """
+        start = _now()
+        try:
+            result = change(self.managers[name])
+        except Exception as error:
+            # one broken director must not take the others down
+            return LVSDirectorResult(name, "failed", None, error,
+                                     _now() - start)
+        return LVSDirectorResult(name, "ok", result, None, _now() - start)
+
+    def _quorum(self, count):
+        """directors that must succeed in a run on count directors
+        """
+        if self.quorum is None:
+            return count // 2 + 1
+        return min(self.quorum, count)
+
+    def _check(self, results):
+        """raise LVSClusterError if results do not meet the policy
+        """
+        failed = sorted(name for name in results
+                        if results[name].status == "failed")
+        succeeded = sum(1 for result in results.values()
+                        if result.status == "ok")
+        errors = "; ".join("{0}: {1}".format(name, results[name].error)
+                           for name in failed)
+        if self.policy == "quorum":
+            quorum = self._quorum(len(results))
+            if succeeded < quorum:
+                raise LVSClusterError("{0} of {1} directors succeeded, quorum "
+                    "is {2}: {3}".format(succeeded, len(results), quorum,
+                                         errors), results)
+        elif failed:
+            raise LVSClusterError("{0} of {1} directors failed: {2}".format(
+                                  len(failed), len(results), errors), results)
+
+    def apply(self, desired_state, dry_run=False, directors=None):
+        """bring the table of every director to desired_state, see
+        LVSManager.apply()
+
+        desired_state is validated once before any director is touched,
+        LVSValidationError tells all of its violations
+
+        returns the results of run(), the result of a director being its
+        plan
+        """
+        violations = validate_state(desired_state)[1]
+        if violations:
+            raise LVSValidationError(violations)
+        return self.run(lambda manager: manager.apply(desired_state, dry_run),
+                        directors)
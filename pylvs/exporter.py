@@ -0,0 +1,218 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+"""
+exporter.py
+
+Prometheus exporter for the IPVS table
+
+the counters, rates, connections and weights of every service and
+RealServer are served on /metrics in the Prometheus text format. The table
+is read at most once per max_age seconds, concurrent scrapes share that
+read, so the number of scrapers does not matter.
+
+    python -m pylvs.exporter --port 9470 --max-age 5
+"""
+
+import argparse
+import sys
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+from .pylvs import LVSManager, _now
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# LVSStats field, metric name, type, help
+METRICS = (
+    ("conns", "connections_total", "counter", "connections scheduled"),
+    ("inpkts", "packets_in_total", "counter", "incoming packets"),
+    ("outpkts", "packets_out_total", "counter", "outgoing packets"),
+    ("inbytes", "bytes_in_total", "counter", "incoming bytes"),
+    ("outbytes", "bytes_out_total", "counter", "outgoing bytes"),
+    ("cps", "connections_per_second", "gauge", "connection rate"),
+    ("inpps", "packets_in_per_second", "gauge", "incoming packet rate"),
+    ("outpps", "packets_out_per_second", "gauge", "outgoing packet rate"),
+    ("inbps", "bytes_in_per_second", "gauge", "incoming byte rate"),
+    ("outbps", "bytes_out_per_second", "gauge", "outgoing byte rate"),
+    ("activeconns", "active_connections", "gauge", "active connections"),
+    ("inactconns", "inactive_connections", "gauge", "inactive connections"),
+)
+
+def _escape(value):
+    """escape a label value for the text format
+    """
+    return (str(value).replace("\\", "\\\\").replace("\n", "\\n")
+            .replace('"', '\\"'))
+
+def _labels(**labels):
+    return "{" + ",".join('{0}="{1}"'.format(key, _escape(labels[key]))
+                          for key in sorted(labels)) + "}"
+
+
+class MetricsCollector(object):
+    """renders the metrics of the IPVS table, caching them for max_age
+    seconds
+
+    manager: LVSManager to read the table with
+    max_age: seconds the rendered metrics are served again before the
+             table is read anew
+    """
+
+    def __init__(self, manager=None, max_age=5):
+        if manager is None:
+            manager = LVSManager()
+        self.manager = manager
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.rendered = None
+        self.created = None
+        self.reads = 0
+
+    def collect(self):
+        """return the metrics in the text format, reading the table if the
+        cached ones are older than max_age
+
+        concurrent callers wait for a read that is already running
+        instead of starting their own
+        """
+        with self.lock:
+            if (self.rendered is None or
+                    _now() - self.created > self.max_age):
+                self.rendered = self._render()
+                self.created = _now()
+            return self.rendered
+
+    def _read(self):
+        """read stats and weights, returns (stats, weights), weights
+        mapping (service name, real_server) to the weight
+        """
+        stats = self.manager.get_stats()
+        snapshot = self.manager.snapshot(partial=True)
+        weights = {}
+        for key in snapshot.list_services():
+            name = snapshot.services[key].name
+            for server in snapshot.servers[key]:
+                weights[(name, str(server.address))] = server.weight
+        return stats, weights
+
+    def _render(self):
+        """read the table and render all metrics
+        """
+        self.reads += 1
+        start = time.time()
+        try:
+            stats, weights = self._read()
+            up = 1
+        except ValueError:
+            stats, weights = {}, {}
+            up = 0
+        lines = []
+        for field, metric, mtype, text in METRICS:
+            for kind, what in (("service", "of the service"),
+                               ("server", "of the RealServer")):
+                name = "pylvs_{0}_{1}".format(kind, metric)
+                lines.append("# HELP {0} {1} {2}".format(name, text, what))
+                lines.append("# TYPE {0} {1}".format(name, mtype))
+                for service in sorted(stats):
+                    service_stats, servers = stats[service]
+                    if kind == "service":
+                        lines.append("{0}{1} {2}".format(name,
+                            _labels(service=service),
+                            getattr(service_stats, field)))
+                        continue
+                    for real_server in sorted(servers):
+                        lines.append("{0}{1} {2}".format(name,
+                            _labels(service=service, real_server=real_server),
+                            getattr(servers[real_server], field)))
+        lines.append("# HELP pylvs_server_weight weight of the RealServer")
+        lines.append("# TYPE pylvs_server_weight gauge")
+        for (service, real_server) in sorted(weights):
+            lines.append("pylvs_server_weight{0} {1}".format(
+                _labels(service=service, real_server=real_server),
+                weights[(service, real_server)]))
+        lines.append("# HELP pylvs_up 1 if the IPVS table could be read")
+        lines.append("# TYPE pylvs_up gauge")
+        lines.append("pylvs_up {0}".format(up))
+        lines.append("# HELP pylvs_scrape_duration_seconds time it took to "
+                     "read the IPVS table")
+        lines.append("# TYPE pylvs_scrape_duration_seconds gauge")
+        lines.append("pylvs_scrape_duration_seconds {0:.6f}".format(
+                     time.time() - start))
+        return "".join(line + "\n" for line in lines)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """serves the metrics of server.collector on /metrics
+    """
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.collector.collect().encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    """threaded HTTP server for a MetricsCollector
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, collector):
+        HTTPServer.__init__(self, address, _Handler)
+        self.collector = collector
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prometheus exporter for "
+                                     "the IPVS table")
+    parser.add_argument("--address", default="",
+                        help="address to listen on, all if omitted")
+    parser.add_argument("--port", type=int, default=9470,
+                        help="port to listen on")
+    parser.add_argument("--max-age", type=float, default=5,
+                        help="seconds the metrics are served from the cache")
+    parser.add_argument("--backend", choices=("ipvsadm", "netlink", "auto"),
+                        default="ipvsadm", help="how to read the table")
+    parser.add_argument("--proc-root", help="where procfs is mounted")
+    args = parser.parse_args(argv)
+
+    backend = None
+    if args.backend != "ipvsadm":
+        from . import netlink
+        if args.backend == "netlink":
+            backend = netlink.NetlinkBackend()
+        else:
+            backend = netlink.detect_backend()
+    manager = LVSManager(backend=backend, proc_root=args.proc_root)
+    server = MetricsServer((args.address, args.port),
+                           MetricsCollector(manager, args.max_age))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
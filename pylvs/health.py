@@ -0,0 +1,321 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+"""
+health.py
+
+asyncio health checker driving the weights of RealServers, python 3 only
+
+every RealServer gets a check, a TCP connect, a HTTP GET or any callable
+taking the real_server and returning True if it is healthy. A RealServer
+failing fall checks in a row is quiesced by setting its weight to 0, and
+gets its weight back after passing rise checks in a row. The changes of
+one check round are applied as one transaction.
+
+    >>> from pylvs.aio import AsyncLVSManager
+    >>> from pylvs.health import HealthChecker, HTTPCheck
+    >>> checker = HealthChecker(AsyncLVSManager(), interval=5, fall=3)
+    >>> await checker.add_service("tcp_207.175.44.10:80", HTTPCheck("/ping"))
+    >>> checker.start()
+"""
+
+import asyncio
+import inspect
+import time
+
+from .aio import AsyncLVSInstance
+from .pylvs import _canonaddr, _servicekey, _validateserver, \
+                   _validateservice
+
+
+def _split(real_server):
+    """split ip:port into host and port, IPv6 addresses lose the brackets
+    """
+    host, port = real_server.rsplit(":", 1)
+    if host.startswith("["):
+        host = host[1:-1]
+    return host, int(port)
+
+async def _close(writer):
+    """close the connection of a check and wait until it is closed
+    """
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+
+def _iscoroutine(check):
+    """True if check, a function or a callable object, is a coroutine
+    """
+    return (inspect.iscoroutinefunction(check) or
+            inspect.iscoroutinefunction(getattr(check, "__call__", None)))
+
+
+class TCPCheck(object):
+    """healthy if a TCP connection to the RealServer can be opened
+
+    port: connect to this port instead of the one of the RealServer
+    """
+
+    def __init__(self, port=None):
+        self.port = port
+
+    async def __call__(self, real_server):
+        host, port = _split(real_server)
+        reader, writer = await asyncio.open_connection(host,
+                                                       self.port or port)
+        await _close(writer)
+        return True
+
+
+class HTTPCheck(object):
+    """healthy if a HTTP GET of path returns one of the expected status codes
+
+    path: path to request
+    port: connect to this port instead of the one of the RealServer
+    host: Host header, the address of the RealServer if omitted
+    expect: status codes counted as healthy
+    """
+
+    def __init__(self, path="/", port=None, host=None, expect=(200,)):
+        self.path = path
+        self.port = port
+        self.host = host
+        self.expect = expect
+
+    async def __call__(self, real_server):
+        host, port = _split(real_server)
+        reader, writer = await asyncio.open_connection(host,
+                                                       self.port or port)
+        try:
+            writer.write("GET {0} HTTP/1.0\r\nHost: {1}\r\n"
+                         "Connection: close\r\n\r\n".format(
+                         self.path, self.host or host).encode("ascii"))
+            status = (await reader.readline()).split()
+        finally:
+            await _close(writer)
+        return (len(status) > 1 and status[1].isdigit() and
+                int(status[1]) in self.expect)
+
+
+class _Target(object):
+    """check state of one RealServer
+    """
+
+    __slots__ = ("name", "proto", "service_addr", "real_server", "check",
+                 "interval", "timeout", "rise", "fall", "healthy", "count",
+                 "weight", "due")
+
+    def __init__(self, name, real_server, check, interval, timeout, rise,
+                 fall):
+        self.name = name
+        self.proto, self.service_addr = name.split("_")
+        self.real_server = real_server
+        self.check = check
+        self.interval = interval
+        self.timeout = timeout
+        self.rise = rise
+        self.fall = fall
+        self.healthy = True
+        # consecutive results contradicting the current state
+        self.count = 0
+        # weight to restore, while the RealServer is quiesced
+        self.weight = None
+        self.due = 0
+
+
+class HealthChecker(object):
+    """runs health checks and quiesces failing RealServers
+
+    manager: AsyncLVSManager used to change the weights
+    interval: default seconds between two checks of a RealServer
+    timeout: default seconds a check may take before it counts as failed
+    rise: default number of passed checks to restore a RealServer
+    fall: default number of failed checks to quiesce a RealServer
+    concurrency: maximum number of checks running at the same time
+
+    the original weights are only kept in memory, a RealServer that was
+    quiesced when the checker stopped keeps weight 0
+    """
+
+    def __init__(self, manager, interval=5, timeout=3, rise=2, fall=3,
+                 concurrency=256):
+        self.manager = manager
+        self.interval = interval
+        self.timeout = timeout
+        self.rise = rise
+        self.fall = fall
+        self.concurrency = concurrency
+        self.targets = {}
+        self._task = None
+
+    def add(self, name, real_server, check=None, interval=None, timeout=None,
+            rise=None, fall=None):
+        """check a RealServer
+
+        name: service name, as returned by list_lvs_instances()
+        real_server: ip:port of the RealServer
+        check: TCPCheck, HTTPCheck or a callable taking the real_server
+               and returning (or resolving to) True if it is healthy,
+               TCPCheck() if omitted. Callables that are no coroutine 
+               run in the default executor, so they may block
+        interval, timeout, rise, fall: override the checker defaults
+        """
+        proto, service_addr = name.split("_")
+        _validateservice(proto, service_addr)
+        _validateserver(proto, service_addr, real_server)
+        if check is None:
+            check = TCPCheck()
+        if not callable(check):
+            raise ValueError("check must be callable")
+        target = _Target(name, real_server, check,
+                         interval or self.interval, timeout or self.timeout,
+                         rise or self.rise, fall or self.fall)
+        if target.rise < 1 or target.fall < 1:
+            raise ValueError("rise and fall must be at least 1")
+        self.targets[_servicekey(proto, service_addr) +
+                     (_canonaddr(real_server),)] = target
+        return True
+
+    async def add_service(self, name, check=None, **kwargs):
+        """check all RealServers the service has right now, the keyword
+        arguments are passed to add()
+        """
+        instance = await self.manager.get_lvs_instance(name)
+        for real_server, method, weight in await instance.list_servers():
+            self.add(name, real_server, check, **kwargs)
+        return True
+
+    def remove(self, name, real_server):
+        """stop checking a RealServer, its weight is left as it is
+        """
+        proto, service_addr = name.split("_")
+        self.targets.pop(_servicekey(proto, service_addr) +
+                         (_canonaddr(real_server),), None)
+        return True
+
+    async def _probe(self, target, semaphore):
+        """run the check of a target, exceptions and timeouts count as
+        failed
+        """
+        async with semaphore:
+            try:
+                if _iscoroutine(target.check):
+                    result = target.check(target.real_server)
+                else:
+                    result = asyncio.get_running_loop().run_in_executor(
+                        None, target.check, target.real_server)
+                return bool(await asyncio.wait_for(result, target.timeout))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                return False
+
+    async def run_round(self, now=None):
+        """check all RealServers that are due and apply the changes
+
+        returns a list of (name, real_server, healthy) tuples for the
+        RealServers that changed their state
+        """
+        if now is None:
+            now = time.monotonic()
+        due = [target for target in self.targets.values()
+               if target.due <= now]
+        if not due:
+            return []
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(*[self._probe(target, semaphore)
+                                         for target in due])
+
+        changed = []
+        for target, healthy in zip(due, results):
+            target.due = now + target.interval
+            if healthy == target.healthy:
+                target.count = 0
+                continue
+            target.count += 1
+            if target.count >= (target.rise if healthy else target.fall):
+                changed.append(target)
+        if changed:
+            changed = await self._apply(changed)
+        return [(target.name, target.real_server, target.healthy)
+                for target in changed]
+
+    async def _apply(self, changed):
+        """quiesce or restore the changed targets with one transaction,
+        the targets only change their state once it is committed, those
+        that could not be edited keep it and are tried again
+
+        returns the list of targets that changed their state
+        """
+        snapshot = await self.manager.snapshot(0)
+        weights = {}
+        edited = []
+        async with self.manager.transaction() as txn:
+            for target in changed:
+                server = snapshot.get_real_server(target.proto,
+                    target.service_addr, target.real_server)
+                if server is None:
+                    continue
+                if target.healthy:
+                    weights[target] = server.weight
+                    weight = 0
+                elif target.weight is None:
+                    continue
+                else:
+                    weight = target.weight
+                opts = {"weight": weight}
+                if server.upper is not None:
+                    opts["upper"] = server.upper
+                    if server.lower is not None:
+                        opts["lower"] = server.lower
+                if server.tun_type is not None:
+                    opts.update(tun_type=server.tun_type,
+                                tun_csum=server.tun_csum)
+                    if server.tun_port is not None:
+                        opts["tun_port"] = server.tun_port
+                instance = AsyncLVSInstance(target.service_addr,
+                                            target.proto, txn)
+                await instance.edit_server(str(server.address),
+                                           server.method, **opts)
+                edited.append(target)
+
+        for target in edited:
+            target.healthy = not target.healthy
+            target.count = 0
+            target.weight = weights.get(target)
+        return edited
+
+    async def run(self):
+        """run check rounds until cancelled
+        """
+        while True:
+            try:
+                await self.run_round()
+            except ValueError:
+                # nothing changed its state, the next round retries
+                pass
+            if self.targets:
+                delay = min(target.due for target in self.targets.values())
+                delay = delay - time.monotonic()
+            else:
+                delay = self.interval
+            await asyncio.sleep(max(delay, 0.01))
+
+    def start(self):
+        """run the checker in a background task
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self.run())
+        return self._task
+
+    def stop(self):
+        """cancel the background task
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        return True
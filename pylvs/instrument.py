@@ -0,0 +1,312 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+"""
+instrument.py
+
+timing, counters and hooks for every command a backend runs
+
+all commands of LVSManager and LVSInstance go through the execute, output,
+stream and restore methods of their backend. InstrumentedBackend wraps any
+backend and times every call. It counts the calls, errors and the latency
+histogram per operation, logs slow calls and hands every call to the pre
+and post hooks. pylvs.aio.AsyncInstrumentedBackend does the same for
+asyncio backends.
+
+    >>> import pylvs
+    >>> from pylvs.instrument import InstrumentedBackend
+    >>> backend = InstrumentedBackend(pylvs.IpvsadmBackend(), slow=0.5)
+    >>> backend.add_hook(post=lambda call: print(call.operation, call.duration))
+    >>> manager = pylvs.LVSManager(backend=backend)
+"""
+
+import bisect
+import inspect
+import logging
+import threading
+import time
+
+from .pylvs import IpvsadmBackend
+
+# the ipvsadm action of a command, mapped to the operation it is counted as
+OPERATIONS = {"-A": "add_service", "-E": "edit_service",
+              "-D": "del_service", "-a": "add_server", "-e": "edit_server",
+              "-d": "del_server", "-C": "clear", "-Z": "zero",
+              "--set": "set_timeouts", "--start-daemon": "start_daemon",
+              "--stop-daemon": "stop_daemon"}
+# upper bounds of the latency histogram buckets in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0, 10.0)
+
+_timer = getattr(time, "perf_counter", time.time)
+
+def operation(method, args):
+    """name of the operation of a backend call, the restore method,
+    the ipvsadm action of the others, "dump" for -S and "list" for -L
+    """
+    if method == "restore":
+        return "restore"
+    action = args[0] if args else ""
+    if action in OPERATIONS:
+        return OPERATIONS[action]
+    if action.startswith("-S") or action == "--save":
+        return "dump"
+    if action.startswith("-L") or action in ("-l", "--list"):
+        return "list"
+    return "other"
+
+
+def _isasync(backend):
+    """helper function to tell asyncio backends, their execute method is
+    a coroutine function
+    """
+    iscoroutinefunction = getattr(inspect, "iscoroutinefunction", None)
+    return (iscoroutinefunction is not None and
+            iscoroutinefunction(getattr(backend, "execute", None)))
+
+
+class LVSCall(object):
+    """a single call of a backend method, as passed to the hooks
+
+    method: backend method, execute, output, stream or restore
+    args: ipvsadm arguments, for restore the list of commands
+    operation: see operation()
+    duration: seconds the call took, None for the pre hooks
+    returncode: exit code of ipvsadm, 0 on success, None if unknown
+    stderr: what ipvsadm printed to stderr, the messages of the failed
+            commands for restore
+    error: the exception the call raised, None on success, for restore
+           a ValueError telling how many commands failed
+    """
+
+    __slots__ = ("method", "args", "operation", "duration", "returncode",
+                 "stderr", "error")
+
+    def __init__(self, method, args):
+        self.method = method
+        self.args = args
+        self.operation = operation(method, args)
+        self.duration = None
+        self.returncode = None
+        self.stderr = ""
+        self.error = None
+
+    @property
+    def failed(self):
+        return self.error is not None or bool(self.returncode)
+
+    def __repr__(self):
+        return "LVSCall({0!r}, {1!r}, {2!r})".format(self.method, self.args,
+                                                     self.duration)
+
+
+class OperationStats(object):
+    """calls, errors and latency histogram of one operation
+    """
+
+    __slots__ = ("count", "errors", "seconds", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        # the last bucket counts the calls slower than all BUCKETS
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, duration, failed):
+        self.count += 1
+        if failed:
+            self.errors += 1
+        self.seconds += duration
+        self.buckets[bisect.bisect_left(BUCKETS, duration)] += 1
+
+    def histogram(self):
+        """cumulative (upper bound, count) tuples like Prometheus has
+        them, the last upper bound is infinity
+        """
+        result = []
+        total = 0
+        for bound, count in zip(BUCKETS + (float("inf"),), self.buckets):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def __repr__(self):
+        return "OperationStats(count={0}, errors={1}, seconds={2:.6f})".format(
+               self.count, self.errors, self.seconds)
+
+
+class InstrumentedBackend(object):
+    """backend timing every call of the backend it wraps
+
+    backend: the wrapped backend, IpvsadmBackend if omitted
+    slow: log calls taking at least this many seconds, as a warning
+    logger: where slow calls are logged, the pylvs logger if omitted
+
+    attributes that are not about running commands, like procfs, are
+    those of the wrapped backend. asyncio backends are wrapped by
+    pylvs.aio.AsyncInstrumentedBackend instead
+    """
+
+    def __init__(self, backend=None, slow=None, logger=None):
+        if backend is None:
+            backend = IpvsadmBackend()
+        self._check(backend)
+        if logger is None:
+            logger = logging.getLogger("pylvs")
+        self.backend = backend
+        self.slow = slow
+        self.logger = logger
+        self.pre_hooks = []
+        self.post_hooks = []
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name == "backend":
+            raise AttributeError(name)
+        return getattr(self.backend, name)
+
+    def _check(self, backend):
+        """raise ValueError if backend can not be wrapped
+        """
+        if _isasync(backend):
+            raise ValueError("{0} is an asyncio backend, wrap it with "
+                             "pylvs.aio.AsyncInstrumentedBackend".format(
+                             type(backend).__name__))
+
+    def add_hook(self, pre=None, post=None):
+        """add callables taking a LVSCall, pre ones are called before
+        every call, post ones after it with the duration and the outcome
+        """
+        if pre is not None:
+            self.pre_hooks.append(pre)
+        if post is not None:
+            self.post_hooks.append(post)
+
+    def remove_hook(self, pre=None, post=None):
+        """remove hooks added with add_hook()
+        """
+        if pre is not None:
+            self.pre_hooks.remove(pre)
+        if post is not None:
+            self.post_hooks.remove(post)
+
+    def report(self):
+        """return a dict mapping the operations to a copy of their
+        OperationStats
+        """
+        with self.lock:
+            result = {}
+            for name, stats in self.stats.items():
+                copy = OperationStats()
+                copy.count = stats.count
+                copy.errors = stats.errors
+                copy.seconds = stats.seconds
+                copy.buckets = list(stats.buckets)
+                result[name] = copy
+            return result
+
+    def reset(self):
+        """drop the counters of all operations
+        """
+        with self.lock:
+            self.stats = {}
+
+    def _run_hooks(self, hooks, call):
+        # a broken hook must not break the IPVS management, it is logged
+        for hook in hooks:
+            try:
+                hook(call)
+            except Exception:
+                self.logger.exception("pylvs hook %r failed", hook)
+
+    def _start(self, method, args):
+        call = LVSCall(method, args)
+        self._run_hooks(self.pre_hooks, call)
+        return call, _timer()
+
+    def _failed(self, call, error):
+        call.error = error
+        call.returncode = getattr(error, "returncode", None)
+        call.stderr = getattr(error, "stderr", None) or str(error)
+
+    def _finish(self, call, start):
+        call.duration = _timer() - start
+        if call.error is None and call.returncode is None:
+            call.returncode = 0
+        with self.lock:
+            stats = self.stats.get(call.operation)
+            if stats is None:
+                stats = self.stats[call.operation] = OperationStats()
+            stats.observe(call.duration, call.failed)
+        if self.slow is not None and call.duration >= self.slow:
+            self.logger.warning("slow IPVS %s call: %.3fs: %s",
+                                call.operation, call.duration,
+                                " ".join(call.args) if call.method != "restore"
+                                else "{0} commands".format(len(call.args)))
+        self._run_hooks(self.post_hooks, call)
+
+    def _restored(self, call, commands, failed):
+        """record the commands a restore call could not apply, returns
+        failed
+        """
+        if failed:
+            call.error = ValueError("{0} of {1} commands failed".format(
+                                    len(failed), len(commands)))
+            call.stderr = "\n".join(message for index, message in failed)
+        return failed
+
+    def _call(self, method, args):
+        call, start = self._start(method, args)
+        try:
+            return getattr(self.backend, method)(args)
+        except ValueError as error:
+            self._failed(call, error)
+            raise
+        finally:
+            self._finish(call, start)
+
+    def execute(self, args):
+        """run a command that changes the IPVS table
+        """
+        return self._call("execute", args)
+
+    def output(self, args):
+        """run a command and return what it printed
+        """
+        return self._call("output", args)
+
+    def stream(self, args):
+        """yield the output of a command line by line, the call lasts
+        until the last line was read
+        """
+        call, start = self._start("stream", args)
+        try:
+            stream = getattr(self.backend, "stream", None)
+            if stream is None:
+                lines = self.backend.output(args).splitlines()
+            else:
+                lines = stream(args)
+            for line in lines:
+                yield line
+        except ValueError as error:
+            self._failed(call, error)
+            raise
+        finally:
+            self._finish(call, start)
+
+    def restore(self, commands):
+        """apply a list of commands, see IpvsadmBackend.restore()
+        """
+        call, start = self._start("restore", commands)
+        try:
+            return self._restored(call, commands,
+                                  self.backend.restore(commands))
+        except ValueError as error:
+            self._failed(call, error)
+            raise
+        finally:
+            self._finish(call, start)
@@ -0,0 +1,1230 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+"""
+netlink.py
+
+pure python generic netlink client for the IPVS family
+
+NetlinkBackend can be passed to LVSManager in place of the default
+IpvsadmBackend, it talks to the kernel directly instead of forking ipvsadm
+for every command. Commands it does not know are handed to a fallback
+backend, which is the ipvsadm one by default.
+
+    >>> import pylvs
+    >>> from pylvs.netlink import NetlinkBackend
+    >>> manager = pylvs.LVSManager(backend=NetlinkBackend())
+"""
+
+import errno
+import os
+import socket
+import struct
+
+from .pylvs import IpvsadmBackend
+
+NETLINK_GENERIC = 16
+
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_ACK = 0x4
+NLM_F_DUMP = 0x300
+
+NLMSG_NOOP = 0x1
+NLMSG_ERROR = 0x2
+NLMSG_DONE = 0x3
+
+NLA_F_NESTED = 0x8000
+NLA_TYPE_MASK = 0x3fff
+
+GENL_ID_CTRL = 0x10
+CTRL_CMD_NEWFAMILY = 1
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+
+IPVS_GENL_NAME = "IPVS"
+IPVS_GENL_VERSION = 0x1
+
+# commands, see linux/ip_vs.h
+IPVS_CMD_NEW_SERVICE = 1
+IPVS_CMD_SET_SERVICE = 2
+IPVS_CMD_DEL_SERVICE = 3
+IPVS_CMD_GET_SERVICE = 4
+IPVS_CMD_NEW_DEST = 5
+IPVS_CMD_SET_DEST = 6
+IPVS_CMD_DEL_DEST = 7
+IPVS_CMD_GET_DEST = 8
+IPVS_CMD_NEW_DAEMON = 9
+IPVS_CMD_DEL_DAEMON = 10
+IPVS_CMD_GET_DAEMON = 11
+IPVS_CMD_SET_CONFIG = 12
+IPVS_CMD_GET_CONFIG = 13
+IPVS_CMD_SET_INFO = 14
+IPVS_CMD_GET_INFO = 15
+IPVS_CMD_ZERO = 16
+IPVS_CMD_FLUSH = 17
+
+# attributes of a command
+IPVS_CMD_ATTR_SERVICE = 1
+IPVS_CMD_ATTR_DEST = 2
+IPVS_CMD_ATTR_DAEMON = 3
+IPVS_CMD_ATTR_TIMEOUT_TCP = 4
+IPVS_CMD_ATTR_TIMEOUT_TCP_FIN = 5
+IPVS_CMD_ATTR_TIMEOUT_UDP = 6
+
+# attributes of a service
+IPVS_SVC_ATTR_AF = 1
+IPVS_SVC_ATTR_PROTOCOL = 2
+IPVS_SVC_ATTR_ADDR = 3
+IPVS_SVC_ATTR_PORT = 4
+IPVS_SVC_ATTR_FWMARK = 5
+IPVS_SVC_ATTR_SCHED_NAME = 6
+IPVS_SVC_ATTR_FLAGS = 7
+IPVS_SVC_ATTR_TIMEOUT = 8
+IPVS_SVC_ATTR_NETMASK = 9
+IPVS_SVC_ATTR_STATS = 10
+IPVS_SVC_ATTR_PE_NAME = 11
+IPVS_SVC_ATTR_STATS64 = 12
+
+# attributes of a destination (RealServer)
+IPVS_DEST_ATTR_ADDR = 1
+IPVS_DEST_ATTR_PORT = 2
+IPVS_DEST_ATTR_FWD_METHOD = 3
+IPVS_DEST_ATTR_WEIGHT = 4
+IPVS_DEST_ATTR_U_THRESH = 5
+IPVS_DEST_ATTR_L_THRESH = 6
+IPVS_DEST_ATTR_ACTIVE_CONNS = 7
+IPVS_DEST_ATTR_INACT_CONNS = 8
+IPVS_DEST_ATTR_PERSIST_CONNS = 9
+IPVS_DEST_ATTR_STATS = 10
+IPVS_DEST_ATTR_ADDR_FAMILY = 11
+IPVS_DEST_ATTR_STATS64 = 12
+IPVS_DEST_ATTR_TUN_TYPE = 13
+IPVS_DEST_ATTR_TUN_PORT = 14
+IPVS_DEST_ATTR_TUN_FLAGS = 15
+
+# attributes of the statistics
+IPVS_STATS_ATTR_CONNS = 1
+IPVS_STATS_ATTR_INPKTS = 2
+IPVS_STATS_ATTR_OUTPKTS = 3
+IPVS_STATS_ATTR_INBYTES = 4
+IPVS_STATS_ATTR_OUTBYTES = 5
+IPVS_STATS_ATTR_CPS = 6
+IPVS_STATS_ATTR_INPPS = 7
+IPVS_STATS_ATTR_OUTPPS = 8
+IPVS_STATS_ATTR_INBPS = 9
+IPVS_STATS_ATTR_OUTBPS = 10
+
+# attributes of the info command
+IPVS_INFO_ATTR_VERSION = 1
+IPVS_INFO_ATTR_CONN_TAB_SIZE = 2
+
+# attributes of a sync daemon
+IPVS_DAEMON_ATTR_STATE = 1
+IPVS_DAEMON_ATTR_MCAST_IFN = 2
+IPVS_DAEMON_ATTR_SYNC_ID = 3
+IPVS_DAEMON_ATTR_SYNC_MAXLEN = 4
+IPVS_DAEMON_ATTR_MCAST_GROUP = 5
+IPVS_DAEMON_ATTR_MCAST_GROUP6 = 6
+IPVS_DAEMON_ATTR_MCAST_PORT = 7
+IPVS_DAEMON_ATTR_MCAST_TTL = 8
+
+IP_VS_STATE_MASTER = 0x1
+IP_VS_STATE_BACKUP = 0x2
+
+IP_VS_CONN_F_MASQ = 0
+IP_VS_CONN_F_TUNNEL = 2
+IP_VS_CONN_F_DROUTE = 3
+IP_VS_CONN_F_FWD_MASK = 0x7
+
+IP_VS_CONN_F_TUNNEL_TYPE_IPIP = 0
+IP_VS_CONN_F_TUNNEL_TYPE_GUE = 1
+IP_VS_CONN_F_TUNNEL_TYPE_GRE = 2
+IP_VS_TUNNEL_ENCAP_FLAG_NOCSUM = 0
+IP_VS_TUNNEL_ENCAP_FLAG_CSUM = 0x1
+IP_VS_TUNNEL_ENCAP_FLAG_REMCSUM = 0x2
+
+TUN_TYPES = {"ipip": IP_VS_CONN_F_TUNNEL_TYPE_IPIP,
+             "gue": IP_VS_CONN_F_TUNNEL_TYPE_GUE,
+             "gre": IP_VS_CONN_F_TUNNEL_TYPE_GRE}
+TUN_FLAGS = {"--tun-nocsum": IP_VS_TUNNEL_ENCAP_FLAG_NOCSUM,
+             "--tun-csum": IP_VS_TUNNEL_ENCAP_FLAG_CSUM,
+             "--tun-remcsum": IP_VS_TUNNEL_ENCAP_FLAG_REMCSUM}
+
+IP_VS_SVC_F_PERSISTENT = 0x1
+IP_VS_SVC_F_SCHED1 = 0x8
+IP_VS_SVC_F_SCHED2 = 0x10
+IP_VS_SVC_F_SCHED3 = 0x20
+# scheduler flags, named like ipvsadm does for sh and mh, and as flag-N
+# for the others
+SCHED_FLAGS = ((IP_VS_SVC_F_SCHED1, "fallback"), (IP_VS_SVC_F_SCHED2, "port"),
+               (IP_VS_SVC_F_SCHED3, None))
+
+IPPROTO_SCTP = 132
+
+PROTOCOLS = {"-t": socket.IPPROTO_TCP, "-u": socket.IPPROTO_UDP,
+             "--sctp-service": IPPROTO_SCTP}
+FWD_METHODS = {"-m": IP_VS_CONN_F_MASQ, "-i": IP_VS_CONN_F_TUNNEL,
+               "-g": IP_VS_CONN_F_DROUTE}
+FWD_NAMES = {IP_VS_CONN_F_MASQ: "Masq", 1: "Local", IP_VS_CONN_F_TUNNEL: 
+             "Tunnel", IP_VS_CONN_F_DROUTE: "Route", 4: "Bypass"}
+LIST_NAMES = {socket.IPPROTO_TCP: "TCP", socket.IPPROTO_UDP: "UDP",
+              IPPROTO_SCTP: "SCTP"}
+
+DAEMON_STATES = {"master": IP_VS_STATE_MASTER, "backup": IP_VS_STATE_BACKUP}
+# ipvsadm option, daemon dict key, lowest and highest value
+DAEMON_OPTIONS = (("--mcast-interface", "mcast_ifn", None, None),
+                  ("--syncid", "syncid", 0, 255),
+                  ("--sync-maxlen", "sync_maxlen", 1, 65507),
+                  ("--mcast-group", "mcast_group", None, None),
+                  ("--mcast-port", "mcast_port", 1, 65535),
+                  ("--mcast-ttl", "mcast_ttl", 1, 255))
+
+STATS = ((IPVS_STATS_ATTR_CONNS, "conns"),
+         (IPVS_STATS_ATTR_INPKTS, "inpkts"),
+         (IPVS_STATS_ATTR_OUTPKTS, "outpkts"),
+         (IPVS_STATS_ATTR_INBYTES, "inbytes"),
+         (IPVS_STATS_ATTR_OUTBYTES, "outbytes"),
+         (IPVS_STATS_ATTR_CPS, "cps"),
+         (IPVS_STATS_ATTR_INPPS, "inpps"),
+         (IPVS_STATS_ATTR_OUTPPS, "outpps"),
+         (IPVS_STATS_ATTR_INBPS, "inbps"),
+         (IPVS_STATS_ATTR_OUTBPS, "outbps"))
+
+DEFAULT_SCHEDULER = "wlc"
+DEFAULT_PERSISTENCE = 300
+
+_NLMSGHDR = struct.Struct("=IHHII")
+_GENLMSGHDR = struct.Struct("=BBH")
+_NLATTR = struct.Struct("=HH")
+_NLMSGERR = struct.Struct("=i")
+
+_ERRORS = {
+    (IPVS_CMD_NEW_SERVICE, errno.EEXIST): "Service already exists",
+    (IPVS_CMD_NEW_SERVICE, errno.ENOENT): "Scheduler not found",
+    (IPVS_CMD_SET_SERVICE, errno.ESRCH): "No such service",
+    (IPVS_CMD_SET_SERVICE, errno.ENOENT): "Scheduler not found",
+    (IPVS_CMD_DEL_SERVICE, errno.ESRCH): "No such service",
+    (IPVS_CMD_ZERO, errno.ESRCH): "No such service",
+    (IPVS_CMD_NEW_DEST, errno.EEXIST): "Destination already exists",
+    (IPVS_CMD_NEW_DEST, errno.ESRCH): "Service not defined",
+    (IPVS_CMD_SET_DEST, errno.ESRCH): "Service not defined",
+    (IPVS_CMD_SET_DEST, errno.ENOENT): "No such destination",
+    (IPVS_CMD_DEL_DEST, errno.ESRCH): "Service not defined",
+    (IPVS_CMD_DEL_DEST, errno.ENOENT): "No such destination",
+    (IPVS_CMD_NEW_DAEMON, errno.EEXIST): "Daemon has already run",
+    (IPVS_CMD_DEL_DAEMON, errno.ESRCH): "No daemon is running",
+}
+
+def _strerror(cmd, error):
+    """helper function to get an ipvsadm like message for a kernel error
+    """
+    return _ERRORS.get((cmd, error)) or os.strerror(error)
+
+def _align(length):
+    """netlink messages and attributes are aligned to 4 bytes
+    """
+    return (length + 3) & ~3
+
+def attr(atype, data):
+    """build a netlink attribute
+    """
+    length = _NLATTR.size + len(data)
+    return (_NLATTR.pack(length, atype) + data +
+            b"\0" * (_align(length) - length))
+
+def nested(atype, attrs):
+    """build a nested netlink attribute from a list of attributes
+    """
+    return attr(atype | NLA_F_NESTED, b"".join(attrs))
+
+def parse_attrs(data):
+    """parse netlink attributes, returns a dict mapping type to payload
+    """
+    attrs = {}
+    offset = 0
+    while offset + _NLATTR.size <= len(data):
+        length, atype = _NLATTR.unpack_from(data, offset)
+        if length < _NLATTR.size:
+            break
+        attrs[atype & NLA_TYPE_MASK] = data[offset + _NLATTR.size:
+                                            offset + length]
+        offset += _align(length)
+    return attrs
+
+def build_message(msg_type, cmd, attrs=(), flags=NLM_F_REQUEST, seq=0,
+                  pid=0):
+    """build a generic netlink message
+    """
+    payload = _GENLMSGHDR.pack(cmd, IPVS_GENL_VERSION, 0) + b"".join(attrs)
+    return _NLMSGHDR.pack(_NLMSGHDR.size + len(payload), msg_type, flags,
+                          seq, pid) + payload
+
+def parse_messages(data):
+    """parse a buffer received from a netlink socket
+
+    yields (msg_type, flags, seq, payload) tuples, payload still includes
+    the generic netlink header
+    """
+    offset = 0
+    while offset + _NLMSGHDR.size <= len(data):
+        length, msg_type, flags, seq, pid = _NLMSGHDR.unpack_from(data, offset)
+        if length < _NLMSGHDR.size:
+            break
+        yield msg_type, flags, seq, data[offset + _NLMSGHDR.size:
+                                         offset + length]
+        offset += _align(length)
+
+def _u8(value):
+    return struct.pack("=B", value)
+
+def _u16(value):
+    return struct.pack("=H", value)
+
+def _u32(value):
+    return struct.pack("=I", value)
+
+def _be16(value):
+    return struct.pack("!H", value)
+
+def _string(value):
+    return value.encode("ascii") + b"\0"
+
+def _get_u8(data):
+    return struct.unpack("=B", data[:1])[0]
+
+def _get_u16(data):
+    return struct.unpack("=H", data[:2])[0]
+
+def _get_u32(data):
+    return struct.unpack("=I", data[:4])[0]
+
+def _get_u64(data):
+    return struct.unpack("=Q", data[:8])[0]
+
+def _get_be16(data):
+    return struct.unpack("!H", data[:2])[0]
+
+def _get_string(data):
+    return data.split(b"\0", 1)[0].decode("ascii")
+
+def _parse_addr(addr):
+    """split ip:port into (af, packed address, port)
+    """
+    ipaddr, port = addr.rsplit(':', 1)
+    if ipaddr.startswith("["):
+        af = socket.AF_INET6
+        ipaddr = ipaddr[1:-1]
+    else:
+        af = socket.AF_INET
+    try:
+        return af, socket.inet_pton(af, ipaddr), int(port)
+    except (socket.error, ValueError):
+        raise ValueError("invalid address: {0}".format(addr))
+
+def _format_addr(af, packed, port):
+    """format an address the way ipvsadm -Sn prints it
+    """
+    if af == socket.AF_INET6:
+        return "[{0}]:{1}".format(socket.inet_ntop(af, packed[:16]), port)
+    return "{0}:{1}".format(socket.inet_ntop(af, packed[:4]), port)
+
+def _decode_stats(data, wide):
+    """decode a nested stats attribute into a dict
+    """
+    attrs = parse_attrs(data)
+    if wide:
+        getter = _get_u64
+    else:
+        getter = _get_u32
+    stats = {}
+    for atype, name in STATS:
+        if atype in attrs:
+            if not wide and atype in (IPVS_STATS_ATTR_INBYTES,
+                                      IPVS_STATS_ATTR_OUTBYTES):
+                stats[name] = _get_u64(attrs[atype])
+            else:
+                stats[name] = getter(attrs[atype])
+    return stats
+
+def decode_service(data):
+    """decode a nested service attribute into a dict
+    """
+    attrs = parse_attrs(data)
+    af = _get_u16(attrs[IPVS_SVC_ATTR_AF])
+    service = {"af": af, "protocol": 0, "addr": None, "port": 0,
+               "fwmark": 0}
+    if IPVS_SVC_ATTR_FWMARK in attrs:
+        service["fwmark"] = _get_u32(attrs[IPVS_SVC_ATTR_FWMARK])
+    if IPVS_SVC_ATTR_PROTOCOL in attrs:
+        service["protocol"] = _get_u16(attrs[IPVS_SVC_ATTR_PROTOCOL])
+    if IPVS_SVC_ATTR_ADDR in attrs:
+        if af == socket.AF_INET6:
+            service["addr"] = attrs[IPVS_SVC_ATTR_ADDR][:16]
+        else:
+            service["addr"] = attrs[IPVS_SVC_ATTR_ADDR][:4]
+    if IPVS_SVC_ATTR_PORT in attrs:
+        service["port"] = _get_be16(attrs[IPVS_SVC_ATTR_PORT])
+    if IPVS_SVC_ATTR_SCHED_NAME in attrs:
+        service["sched_name"] = _get_string(attrs[IPVS_SVC_ATTR_SCHED_NAME])
+    if IPVS_SVC_ATTR_FLAGS in attrs:
+        service["flags"] = _get_u32(attrs[IPVS_SVC_ATTR_FLAGS])
+    if IPVS_SVC_ATTR_TIMEOUT in attrs:
+        service["timeout"] = _get_u32(attrs[IPVS_SVC_ATTR_TIMEOUT])
+    if IPVS_SVC_ATTR_NETMASK in attrs:
+        service["netmask"] = _get_u32(attrs[IPVS_SVC_ATTR_NETMASK])
+    if IPVS_SVC_ATTR_STATS64 in attrs:
+        service["stats"] = _decode_stats(attrs[IPVS_SVC_ATTR_STATS64], True)
+    elif IPVS_SVC_ATTR_STATS in attrs:
+        service["stats"] = _decode_stats(attrs[IPVS_SVC_ATTR_STATS], False)
+    return service
+
+def decode_dest(data, af):
+    """decode a nested destination attribute into a dict
+
+    af: address family of the service, used if the kernel does not send
+        the address family of the destination
+    """
+    attrs = parse_attrs(data)
+    if IPVS_DEST_ATTR_ADDR_FAMILY in attrs:
+        af = _get_u16(attrs[IPVS_DEST_ATTR_ADDR_FAMILY])
+    if af == socket.AF_INET6:
+        addr = attrs[IPVS_DEST_ATTR_ADDR][:16]
+    else:
+        addr = attrs[IPVS_DEST_ATTR_ADDR][:4]
+    dest = {"af": af, "addr": addr,
+            "port": _get_be16(attrs[IPVS_DEST_ATTR_PORT])}
+    for atype, name in ((IPVS_DEST_ATTR_FWD_METHOD, "fwd_method"),
+                        (IPVS_DEST_ATTR_WEIGHT, "weight"),
+                        (IPVS_DEST_ATTR_U_THRESH, "u_thresh"),
+                        (IPVS_DEST_ATTR_L_THRESH, "l_thresh"),
+                        (IPVS_DEST_ATTR_ACTIVE_CONNS, "active_conns"),
+                        (IPVS_DEST_ATTR_INACT_CONNS, "inact_conns"),
+                        (IPVS_DEST_ATTR_PERSIST_CONNS, "persist_conns")):
+        if atype in attrs:
+            dest[name] = _get_u32(attrs[atype])
+    if "fwd_method" in dest:
+        dest["fwd_method"] &= IP_VS_CONN_F_FWD_MASK
+    if IPVS_DEST_ATTR_TUN_TYPE in attrs:
+        dest["tun_type"] = _get_u8(attrs[IPVS_DEST_ATTR_TUN_TYPE])
+    if IPVS_DEST_ATTR_TUN_PORT in attrs:
+        dest["tun_port"] = _get_be16(attrs[IPVS_DEST_ATTR_TUN_PORT])
+    if IPVS_DEST_ATTR_TUN_FLAGS in attrs:
+        dest["tun_flags"] = _get_u16(attrs[IPVS_DEST_ATTR_TUN_FLAGS])
+    if IPVS_DEST_ATTR_STATS64 in attrs:
+        dest["stats"] = _decode_stats(attrs[IPVS_DEST_ATTR_STATS64], True)
+    elif IPVS_DEST_ATTR_STATS in attrs:
+        dest["stats"] = _decode_stats(attrs[IPVS_DEST_ATTR_STATS], False)
+    return dest
+
+def encode_service(service, full=True):
+    """encode a service dict into a nested service attribute
+
+    full: include scheduler, flags, timeout and netmask, the kernel wants
+          them for new and changed services
+    """
+    af = service["af"]
+    attrs = [attr(IPVS_SVC_ATTR_AF, _u16(af))]
+    if service.get("fwmark"):
+        attrs.append(attr(IPVS_SVC_ATTR_FWMARK, _u32(service["fwmark"])))
+    else:
+        attrs.append(attr(IPVS_SVC_ATTR_PROTOCOL,
+                          _u16(service["protocol"])))
+        attrs.append(attr(IPVS_SVC_ATTR_ADDR, service["addr"].ljust(16, b"\0")))
+        attrs.append(attr(IPVS_SVC_ATTR_PORT, _be16(service["port"])))
+    if full:
+        if af == socket.AF_INET6:
+            netmask = 128
+        else:
+            netmask = 0xffffffff
+        attrs.append(attr(IPVS_SVC_ATTR_SCHED_NAME,
+            _string(service.get("sched_name", DEFAULT_SCHEDULER))))
+        attrs.append(attr(IPVS_SVC_ATTR_FLAGS,
+            struct.pack("=II", service.get("flags", 0), 0xffffffff)))
+        attrs.append(attr(IPVS_SVC_ATTR_TIMEOUT,
+                          _u32(service.get("timeout", 0))))
+        attrs.append(attr(IPVS_SVC_ATTR_NETMASK,
+                          _u32(service.get("netmask", netmask))))
+    return nested(IPVS_CMD_ATTR_SERVICE, attrs)
+
+def encode_dest(dest, full=True):
+    """encode a destination dict into a nested destination attribute
+
+    full: include forwarding method, weight and thresholds, the kernel
+          wants them for new and changed destinations
+    """
+    attrs = [attr(IPVS_DEST_ATTR_ADDR, dest["addr"].ljust(16, b"\0")),
+             attr(IPVS_DEST_ATTR_PORT, _be16(dest["port"])),
+             attr(IPVS_DEST_ATTR_ADDR_FAMILY, _u16(dest["af"]))]
+    if full:
+        attrs.append(attr(IPVS_DEST_ATTR_FWD_METHOD,
+            _u32(dest.get("fwd_method", IP_VS_CONN_F_DROUTE))))
+        attrs.append(attr(IPVS_DEST_ATTR_WEIGHT, _u32(dest.get("weight", 1))))
+        attrs.append(attr(IPVS_DEST_ATTR_U_THRESH,
+                          _u32(dest.get("u_thresh", 0))))
+        attrs.append(attr(IPVS_DEST_ATTR_L_THRESH,
+                          _u32(dest.get("l_thresh", 0))))
+        # kernels before 5.3 do not know the tunnel attributes
+        if "tun_type" in dest:
+            attrs.append(attr(IPVS_DEST_ATTR_TUN_TYPE, _u8(dest["tun_type"])))
+            attrs.append(attr(IPVS_DEST_ATTR_TUN_PORT,
+                              _be16(dest.get("tun_port", 0))))
+            attrs.append(attr(IPVS_DEST_ATTR_TUN_FLAGS,
+                              _u16(dest.get("tun_flags", 0))))
+    return nested(IPVS_CMD_ATTR_DEST, attrs)
+
+def format_service(service):
+    """format a service dict the way ipvsadm -Sn prints it
+    """
+    af = service["af"]
+    if service.get("fwmark"):
+        line = "-A -f {0}".format(service["fwmark"])
+        if af == socket.AF_INET6:
+            line += " -6"
+    else:
+        line = "-A {0} {1}".format(_service_flag(service),
+            _format_addr(af, service["addr"], service["port"]))
+    line += " -s {0}".format(service.get("sched_name", DEFAULT_SCHEDULER))
+    sched_flags = _format_sched_flags(service)
+    if sched_flags:
+        line += " -b {0}".format(sched_flags)
+    if service.get("flags", 0) & IP_VS_SVC_F_PERSISTENT:
+        line += " -p {0}".format(service.get("timeout", 0))
+        netmask = service.get("netmask")
+        if af == socket.AF_INET and netmask not in (None, 0xffffffff):
+            line += " -M {0}".format(socket.inet_ntoa(_u32(netmask)))
+        elif af == socket.AF_INET6 and netmask not in (None, 128):
+            line += " -M {0}".format(netmask)
+    return line
+
+def _format_sched_flags(service):
+    """helper function to get the scheduler flags of a service the way
+    ipvsadm prints them, like sh-fallback,sh-port, None if there are none
+    """
+    sched_name = service.get("sched_name", DEFAULT_SCHEDULER)
+    names = []
+    for index, (flag, name) in enumerate(SCHED_FLAGS):
+        if not service.get("flags", 0) & flag:
+            continue
+        if name is not None and sched_name in ("sh", "mh"):
+            names.append("{0}-{1}".format(sched_name, name))
+        else:
+            names.append("flag-{0}".format(index + 1))
+    return ",".join(names) or None
+
+def _parse_sched_flags(value):
+    """helper function to get the flag bits of ipvsadm -b flags
+    """
+    flags = 0
+    for name in value.split(","):
+        for index, (flag, suffix) in enumerate(SCHED_FLAGS):
+            if name == "flag-{0}".format(index + 1) or (suffix is not None
+                    and name in ("sh-" + suffix, "mh-" + suffix)):
+                flags |= flag
+                break
+        else:
+            raise ValueError("invalid scheduler flag `{0}'".format(name))
+    return flags
+
+def format_dest(service, dest):
+    """format a destination dict the way ipvsadm -Sn prints it
+    """
+    if service.get("fwmark"):
+        name = "-f {0}".format(service["fwmark"])
+        if service["af"] == socket.AF_INET6:
+            name += " -6"
+    else:
+        name = "{0} {1}".format(_service_flag(service),
+            _format_addr(service["af"], service["addr"], service["port"]))
+    for flag, method in FWD_METHODS.items():
+        if method == dest.get("fwd_method", IP_VS_CONN_F_DROUTE):
+            break
+    else:
+        flag = "-g"
+    line = "-a {0} -r {1} {2} -w {3}".format(name,
+        _format_addr(dest["af"], dest["addr"], dest["port"]), flag,
+        dest.get("weight", 1))
+    if dest.get("u_thresh"):
+        line += " -x {0}".format(dest["u_thresh"])
+    if dest.get("l_thresh"):
+        line += " -y {0}".format(dest["l_thresh"])
+    tun_type = dest.get("tun_type", IP_VS_CONN_F_TUNNEL_TYPE_IPIP)
+    if (dest.get("fwd_method") == IP_VS_CONN_F_TUNNEL and
+            tun_type != IP_VS_CONN_F_TUNNEL_TYPE_IPIP):
+        for name, value in TUN_TYPES.items():
+            if value == tun_type:
+                line += " --tun-type {0}".format(name)
+        if tun_type == IP_VS_CONN_F_TUNNEL_TYPE_GUE:
+            line += " --tun-port {0}".format(dest.get("tun_port", 0))
+        flags = dest.get("tun_flags", 0)
+        if flags & IP_VS_TUNNEL_ENCAP_FLAG_REMCSUM:
+            line += " --tun-remcsum"
+        elif flags & IP_VS_TUNNEL_ENCAP_FLAG_CSUM:
+            line += " --tun-csum"
+        else:
+            line += " --tun-nocsum"
+    return line
+
+def format_listing(entries, info, fmt=None):
+    """format services the way ipvsadm -Ln prints them
+
+    entries: list of (service, dests) tuples
+    info: dict as returned by NetlinkBackend.get_info()
+    fmt: None for the connections, "stats" for the counters and "rate"
+         for the rates
+    """
+    lines = ["IP Virtual Server version {0} (size={1})".format(
+             info["version"], info["conn_tab_size"])]
+    if fmt == "stats":
+        names = [name for atype, name in STATS[:5]]
+        lines.append("Prot LocalAddress:Port               Conns   InPkts  "
+                     "OutPkts  InBytes OutBytes")
+        lines.append("  -> RemoteAddress:Port")
+    elif fmt == "rate":
+        names = [name for atype, name in STATS[5:]]
+        lines.append("Prot LocalAddress:Port                 CPS    InPPS   "
+                     "OutPPS    InBPS   OutBPS")
+        lines.append("  -> RemoteAddress:Port")
+    else:
+        lines.append("Prot LocalAddress:Port Scheduler Flags")
+        lines.append("  -> RemoteAddress:Port           Forward Weight "
+                     "ActiveConn InActConn")
+
+    for service, dests in entries:
+        if service.get("fwmark"):
+            name = "FWM  {0}".format(service["fwmark"])
+            if service["af"] == socket.AF_INET6:
+                name += " IPv6"
+        else:
+            name = "{0}  {1}".format(LIST_NAMES[service["protocol"]],
+                _format_addr(service["af"], service["addr"], service["port"]))
+        if fmt:
+            stats = service.get("stats", {})
+            lines.append("{0:<33}".format(name) + "".join(
+                " {0:>8}".format(stats.get(key, 0)) for key in names))
+        else:
+            line = "{0} {1}".format(name, service.get("sched_name",
+                                                      DEFAULT_SCHEDULER))
+            sched_flags = _format_sched_flags(service)
+            if sched_flags:
+                line += " ({0})".format(sched_flags)
+            if service.get("flags", 0) & IP_VS_SVC_F_PERSISTENT:
+                line += " persistent {0}".format(service.get("timeout", 0))
+            lines.append(line)
+        for dest in dests:
+            address = _format_addr(dest["af"], dest["addr"], dest["port"])
+            if fmt:
+                stats = dest.get("stats", {})
+                lines.append("  -> {0:<28}".format(address) + "".join(
+                    " {0:>8}".format(stats.get(key, 0)) for key in names))
+            else:
+                lines.append("  -> {0:<28} {1:<7} {2:<6} {3:<10} {4:<10}"
+                    .format(address, FWD_NAMES.get(dest.get("fwd_method"),
+                    "Route"), dest.get("weight", 1),
+                    dest.get("active_conns", 0), dest.get("inact_conns", 0)))
+    return "".join(line + "\n" for line in lines)
+
+def encode_daemon(daemon, full=True):
+    """encode a sync daemon dict into a nested daemon attribute
+
+    full: include interface, syncid and the multicast settings, the
+          kernel wants them to start a daemon
+    """
+    attrs = [attr(IPVS_DAEMON_ATTR_STATE, _u32(daemon["state"]))]
+    if full:
+        attrs.append(attr(IPVS_DAEMON_ATTR_MCAST_IFN,
+                          _string(daemon["mcast_ifn"])))
+        attrs.append(attr(IPVS_DAEMON_ATTR_SYNC_ID,
+                          _u32(daemon.get("syncid", 0))))
+        if daemon.get("sync_maxlen"):
+            attrs.append(attr(IPVS_DAEMON_ATTR_SYNC_MAXLEN,
+                              _u16(daemon["sync_maxlen"])))
+        group = daemon.get("mcast_group")
+        if group and ":" in group:
+            attrs.append(attr(IPVS_DAEMON_ATTR_MCAST_GROUP6,
+                              socket.inet_pton(socket.AF_INET6, group)))
+        elif group:
+            attrs.append(attr(IPVS_DAEMON_ATTR_MCAST_GROUP,
+                              socket.inet_aton(group)))
+        if daemon.get("mcast_port"):
+            attrs.append(attr(IPVS_DAEMON_ATTR_MCAST_PORT,
+                              _be16(daemon["mcast_port"])))
+        if daemon.get("mcast_ttl"):
+            attrs.append(attr(IPVS_DAEMON_ATTR_MCAST_TTL,
+                              _u8(daemon["mcast_ttl"])))
+    return nested(IPVS_CMD_ATTR_DAEMON, attrs)
+
+def decode_daemon(data):
+    """decode a nested daemon attribute into a dict
+    """
+    attrs = parse_attrs(data)
+    daemon = {"state": _get_u32(attrs[IPVS_DAEMON_ATTR_STATE]),
+              "mcast_ifn": _get_string(attrs[IPVS_DAEMON_ATTR_MCAST_IFN]),
+              "syncid": _get_u32(attrs[IPVS_DAEMON_ATTR_SYNC_ID])}
+    if IPVS_DAEMON_ATTR_SYNC_MAXLEN in attrs:
+        daemon["sync_maxlen"] = _get_u16(attrs[IPVS_DAEMON_ATTR_SYNC_MAXLEN])
+    if IPVS_DAEMON_ATTR_MCAST_GROUP6 in attrs:
+        daemon["mcast_group"] = socket.inet_ntop(socket.AF_INET6,
+            attrs[IPVS_DAEMON_ATTR_MCAST_GROUP6][:16])
+    elif IPVS_DAEMON_ATTR_MCAST_GROUP in attrs:
+        daemon["mcast_group"] = socket.inet_ntoa(
+            attrs[IPVS_DAEMON_ATTR_MCAST_GROUP][:4])
+    if IPVS_DAEMON_ATTR_MCAST_PORT in attrs:
+        daemon["mcast_port"] = _get_be16(attrs[IPVS_DAEMON_ATTR_MCAST_PORT])
+    if IPVS_DAEMON_ATTR_MCAST_TTL in attrs:
+        daemon["mcast_ttl"] = struct.unpack("=B",
+            attrs[IPVS_DAEMON_ATTR_MCAST_TTL][:1])[0]
+    return daemon
+
+def format_daemons(daemons):
+    """format sync daemon dicts the way ipvsadm -L --daemon prints them
+    """
+    lines = []
+    for daemon in sorted(daemons, key=lambda daemon: daemon["state"]):
+        for name, state in sorted(DAEMON_STATES.items(),
+                                  key=lambda item: item[1]):
+            if not daemon["state"] & state:
+                continue
+            line = "{0} sync daemon (mcast={1}, syncid={2}".format(name,
+                daemon["mcast_ifn"], daemon["syncid"])
+            for key, label in (("sync_maxlen", "maxlen"),
+                               ("mcast_group", "group"),
+                               ("mcast_port", "port"),
+                               ("mcast_ttl", "ttl")):
+                if daemon.get(key):
+                    line += ", {0}={1}".format(label, daemon[key])
+            lines.append(line + ")")
+    return "".join(line + "\n" for line in lines)
+
+def _parse_daemon_command(args):
+    """translate --start-daemon and --stop-daemon arguments into a
+    netlink command
+    """
+    action = args[0]
+    if len(args) < 2 or args[1] not in DAEMON_STATES:
+        raise ValueError("illegal {0} parameter specified".format(action[2:]))
+    daemon = {"state": DAEMON_STATES[args[1]]}
+    options = dict((option, (key, low, high))
+                   for option, key, low, high in DAEMON_OPTIONS)
+    index = 2
+    while index < len(args):
+        option = args[index]
+        if option not in options:
+            raise NotImplementedError(option)
+        if index + 1 >= len(args):
+            raise ValueError("no value given for {0}".format(option))
+        key, low, high = options[option]
+        value = args[index + 1]
+        if option == "--mcast-group":
+            try:
+                socket.inet_pton((socket.AF_INET6 if ":" in value
+                                  else socket.AF_INET), value)
+            except socket.error:
+                raise ValueError("illegal {0} specified".format(option[2:]))
+        elif low is not None:
+            try:
+                value = int(value)
+            except ValueError:
+                value = None
+            if value is None or not low <= value <= high:
+                raise ValueError("illegal {0} specified".format(option[2:]))
+        daemon[key] = value
+        index += 2
+    if action == "--stop-daemon":
+        return IPVS_CMD_DEL_DAEMON, [encode_daemon(daemon, full=False)]
+    if "mcast_ifn" not in daemon:
+        raise ValueError("no multicast interface given")
+    return IPVS_CMD_NEW_DAEMON, [encode_daemon(daemon)]
+
+def format_timeouts(timeouts):
+    """format the tcp, tcpfin and udp timeouts the way ipvsadm -L
+    --timeout prints them
+    """
+    return "Timeout (tcp tcpfin udp): {0} {1} {2}\n".format(*timeouts)
+
+def _is_option_listing(args, option):
+    """check if args ask for what option lists, like the sync daemons for
+    --daemon
+    """
+    allowed = set(("-L", "-l", "--list", "-Ln", "-nL", "-n", "--numeric",
+                   option))
+    return (option in args and set(args) <= allowed and
+            bool(set(args) & set(("-L", "-l", "--list", "-Ln", "-nL"))))
+
+def _parse_listing_args(args):
+    """check if args ask for a listing format_listing can produce
+
+    returns (fmt, selector) or None, selector being the ipvsadm service
+    arguments or None
+    """
+    flags = set()
+    fmt = None
+    selector = None
+    index = 0
+    while index < len(args):
+        arg = args[index]
+        if arg in ("-Ln", "-nL"):
+            flags.update(("-L", "-n"))
+        elif arg in ("-L", "-l", "--list", "-n", "--numeric", "--exact"):
+            flags.add(arg)
+        elif arg in ("--stats", "--rate") and fmt is None:
+            fmt = arg[2:]
+        elif (arg in PROTOCOLS or arg == "-f") and index + 1 < len(args):
+            selector = [arg, args[index + 1]]
+            index += 1
+        elif arg == "-6" and selector is not None:
+            selector.append(arg)
+        else:
+            return None
+        index += 1
+    if not (flags & set(("-L", "-l", "--list"))) or not (
+            flags & set(("-n", "--numeric"))):
+        return None
+    return fmt, selector
+
+def _service_flag(service):
+    """helper function to get the ipvsadm flag for the service protocol
+    """
+    for flag, protocol in PROTOCOLS.items():
+        if protocol == service["protocol"]:
+            return flag
+    raise ValueError("unknown protocol: {0}".format(service["protocol"]))
+
+def _service_key(service):
+    """sort services the same way ipvsadm does
+    """
+    return (service.get("fwmark", 0), service.get("protocol", 0),
+            service["af"], service.get("addr") or b"", service.get("port", 0))
+
+def _dest_key(dest):
+    """sort destinations the same way ipvsadm does
+    """
+    return (dest["af"], dest["addr"], dest["port"])
+
+def parse_command(args):
+    """translate ipvsadm arguments into a netlink command
+
+    returns a (cmd, attrs) tuple, raises NotImplementedError for
+    arguments that can not be translated and ValueError for invalid ones
+    """
+    if not args:
+        raise ValueError("no command given")
+    action = args[0]
+
+    if action == "-C":
+        return IPVS_CMD_FLUSH, []
+    if action == "--set":
+        if len(args) != 4:
+            raise ValueError("--set needs tcp, tcpfin and udp timeouts")
+        tcp, tcpfin, udp = [int(value) for value in args[1:]]
+        return IPVS_CMD_SET_CONFIG, [
+            attr(IPVS_CMD_ATTR_TIMEOUT_TCP, _u32(tcp)),
+            attr(IPVS_CMD_ATTR_TIMEOUT_TCP_FIN, _u32(tcpfin)),
+            attr(IPVS_CMD_ATTR_TIMEOUT_UDP, _u32(udp))]
+    if action in ("--start-daemon", "--stop-daemon"):
+        return _parse_daemon_command(args)
+
+    actions = {"-A": IPVS_CMD_NEW_SERVICE, "-E": IPVS_CMD_SET_SERVICE,
+               "-D": IPVS_CMD_DEL_SERVICE, "-a": IPVS_CMD_NEW_DEST,
+               "-e": IPVS_CMD_SET_DEST, "-d": IPVS_CMD_DEL_DEST,
+               "-Z": IPVS_CMD_ZERO}
+    if action not in actions:
+        raise NotImplementedError(action)
+    cmd = actions[action]
+
+    service = {}
+    dest = {}
+    index = 1
+    while index < len(args):
+        option = args[index]
+        value = None
+        if index + 1 < len(args):
+            value = args[index + 1]
+        if option in PROTOCOLS:
+            service["af"], service["addr"], service["port"] = _parse_addr(value)
+            service["protocol"] = PROTOCOLS[option]
+            index += 2
+        elif option == "-f":
+            service["fwmark"] = int(value)
+            service.setdefault("af", socket.AF_INET)
+            index += 2
+        elif option == "-6":
+            service["af"] = socket.AF_INET6
+            index += 1
+        elif option == "-s":
+            service["sched_name"] = value
+            index += 2
+        elif option == "-b":
+            service["flags"] = (service.get("flags", 0) |
+                                _parse_sched_flags(value))
+            index += 2
+        elif option == "-p":
+            service["flags"] = service.get("flags", 0) | IP_VS_SVC_F_PERSISTENT
+            if value is not None and not value.startswith("-"):
+                service["timeout"] = int(value)
+                index += 2
+            else:
+                service["timeout"] = DEFAULT_PERSISTENCE
+                index += 1
+        elif option == "-M":
+            service["netmask"] = value
+            index += 2
+        elif option == "-r":
+            dest["af"], dest["addr"], dest["port"] = _parse_addr(value)
+            index += 2
+        elif option in FWD_METHODS:
+            dest["fwd_method"] = FWD_METHODS[option]
+            index += 1
+        elif option in ("-w", "-x", "-y"):
+            name = {"-w": "weight", "-x": "u_thresh", "-y": "l_thresh"}[option]
+            dest[name] = int(value)
+            index += 2
+            if option == "-w" and not 0 <= dest[name] <= 65535:
+                raise ValueError("illegal weight specified")
+        elif option == "--tun-type":
+            if value not in TUN_TYPES:
+                raise ValueError("illegal tunnel type specified")
+            dest["tun_type"] = TUN_TYPES[value]
+            index += 2
+        elif option == "--tun-port":
+            dest["tun_port"] = int(value)
+            index += 2
+        elif option in TUN_FLAGS:
+            dest["tun_flags"] = TUN_FLAGS[option]
+            index += 1
+        else:
+            raise NotImplementedError(option)
+
+    if not service and action != "-Z":
+        raise ValueError("no service given")
+    if "netmask" in service:
+        if service["af"] == socket.AF_INET6:
+            service["netmask"] = int(service["netmask"])
+        else:
+            service["netmask"] = _get_u32(socket.inet_aton(service["netmask"]))
+
+    if cmd in (IPVS_CMD_NEW_SERVICE, IPVS_CMD_SET_SERVICE):
+        return cmd, [encode_service(service)]
+    if cmd in (IPVS_CMD_DEL_SERVICE, IPVS_CMD_ZERO):
+        if not service:
+            return cmd, []
+        return cmd, [encode_service(service, full=False)]
+    if not dest:
+        raise ValueError("no RealServer given")
+    if service.get("fwmark") and "-6" not in args:
+        # a firewall mark service takes the family of its RealServers
+        service["af"] = dest["af"]
+    if (cmd != IPVS_CMD_DEL_DEST and not service.get("fwmark") and
+            dest.get("fwd_method", IP_VS_CONN_F_DROUTE) != IP_VS_CONN_F_MASQ):
+        # like ipvsadm, only masquerading can change the port
+        dest["port"] = service["port"]
+    return cmd, [encode_service(service, full=False),
+                 encode_dest(dest, full=(cmd != IPVS_CMD_DEL_DEST))]
+
+
+class NetlinkBackend(object):
+    """backend talking generic netlink to the IPVS module of the kernel
+
+    sock: a connected netlink socket, a new NETLINK_GENERIC socket is
+          opened if omitted
+    family: id of the IPVS generic netlink family, resolved if omitted
+    fallback: backend used for commands that can not be translated,
+              IpvsadmBackend if omitted
+    batch_size: maximum number of bytes sent in a single send call
+    """
+
+    bufsize = 131072
+
+    def __init__(self, sock=None, family=None, fallback=None,
+                 batch_size=65536):
+        # only our own socket is known to talk to the kernel of this host
+        self.procfs = sock is None
+        if sock is None:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                 NETLINK_GENERIC)
+            sock.bind((0, 0))
+        if fallback is None:
+            fallback = IpvsadmBackend()
+        self.sock = sock
+        self.fallback = fallback
+        self.batch_size = batch_size
+        self.seq = 0
+        if family is None:
+            family = self._resolve_family()
+        self.family = family
+
+    def close(self):
+        """close the netlink socket
+        """
+        self.sock.close()
+
+    def _next_seq(self):
+        self.seq = (self.seq + 1) & 0xffffffff
+        return self.seq
+
+    def _resolve_family(self):
+        """ask the generic netlink controller for the IPVS family id
+        """
+        seq = self._next_seq()
+        self.sock.send(build_message(GENL_ID_CTRL, CTRL_CMD_GETFAMILY,
+            [attr(CTRL_ATTR_FAMILY_NAME, _string(IPVS_GENL_NAME))],
+            NLM_F_REQUEST, seq))
+        while True:
+            for msg_type, flags, rseq, payload in parse_messages(
+                    self.sock.recv(self.bufsize)):
+                if rseq != seq:
+                    continue
+                if msg_type == NLMSG_ERROR:
+                    error = -_NLMSGERR.unpack_from(payload)[0]
+                    raise ValueError("IPVS generic netlink family not "
+                        "available: {0}".format(os.strerror(error)))
+                attrs = parse_attrs(payload[_GENLMSGHDR.size:])
+                return _get_u16(attrs[CTRL_ATTR_FAMILY_ID])
+
+    def _query(self, cmd, attrs=(), dump=False):
+        """send a get request, returns the attributes of all replies
+        """
+        if dump:
+            flags = NLM_F_REQUEST | NLM_F_DUMP
+        else:
+            flags = NLM_F_REQUEST
+        seq = self._next_seq()
+        self.sock.send(build_message(self.family, cmd, attrs, flags, seq))
+        replies = []
+        while True:
+            for msg_type, rflags, rseq, payload in parse_messages(
+                    self.sock.recv(self.bufsize)):
+                if rseq != seq:
+                    continue
+                if msg_type == NLMSG_DONE:
+                    return replies
+                if msg_type == NLMSG_ERROR:
+                    error = -_NLMSGERR.unpack_from(payload)[0]
+                    if error:
+                        raise ValueError(_strerror(cmd, error))
+                    return replies
+                replies.append(parse_attrs(payload[_GENLMSGHDR.size:]))
+                if not rflags & NLM_F_MULTI:
+                    return replies
+
+    def _send_batch(self, messages):
+        """send a list of (cmd, attrs) tuples, packing as many messages
+        into a single send call as batch_size allows
+
+        returns a list with the errno for every message, 0 on success
+        """
+        results = [0] * len(messages)
+        pending = {}
+        chunk = []
+        size = 0
+        for index, (cmd, attrs) in enumerate(messages):
+            seq = self._next_seq()
+            data = build_message(self.family, cmd, attrs,
+                                 NLM_F_REQUEST | NLM_F_ACK, seq)
+            if chunk and size + len(data) > self.batch_size:
+                self._flush(chunk, pending, results)
+                chunk = []
+                size = 0
+            chunk.append(data)
+            size += len(data)
+            pending[seq] = index
+        if chunk:
+            self._flush(chunk, pending, results)
+        return results
+
+    def _flush(self, chunk, pending, results):
+        """send a chunk of messages and wait for all acknowledgements
+        """
+        self.sock.send(b"".join(chunk))
+        while pending:
+            for msg_type, flags, seq, payload in parse_messages(
+                    self.sock.recv(self.bufsize)):
+                if msg_type == NLMSG_ERROR and seq in pending:
+                    results[pending.pop(seq)] = -_NLMSGERR.unpack_from(
+                                                                payload)[0]
+
+    def _apply(self, cmd, attrs):
+        """send a single command, raise ValueError if the kernel refused it
+        """
+        error = self._send_batch([(cmd, attrs)])[0]
+        if error:
+            raise ValueError(_strerror(cmd, error))
+        return True
+
+    def get_services(self):
+        """return a list of dicts describing all services
+        """
+        return [decode_service(attrs[IPVS_CMD_ATTR_SERVICE]) for attrs in
+                self._query(IPVS_CMD_GET_SERVICE, dump=True)]
+
+    def get_service(self, service):
+        """return a dict describing a single service
+        """
+        replies = self._query(IPVS_CMD_GET_SERVICE,
+                              [encode_service(service, full=False)])
+        return decode_service(replies[0][IPVS_CMD_ATTR_SERVICE])
+
+    def new_service(self, service):
+        """add a service
+        """
+        return self._apply(IPVS_CMD_NEW_SERVICE, [encode_service(service)])
+
+    def set_service(self, service):
+        """change the options of a service
+        """
+        return self._apply(IPVS_CMD_SET_SERVICE, [encode_service(service)])
+
+    def del_service(self, service):
+        """remove a service
+        """
+        return self._apply(IPVS_CMD_DEL_SERVICE,
+                           [encode_service(service, full=False)])
+
+    def get_dests(self, service):
+        """return a list of dicts describing the RealServers of service
+        """
+        return [decode_dest(attrs[IPVS_CMD_ATTR_DEST], service["af"])
+                for attrs in self._query(IPVS_CMD_GET_DEST,
+                    [encode_service(service, full=False)], dump=True)]
+
+    def new_dest(self, service, dest):
+        """add a RealServer to service
+        """
+        return self._apply(IPVS_CMD_NEW_DEST,
+                           [encode_service(service, full=False),
+                            encode_dest(dest)])
+
+    def set_dest(self, service, dest):
+        """change a RealServer of service
+        """
+        return self._apply(IPVS_CMD_SET_DEST,
+                           [encode_service(service, full=False),
+                            encode_dest(dest)])
+
+    def del_dest(self, service, dest):
+        """remove a RealServer from service
+        """
+        return self._apply(IPVS_CMD_DEL_DEST,
+                           [encode_service(service, full=False),
+                            encode_dest(dest, full=False)])
+
+    def get_info(self):
+        """return the IPVS version and the size of the connection table
+        """
+        attrs = self._query(IPVS_CMD_GET_INFO)[0]
+        version = _get_u32(attrs[IPVS_INFO_ATTR_VERSION])
+        return {"version": "{0}.{1}.{2}".format((version >> 16) & 0xff,
+                                                (version >> 8) & 0xff,
+                                                version & 0xff),
+                "conn_tab_size": _get_u32(attrs[IPVS_INFO_ATTR_CONN_TAB_SIZE])}
+
+    def get_timeouts(self):
+        """return the tcp, tcpfin and udp timeouts
+        """
+        attrs = self._query(IPVS_CMD_GET_CONFIG)[0]
+        return (_get_u32(attrs[IPVS_CMD_ATTR_TIMEOUT_TCP]),
+                _get_u32(attrs[IPVS_CMD_ATTR_TIMEOUT_TCP_FIN]),
+                _get_u32(attrs[IPVS_CMD_ATTR_TIMEOUT_UDP]))
+
+    def get_daemons(self):
+        """return a list of dicts describing the running sync daemons
+        """
+        return [decode_daemon(attrs[IPVS_CMD_ATTR_DAEMON]) for attrs in
+                self._query(IPVS_CMD_GET_DAEMON, dump=True)
+                if IPVS_CMD_ATTR_DAEMON in attrs]
+
+    def set_timeouts(self, tcp, tcpfin, udp):
+        """set the tcp, tcpfin and udp timeouts
+        """
+        return self._apply(*parse_command(["--set", str(tcp), str(tcpfin),
+                                           str(udp)]))
+
+    def zero(self, service=None):
+        """zero the counters of service, or of all services
+        """
+        if service is None:
+            return self._apply(IPVS_CMD_ZERO, [])
+        return self._apply(IPVS_CMD_ZERO,
+                           [encode_service(service, full=False)])
+
+    def flush(self):
+        """remove all services
+        """
+        return self._apply(IPVS_CMD_FLUSH, [])
+
+    def dump(self):
+        """return the IPVS table in the format of ipvsadm -Sn
+        """
+        lines = []
+        for service in sorted(self.get_services(), key=_service_key):
+            lines.append(format_service(service))
+            for dest in sorted(self.get_dests(service), key=_dest_key):
+                lines.append(format_dest(service, dest))
+        return "".join(line + "\n" for line in lines)
+
+    def listing(self, fmt=None, selector=None):
+        """return the IPVS table in the format of ipvsadm -Ln
+
+        fmt: None, "stats" or "rate", see format_listing()
+        selector: ipvsadm service arguments like ["-t", "1.2.3.4:80"] to
+                  only list this service
+        """
+        services = self.get_services()
+        if selector is not None:
+            wanted = parse_command(["-D"] + selector)[1][0]
+            services = [service for service in services
+                        if encode_service(service, full=False) == wanted]
+            if not services:
+                raise ValueError("No such service")
+        entries = [(service, sorted(self.get_dests(service), key=_dest_key))
+                   for service in sorted(services, key=_service_key)]
+        return format_listing(entries, self.get_info(), fmt)
+
+    def execute(self, args):
+        """run ipvsadm style arguments
+        """
+        try:
+            cmd, attrs = parse_command(args)
+        except NotImplementedError:
+            return self.fallback.execute(args)
+        return self._apply(cmd, attrs)
+
+    def output(self, args):
+        """return the output ipvsadm would print for args
+        """
+        if args in (["-Sn"], ["-S", "-n"]):
+            return self.dump()
+        if _is_option_listing(args, "--daemon"):
+            return format_daemons(self.get_daemons())
+        if _is_option_listing(args, "--timeout"):
+            return format_timeouts(self.get_timeouts())
+        listing = _parse_listing_args(args)
+        if listing is not None:
+            return self.listing(*listing)
+        return self.fallback.output(args)
+
+    def restore(self, commands):
+        """apply a list of ipvsadm style commands, sending as few
+        netlink messages as possible
+
+        returns a list of (index, message) tuples for the failed commands
+        """
+        try:
+            messages = [parse_command(args) for args in commands]
+        except NotImplementedError:
+            return self.fallback.restore(commands)
+        results = self._send_batch(messages)
+        return [(index, _strerror(messages[index][0], error))
+                for index, error in enumerate(results) if error]
+
+def detect_backend():
+    """return a NetlinkBackend if the IPVS generic netlink family is
+    available, IpvsadmBackend otherwise
+    """
+    try:
+        return NetlinkBackend()
+    except (socket.error, ValueError, AttributeError):
+        return IpvsadmBackend()
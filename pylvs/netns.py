@@ -0,0 +1,110 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+"""
+netns.py
+
+the IPVS tables of many network namespaces
+
+every network namespace has an IPVS table of its own. On container hosts
+there are hundreds of them, NetnsManager reads and changes all of them
+concurrently, running ipvsadm in every namespace with a command like
+["ip", "netns", "exec", "web1", "ipvsadm"], and returns the results keyed
+by namespace.
+
+    >>> from pylvs.netns import NetnsManager
+    >>> namespaces = NetnsManager(workers=32)
+    >>> services = namespaces.list_lvs_instances()
+    >>> results = namespaces.apply(desired_state)
+"""
+
+import errno
+import os
+
+from .cluster import ClusterManager
+from .pylvs import IpvsadmBackend, LVSManager, netns_command
+
+# where ip netns keeps its named namespaces
+NETNS_ROOT = "/var/run/netns"
+
+def list_namespaces(netns_root=None):
+    """return the sorted names of the namespaces of ip netns
+
+    netns_root: where the namespaces are bind mounted, NETNS_ROOT if
+                omitted, no namespaces if it does not exist
+    """
+    if netns_root is None:
+        netns_root = NETNS_ROOT
+    try:
+        return sorted(os.listdir(netns_root))
+    except OSError as error:
+        if error.errno == errno.ENOENT:
+            return []
+        raise ValueError("failed to list {0}: {1}".format(netns_root, error))
+
+
+class NetnsManager(ClusterManager):
+    """runs the same reads and changes in many network namespaces
+    concurrently, see ClusterManager
+
+    namespaces: names of the namespaces, or paths like /proc/1234/ns/net,
+                all namespaces of list_namespaces() if omitted
+    command: callable returning the argument list that runs ipvsadm in a
+             namespace, netns_command() if omitted. Use it to run
+             ipvsadm with sudo, or to test without root
+    netns_root: where list_namespaces() looks for the namespaces
+    workers, policy, quorum: see ClusterManager
+
+    every ipvsadm call is a process of its own, so threads are enough to
+    keep workers of them running at the same time
+    """
+
+    def __init__(self, namespaces=None, command=None, workers=16,
+                 policy="all", quorum=None, netns_root=None):
+        if namespaces is None:
+            namespaces = list_namespaces(netns_root)
+        if command is None:
+            command = netns_command
+        managers = {}
+        for netns in namespaces:
+            manager = LVSManager(backend=IpvsadmBackend(command(netns)))
+            manager.netns = netns
+            managers[netns] = manager
+        ClusterManager.__init__(self, managers, workers, policy, quorum)
+
+    def collect(self, change, namespaces=None):
+        """run change like run() does, and return a dict mapping the
+        namespaces it succeeded in to what it returned
+        """
+        results = self.run(change, namespaces)
+        return dict((netns, result.result) for netns, result in results.items()
+                    if result.status == "ok")
+
+    def list_lvs_instances(self, namespaces=None):
+        """return a dict mapping the namespaces to their services, see
+        LVSManager.list_lvs_instances()
+        """
+        return self.collect(lambda manager: manager.list_lvs_instances(),
+                            namespaces)
+
+    def get_stats(self, namespaces=None):
+        """return a dict mapping the namespaces to the statistics of their
+        services, see LVSManager.get_stats()
+        """
+        return self.collect(lambda manager: manager.get_stats(), namespaces)
+
+    def batch(self, change, namespaces=None):
+        """call change with a LVSTransaction in every namespace, so all
+        changes of a namespace are made with a single ipvsadm -R call
+
+        change: callable taking a LVSTransaction, like
+                lambda txn: txn.add_lvs_instance("10.0.0.1:80", "tcp")
+
+        returns the results of run()
+        """
+        def transaction(manager):
+            with manager.transaction() as txn:
+                return change(txn)
+        return self.run(transaction, namespaces)
@@ -0,0 +1,408 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+"""
+procfs.py
+
+readers for the IPVS files the kernel exposes below /proc
+
+the connection table can hold millions of entries, so it is read as a
+stream, one line at a time, and the aggregators only keep one counter per
+RealServer and state
+"""
+
+import binascii
+import collections
+import os
+import socket
+import struct
+
+PROC_ROOT = "/proc"
+MODULES_ROOT = "/lib/modules"
+# ip_vs_* modules that are no schedulers
+_NOT_SCHEDULERS = frozenset(("ftp", "pe_sip"))
+
+IPVSConnection = collections.namedtuple("IPVSConnection",
+    ("proto", "client", "service_addr", "real_server", "state", "expires",
+     "origin"))
+
+def _path(name, proc_root=None):
+    """helper function to get the path of a file below the proc root
+    """
+    if proc_root is None:
+        proc_root = PROC_ROOT
+    return os.path.join(proc_root, "net", name)
+
+def _sysctl_path(name, proc_root=None):
+    """helper function to get the path of an IPVS sysctl below the proc
+    root
+    """
+    if proc_root is None:
+        proc_root = PROC_ROOT
+    return os.path.join(proc_root, "sys", "net", "ipv4", "vs", name)
+
+def _decode_addr(addr, port):
+    """decode a hex address and port as printed by the kernel into the
+    ip:port notation used by pylvs
+    """
+    if len(addr) == 8:
+        ipaddr = socket.inet_ntoa(binascii.unhexlify(addr))
+        return "{0}:{1}".format(ipaddr, int(port, 16))
+    packed = binascii.unhexlify(addr.replace(":", ""))
+    ipaddr = socket.inet_ntop(socket.AF_INET6, packed)
+    return "[{0}]:{1}".format(ipaddr, int(port, 16))
+
+def _encode_addr(addr):
+    """encode an ip:port string the way the kernel prints it in
+    ip_vs_conn, IPv4 as upper case hex, IPv6 as lower case hex groups
+    """
+    ipaddr, port = addr.rsplit(":", 1)
+    if ipaddr.startswith("["):
+        packed = socket.inet_pton(socket.AF_INET6, ipaddr[1:-1])
+        groups = struct.unpack("!8H", packed)
+        ipaddr = ":".join("{0:04x}".format(group) for group in groups)
+    else:
+        ipaddr = "{0:08X}".format(struct.unpack("!I",
+                                  socket.inet_aton(ipaddr))[0])
+    return "{0} {1:04X}".format(ipaddr, int(port))
+
+def _offsets(line):
+    """column offsets of a connection line
+
+    the protocol column has a variable width, everything after it has a
+    fixed width that only depends on the address family
+
+    returns (start of the first address, width of an address)
+    """
+    start = line.index(" ")
+    while line[start] == " ":
+        start += 1
+    if line[start + 8] == " ":
+        return start, 8
+    return start, 39
+
+def _parse_sysctl(value):
+    """parse the value of a sysctl, an int or a tuple of ints for
+    vectors like sync_threshold, the plain string for anything else
+    """
+    fields = value.split()
+    try:
+        values = tuple(int(field) for field in fields)
+    except ValueError:
+        return value.strip()
+    if len(values) == 1:
+        return values[0]
+    return values
+
+def read_sysctls(prefix="", proc_root=None):
+    """read the IPVS sysctls below /proc/sys/net/ipv4/vs
+
+    prefix: only read the sysctls whose name starts with this, like
+            "sync_"
+    proc_root: where procfs is mounted, PROC_ROOT if omitted
+
+    returns a dict mapping the names to their values, see _parse_sysctl()
+    """
+    path = _sysctl_path("", proc_root)
+    sysctls = {}
+    for name in sorted(os.listdir(path)):
+        if not name.startswith(prefix):
+            continue
+        with open(os.path.join(path, name)) as sysctl:
+            sysctls[name] = _parse_sysctl(sysctl.read())
+    return sysctls
+
+def write_sysctl(name, value, proc_root=None):
+    """write an IPVS sysctl below /proc/sys/net/ipv4/vs
+
+    value: an int, a tuple of ints for vectors like sync_threshold, or a
+           string
+    """
+    if isinstance(value, tuple):
+        value = " ".join(str(item) for item in value)
+    with open(_sysctl_path(name, proc_root), "w") as sysctl:
+        sysctl.write("{0}\n".format(value))
+
+def read_header(proc_root=None, path=None):
+    """first line of /proc/net/ip_vs, with the IPVS version and the size
+    of the connection hash table
+    """
+    if path is None:
+        path = _path("ip_vs", proc_root)
+    with open(path) as ip_vs:
+        return ip_vs.readline()
+
+def _module_name(path):
+    """helper function to get the module name of a path of modules.dep
+    or modules.builtin, like kernel/net/netfilter/ipvs/ip_vs_rr.ko.xz
+    """
+    return os.path.basename(path).split(".ko", 1)[0].replace("-", "_")
+
+def probe_schedulers(proc_root=None, modules_root=None):
+    """names of the IPVS schedulers the running kernel has, loaded ones
+    from /proc/modules, built in and installed ones from modules.builtin
+    and modules.dep of its release
+
+    proc_root: where procfs is mounted, PROC_ROOT if omitted
+    modules_root: where the kernel modules are installed, MODULES_ROOT if
+                  omitted
+
+    the kernel loads the module of a scheduler when a service uses it, so
+    installed ones count. Raises IOError if none of the files exist
+    """
+    if proc_root is None:
+        proc_root = PROC_ROOT
+    if modules_root is None:
+        modules_root = MODULES_ROOT
+    names = set()
+    found = False
+    try:
+        with open(os.path.join(proc_root, "modules")) as modules:
+            names.update(line.split(" ", 1)[0] for line in modules)
+        found = True
+    except (IOError, OSError):
+        pass
+    try:
+        with open(os.path.join(proc_root, "sys", "kernel",
+                               "osrelease")) as osrelease:
+            release = osrelease.read().strip()
+    except (IOError, OSError):
+        release = os.uname()[2]
+    for name in ("modules.builtin", "modules.dep"):
+        try:
+            with open(os.path.join(modules_root, release, name)) as modules:
+                names.update(_module_name(line.split(":", 1)[0].strip())
+                             for line in modules)
+            found = True
+        except (IOError, OSError):
+            pass
+    if not found:
+        raise IOError("no kernel module list below {0} or {1}".format(
+                      proc_root, os.path.join(modules_root, release)))
+    return frozenset(name[6:] for name in names if name.startswith("ip_vs_")
+                     and name[6:] not in _NOT_SCHEDULERS)
+
+def _lines(proc_root=None, sync=False, path=None):
+    """yield the connection lines of ip_vs_conn or ip_vs_conn_sync,
+    without the header
+    """
+    if path is None:
+        if sync:
+            path = _path("ip_vs_conn_sync", proc_root)
+        else:
+            path = _path("ip_vs_conn", proc_root)
+    with open(path) as conns:
+        for line in conns:
+            if line.startswith("Pro ") or len(line) < 20:
+                continue
+            yield line
+
+def iter_connections(proc_root=None, sync=False, path=None):
+    """yield an IPVSConnection for every entry of the connection table
+
+    proc_root: where procfs is mounted, PROC_ROOT if omitted
+    sync: read ip_vs_conn_sync, which also tells if the connection was
+          created locally or by the sync daemon
+    path: read this file instead
+    """
+    for line in _lines(proc_root, sync, path):
+        start, width = _offsets(line)
+        step = width + 6
+        client = start
+        service = client + step
+        dest = service + step
+        rest = line[dest + step:].split()
+        origin = None
+        if sync and len(rest) > 2:
+            origin = rest.pop(1)
+        yield IPVSConnection(line[:start].rstrip(),
+            _decode_addr(line[client:client + width],
+                         line[client + width + 1:client + width + 5]),
+            _decode_addr(line[service:service + width],
+                         line[service + width + 1:service + width + 5]),
+            _decode_addr(line[dest:dest + width],
+                         line[dest + width + 1:dest + width + 5]),
+            rest[0], int(rest[1]), origin)
+
+def aggregate_connections(proto=None, service_addr=None, proc_root=None,
+                          sync=False, path=None):
+    """count the connections per RealServer and per state in a single
+    pass over the connection table
+
+    proto, service_addr: only count connections of this service
+    proc_root, sync, path: see iter_connections()
+
+    returns a tuple (servers, states), servers being a dict mapping every
+    RealServer to a dict of per state counts, and states a dict with the
+    per state counts of all RealServers
+    """
+    wanted = None
+    if service_addr is not None:
+        wanted = _encode_addr(service_addr)
+    prefix = None
+    if proto is not None:
+        prefix = proto.upper() + " "
+
+    # count on the raw columns, they are only decoded once per RealServer
+    counts = {}
+    for line in _lines(proc_root, sync, path):
+        if prefix is not None and not line.startswith(prefix):
+            continue
+        start, width = _offsets(line)
+        step = width + 6
+        if wanted is not None:
+            service = start + step
+            if line[service:service + step - 1] != wanted:
+                continue
+        dest = start + 2 * step
+        state = dest + step
+        key = (line[dest:state - 1], line[state:line.find(" ", state)])
+        counts[key] = counts.get(key, 0) + 1
+
+    servers = {}
+    states = {}
+    for (dest, state), count in counts.items():
+        addr, port = dest.split(" ")
+        real_server = _decode_addr(addr, port)
+        per_state = servers.setdefault(real_server, {})
+        per_state[state] = per_state.get(state, 0) + count
+        states[state] = states.get(state, 0) + count
+    return servers, states
+
+def aggregate_origins(proc_root=None, path=None):
+    """count the entries of ip_vs_conn_sync per origin, connections
+    created on this host and connections received from a master sync
+    daemon
+
+    proc_root, path: see iter_connections()
+
+    returns a dict mapping the origins, as printed by the kernel, to
+    their counts
+    """
+    counts = {}
+    for line in _lines(proc_root, True, path):
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+        origin = fields[-2]
+        counts[origin] = counts.get(origin, 0) + 1
+    return counts
+
+_FWD_FLAGS = {"Masq": "-m", "Local": "-g", "Tunnel": "-i", "Route": "-g"}
+_PROTO_FLAGS = {"TCP": "-t", "UDP": "-u", "SCTP": "--sctp-service",
+                "FWM": "-f"}
+
+def _decode_service_addr(addr):
+    """decode a hex address:port from ip_vs, IPv6 addresses are bracketed
+    """
+    ipaddr, port = addr.rsplit(":", 1)
+    if ipaddr.startswith("["):
+        ipaddr = ipaddr[1:-1]
+    return _decode_addr(ipaddr, port)
+
+def _decode_netmask(mask, ipv6):
+    """decode the persistence netmask, None for a host mask
+    """
+    mask = int(mask, 16)
+    if ipv6:
+        # the prefix length is printed through ntohl()
+        if mask > 128:
+            mask = struct.unpack("<I", struct.pack(">I", mask))[0]
+        if mask == 128:
+            return None
+        return str(mask)
+    if mask == 0xffffffff:
+        return None
+    return socket.inet_ntoa(struct.pack("!I", mask))
+
+def iter_services(proc_root=None, path=None):
+    """yield a (proto, service_addr, scheduler, persistence, netmask,
+    servers) tuple for every service in /proc/net/ip_vs, servers being a
+    list of (real_server, method, weight) tuples
+
+    the upper and lower thresholds of the RealServers are not shown by
+    the kernel, and the persistence timeout is in jiffies. Firewall mark
+    services are returned as fwm with the mark as service_addr, the kernel
+    does not show their address family, they are fwm6 if their first
+    RealServer is IPv6
+    """
+    if path is None:
+        path = _path("ip_vs", proc_root)
+    service = None
+    with open(path) as table:
+        for line in table:
+            fields = line.split()
+            if not fields:
+                continue
+            if fields[0] == "->":
+                if service is not None and fields[2] in _FWD_FLAGS:
+                    service[5].append((_decode_service_addr(fields[1]),
+                                       _FWD_FLAGS[fields[2]], fields[3]))
+                continue
+            if service is not None:
+                yield _fwm_family(service)
+                service = None
+            if fields[0] not in _PROTO_FLAGS or len(fields) < 3:
+                continue
+            persistence = None
+            netmask = None
+            if fields[0] == "FWM":
+                addr = str(int(fields[1], 16))
+            else:
+                addr = _decode_service_addr(fields[1])
+            if "persistent" in fields:
+                index = fields.index("persistent")
+                persistence = fields[index + 1]
+                netmask = fields[index + 2]
+            service = [fields[0].lower(), addr, fields[2], persistence,
+                       netmask, []]
+    if service is not None:
+        yield _fwm_family(service)
+
+def _fwm_family(service):
+    """finish a service of iter_services(), firewall mark services
+    take the address family of their first RealServer
+    """
+    proto, addr, scheduler, persistence, netmask, servers = service
+    if proto == "fwm":
+        ipv6 = bool(servers) and servers[0][0].startswith("[")
+        if ipv6:
+            proto = "fwm6"
+    else:
+        ipv6 = addr.startswith("[")
+    if netmask is not None:
+        netmask = _decode_netmask(netmask, ipv6)
+    return (proto, addr, scheduler, persistence, netmask, servers)
+
+def dump_services(proc_root=None, path=None):
+    """render /proc/net/ip_vs in the format of ipvsadm -Sn, without the
+    upper and lower thresholds of the RealServers and with the persistence
+    timeout in jiffies
+
+    raises ValueError for firewall mark services without RealServers, 
+    their address family can not be told
+    """
+    lines = []
+    for proto, addr, scheduler, persistence, netmask, servers \
+            in iter_services(proc_root, path):
+        if proto.startswith("fwm"):
+            if not servers:
+                raise ValueError("address family of firewall mark {0} "
+                                 "unknown".format(addr))
+            flag = "-f"
+            if proto == "fwm6":
+                addr += " -6"
+        else:
+            flag = _PROTO_FLAGS[proto.upper()]
+        line = "-A {0} {1} -s {2}".format(flag, addr, scheduler)
+        if persistence is not None:
+            line += " -p {0}".format(persistence)
+            if netmask is not None:
+                line += " -M {0}".format(netmask)
+        lines.append(line)
+        for real_server, method, weight in servers:
+            lines.append("-a {0} {1} -r {2} {3} -w {4}".format(
+                flag, addr, real_server, method, weight))
+    return "".join(line + "\n" for line in lines)
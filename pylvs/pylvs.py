@@ -9,15 +9,100 @@ pylvs.py
 small wrapper around ipvsadm for handling Linux Virtual Server Instances
 """
 
-import re
+import collections
+import gc
+import hashlib
+import json
+import os
 import socket
 import subprocess
+import time
+
+from . import procfs
 
 IPVSADM = "ipvsadm"
 METHODS = ('ipip', 'masq', 'route')
-PROTOS = ('tcp', 'udp')
+# encapsulation of ipip RealServers, and its checksum options
+TUN_TYPES = ('ipip', 'gue', 'gre')
+TUN_CSUMS = ('nocsum', 'csum', 'remcsum')
+PROTOS = ('tcp', 'udp', 'sctp', 'fwm', 'fwm6')
+# firewall mark services, named by the mark instead of ip:port
+FWM_PROTOS = ('fwm', 'fwm6')
 SCHEDULERS = ('rr', 'wrr', 'lc', 'wlc', 'lblc', 
-              'lblcr', 'dh', 'sh', 'sed', 'nq')
+              'lblcr', 'dh', 'sh', 'sed', 'nq', 'fo', 'ovf', 'mh')
+# scheduler flags of ipvsadm -b, each belongs to the scheduler its name
+# starts with
+SCHED_FLAGS = ('sh-fallback', 'sh-port', 'mh-fallback', 'mh-port')
+_PROTOS = {'-t': 'tcp', '-u': 'udp', '--sctp-service': 'sctp'}
+_METHODS = {'-m': 'masq', '-g': 'route', '-i': 'ipip'}
+
+_LISTPROTOS = {'TCP': 'tcp', 'UDP': 'udp', 'SCTP': 'sctp', 'FWM': 'fwm'}
+
+STATS_FIELDS = ('conns', 'inpkts', 'outpkts', 'inbytes', 'outbytes')
+RATE_FIELDS = ('cps', 'inpps', 'outpps', 'inbps', 'outbps')
+LVSStats = collections.namedtuple('LVSStats', STATS_FIELDS + RATE_FIELDS + 
+                                  ('activeconns', 'inactconns'))
+
+DAEMON_STATES = ('master', 'backup')
+LVSDaemon = collections.namedtuple('LVSDaemon', ('state', 'mcast_interface',
+                                   'syncid', 'sync_maxlen', 'mcast_group', 
+                                   'mcast_port', 'mcast_ttl'))
+# fields of ipvsadm -L --daemon, mapped to the LVSDaemon fields
+_DAEMON_FIELDS = {'mcast': 'mcast_interface', 'syncid': 'syncid', 
+                  'maxlen': 'sync_maxlen', 'group': 'mcast_group', 
+                  'port': 'mcast_port', 'ttl': 'mcast_ttl'}
+
+# IPVS sysctls of /proc/sys/net/ipv4/vs that can be tuned, mapped to their
+# (lowest, highest) value, highest None if unlimited. sync_threshold is a
+# (threshold, period) pair
+TUNABLES = {'am_droprate': (0, None), 'amemthresh': (0, None), 
+            'backup_only': (0, 1), 'cache_bypass': (0, 1), 
+            'conn_reuse_mode': (0, 3), 'conntrack': (0, 1), 
+            'drop_entry': (0, 3), 'drop_packet': (0, 3), 
+            'expire_nodest_conn': (0, 1), 
+            'expire_quiescent_template': (0, 1), 'ignore_tunneled': (0, 1),
+            'nat_icmp_send': (0, 1), 'pmtu_disc': (0, 1), 
+            'run_estimation': (0, 1), 'schedule_icmp': (0, 1), 
+            'secure_tcp': (0, 3), 'sloppy_sctp': (0, 1), 
+            'sloppy_tcp': (0, 1), 'snat_reroute': (0, 1), 
+            'sync_persist_mode': (0, 1), 'sync_ports': (1, None), 
+            'sync_qlen_max': (1, None), 'sync_refresh_period': (0, None), 
+            'sync_retries': (0, 3), 'sync_sock_size': (0, None), 
+            'sync_threshold': (0, None), 'sync_version': (0, 1)}
+TUNABLE_PROFILES = {
+    # what the ip_vs module starts with
+    'defaults': {'am_droprate': 10, 'amemthresh': 1024, 
+                 'conn_reuse_mode': 1, 'conntrack': 0, 'drop_entry': 0, 
+                 'drop_packet': 0, 'expire_nodest_conn': 0, 
+                 'expire_quiescent_template': 0, 'schedule_icmp': 0, 
+                 'secure_tcp': 0, 'sloppy_tcp': 0, 
+                 'sync_threshold': (3, 50)},
+    # drop entries, packets and half open connections when memory runs 
+    # below amemthresh, against connection floods
+    'defense': {'drop_entry': 1, 'drop_packet': 1, 'secure_tcp': 1},
+    # expire the connections of removed and quiesced RealServers at once,
+    # so clients reconnect to the remaining ones
+    'failover': {'expire_nodest_conn': 1, 'expire_quiescent_template': 1},
+}
+
+CHANGES = ('service_added', 'service_removed', 'service_changed', 
+           'server_added', 'server_removed', 'server_changed')
+LVSChange = collections.namedtuple('LVSChange', ('kind', 'service', 
+                                   'real_server', 'old', 'new'))
+
+# checkpoint files written by LVSManager.save()
+CHECKPOINT_FORMAT = 'pylvs-checkpoint'
+CHECKPOINT_VERSION = 1
+
+LVSViolation = collections.namedtuple('LVSViolation', ('service', 
+                                      'real_server', 'message'))
+
+_now = getattr(time, "monotonic", time.time)
+
+# listings read by get_stats(), the formats exclude each other
+_RATE_LISTING = ["-Ln", "--rate", "--exact"]
+_CONN_LISTING = ["-Ln"]
+_STATS_LISTING = ["-Ln", "--stats", "--exact"]
 
 def _chkip(ipaddr):
     """check if given service_addr is a valid ipv6, or ipv4 address
@@ -40,7 +125,7 @@ def _mthcmd(method):
     """helper function to get the right cmd arg for the method
     """
     if method not in METHODS:
-        raise ValueError, "Invalid LoadBalancing Method: {0}".format(method)
+        raise ValueError("Invalid LoadBalancing Method: {0}".format(method))
     
     if method == "ipip":
         mthcmd = "-i"
@@ -50,18 +135,103 @@ def _mthcmd(method):
         mthcmd = "-g"
     return mthcmd
 
+def _tunopts(tun_type, tun_port=None, tun_csum=None):
+    """helper function to get the canonical (tun_type, tun_port, tun_csum)
+    of a RealServer, all None for plain ipip, the checksum defaulting to
+    nocsum like the kernel does
+    """
+    if tun_type is None or tun_type == "ipip":
+        return (None, None, None)
+    if tun_port is not None:
+        tun_port = int(tun_port)
+    return (tun_type, tun_port, tun_csum or "nocsum")
+
+def _tunerrors(method, tun_type=None, tun_port=None, tun_csum=None):
+    """helper function to list the errors of the tunnel options of a
+    RealServer, empty if they are fine
+    """
+    if tun_type is None:
+        if tun_port is not None or tun_csum is not None:
+            return ["tun_port and tun_csum cannot appear without tun_type"]
+        return []
+    errors = []
+    if method != "ipip":
+        errors.append("tunnel options need the ipip method")
+    if tun_type not in TUN_TYPES:
+        errors.append("invalid tunnel type: {0}".format(tun_type))
+    elif tun_type == "gue":
+        if not _inrange(1, 65535, tun_port):
+            errors.append("gue needs a tun_port within 1 and 65535, was "
+                          "{0}".format(tun_port))
+    elif tun_port is not None:
+        errors.append("tun_port is only allowed with gue")
+    if tun_csum is not None:
+        if tun_csum not in TUN_CSUMS:
+            errors.append("invalid tunnel checksum: {0}".format(tun_csum))
+        elif tun_type == "ipip":
+            errors.append("tun_csum is only allowed with gue and gre")
+        elif tun_csum == "remcsum" and tun_type != "gue":
+            errors.append("remcsum is only allowed with gue")
+    return errors
+
+def _tuncmd(method, **kwargs):
+    """helper function to get the cmd args for the tunnel options of a
+    RealServer
+    
+    optional args:
+    tun_type: one of TUN_TYPES
+    tun_port: destination port, gue only
+    tun_csum: one of TUN_CSUMS, gue and gre only
+    """
+    tun_type = kwargs.get("tun_type")
+    tun_port = kwargs.get("tun_port")
+    tun_csum = kwargs.get("tun_csum")
+    errors = _tunerrors(method, tun_type, tun_port, tun_csum)
+    if errors:
+        raise ValueError(errors[0])
+    if tun_type is None:
+        return []
+    cmd = ["--tun-type", tun_type]
+    if tun_port is not None:
+        cmd = cmd + ["--tun-port", str(tun_port)]
+    if tun_csum is not None:
+        cmd = cmd + ["--tun-" + tun_csum]
+    return cmd
+
 def _prtcmd(proto):
     """helper function to get the right cmd arg for the proto
     """
     if proto not in PROTOS:
-        raise ValueError, "Invalid protocol: {0}".format(proto)
+        raise ValueError("Invalid protocol: {0}".format(proto))
     
     if proto == "udp":
         prtcmd = "-u"
+    elif proto == "sctp":
+        prtcmd = "--sctp-service"
+    elif proto in FWM_PROTOS:
+        prtcmd = "-f"
     else:
         prtcmd = "-t"
     return prtcmd
 
+def _svccmd(proto, service_addr):
+    """helper function to get the cmd args selecting a service
+    """
+    cmd = [_prtcmd(proto), service_addr]
+    if proto == "fwm6":
+        cmd.append("-6")
+    return cmd
+
+def _fwmproto(options):
+    """helper function to get the proto of a -f line of ipvsadm -Sn,
+    ipvsadm only marks IPv6 on the service, so the RealServers tell too
+    """
+    real_server = options.get("-r")
+    if "-6" in options or (real_server is not None and 
+                           real_server.startswith("[")):
+        return "fwm6"
+    return "fwm"
+
 def _rangechk(minval, maxval, candidate):
     """check if candidate is within given range
     
@@ -72,6 +242,232 @@ def _rangechk(minval, maxval, candidate):
     else:
         return False
 
+def _canonaddr(addr):
+    """helper function to get the canonical form of an ip:port string
+    
+    ipvsadm prints addresses in their inet_ntop form, so user supplied
+    addresses have to be normalised before they can be compared
+    """
+    ipaddr, port = addr.rsplit(':', 1)
+    try:
+        if ipaddr.startswith("["):
+            packed = socket.inet_pton(socket.AF_INET6, ipaddr[1:-1])
+            ipaddr = "[" + socket.inet_ntop(socket.AF_INET6, packed) + "]"
+        else:
+            packed = socket.inet_pton(socket.AF_INET, ipaddr)
+            ipaddr = socket.inet_ntop(socket.AF_INET, packed)
+    except (socket.error, ValueError):
+        pass
+    return ipaddr + ":" + str(port)
+
+def _servicekey(proto, service_addr):
+    """helper function to get the key of a service in a LVSSnapshot
+    """
+    if proto in FWM_PROTOS:
+        try:
+            return (proto, str(int(service_addr)))
+        except ValueError:
+            return (proto, service_addr)
+    return (proto, _canonaddr(service_addr))
+
+def _schedflags(scheduler, flags):
+    """helper function to check scheduler flags, flags being a list or a
+    comma separated string of SCHED_FLAGS
+    
+    returns a tuple of the flags in the order of SCHED_FLAGS
+    """
+    if isinstance(flags, str):
+        flags = flags.split(",")
+    flags = set(flags)
+    for flag in flags:
+        if flag not in SCHED_FLAGS:
+            raise ValueError("invalid scheduler flag: {0}".format(flag))
+        if not flag.startswith(str(scheduler) + "-"):
+            raise ValueError("incompatible scheduler flag {0} for "
+                             "scheduler {1}".format(flag, scheduler))
+    return tuple(flag for flag in SCHED_FLAGS if flag in flags)
+
+def _optscmd(scheduler, **kwargs):
+    """helper function to get the cmd args for the options of a service
+    
+    scheduler: which scheduler to use
+    
+    optional args:
+    persistence:
+    netmask:
+    flags: scheduler flags, see SCHED_FLAGS
+    """
+    if scheduler in SCHEDULERS:
+        cmd = ["-s", scheduler]
+    else:
+        raise ValueError("selected scheduler is invalid")
+    
+    if kwargs.get("flags"):
+        cmd = cmd + ["-b", ",".join(_schedflags(scheduler, kwargs["flags"]))]
+    
+    if "persistence" in kwargs:
+        if _rangechk(1, 65535, kwargs["persistence"]):
+            cmd = cmd + ['-p', str(kwargs["persistence"])]
+        else:
+            raise ValueError("persistence outside of valid range, should "
+        "be within 1 and 65535, was {0}".format(kwargs['persistence']))
+    #FIXME: we should check that we have a valid netmask
+    if "netmask" in kwargs:
+        if not "persistence" in kwargs:
+            raise ValueError("netmask cannot appear without persistence")
+        cmd = cmd +["-M", kwargs["netmask"]]
+    return cmd
+
+def _parse_listing(out):
+    """helper function to parse the output of ipvsadm -Ln
+    
+    returns a list of (name, fields, servers) tuples, fields being the 
+    columns after the service address, and servers a list of 
+    (real_server, fields) tuples
+    """
+    result = []
+    for line in out.split("\n"):
+        fields = line.split()
+        if len(fields) < 2:
+            continue
+        if fields[0] == "->":
+            if result and fields[1] != "RemoteAddress:Port":
+                result[-1][2].append((fields[1], fields[2:]))
+        elif fields[0] in _LISTPROTOS:
+            proto = _LISTPROTOS[fields[0]]
+            fields = fields[1:]
+            if proto == "fwm" and len(fields) > 1 and fields[1] == "IPv6":
+                proto = "fwm6"
+                del fields[1]
+            result.append((proto + "_" + fields[0], fields[1:], []))
+    return result
+
+def _parse_daemons(out):
+    """parse the output of ipvsadm -L --daemon into LVSDaemon tuples
+    """
+    daemons = []
+    for line in out.splitlines():
+        state, sep, rest = line.partition(" sync daemon (")
+        if not sep or state not in DAEMON_STATES:
+            continue
+        values = dict.fromkeys(LVSDaemon._fields)
+        values['state'] = state
+        for item in rest.rstrip(")").split(", "):
+            key, sep, value = item.partition("=")
+            if key not in _DAEMON_FIELDS:
+                continue
+            if key not in ('mcast', 'group'):
+                value = int(value)
+            values[_DAEMON_FIELDS[key]] = value
+        daemons.append(LVSDaemon(**values))
+    return daemons
+
+def _tunables(profile):
+    """helper function to check a tunables profile, the name of one of
+    TUNABLE_PROFILES or a dict mapping TUNABLES to their values
+    
+    returns the dict with ints, and a tuple for sync_threshold
+    """
+    if not isinstance(profile, dict):
+        if profile not in TUNABLE_PROFILES:
+            raise ValueError("unknown tunables profile: {0}".format(profile))
+        profile = TUNABLE_PROFILES[profile]
+    result = {}
+    errors = []
+    for name in sorted(profile):
+        value = profile[name]
+        if name not in TUNABLES:
+            errors.append("{0}: unknown tunable".format(name))
+            continue
+        low, high = TUNABLES[name]
+        try:
+            if name == 'sync_threshold':
+                value = tuple(int(item) for item in value)
+                valid = (len(value) == 2 and min(value) >= 0 and 
+                         (value[0] < value[1] or value[1] == 0))
+            else:
+                value = int(value)
+                valid = _inrange(low, high or value, value)
+                if name == 'sync_ports':
+                    # the kernel wants a power of 2
+                    valid = valid and not value & (value - 1)
+        except (TypeError, ValueError):
+            valid = False
+        if not valid:
+            errors.append("{0}: invalid value {1!r}".format(name, 
+                                                          profile[name]))
+            continue
+        result[name] = value
+    if errors:
+        raise ValueError("invalid tunables: " + "; ".join(errors))
+    return result
+
+def _parse_info(line):
+    """helper function to parse the IP Virtual Server version line of
+    ipvsadm -Ln and /proc/net/ip_vs
+    """
+    fields = line.split()
+    if (fields[:4] != ["IP", "Virtual", "Server", "version"] or 
+            len(fields) < 6 or not fields[5].startswith("(size=")):
+        raise ValueError("could not read the IPVS version: "
+                         "{0}".format(line.strip()))
+    size = int(fields[5][6:].rstrip(")"))
+    return {"version": fields[4], "conn_tab_size": size, 
+            "conn_tab_bits": size.bit_length() - 1}
+
+def _counters(fields, count=5):
+    """helper function to convert the first count columns to integers
+    """
+    values = [int(value) for value in fields[:count]]
+    return values + [0] * (count - len(values))
+
+def _desired_opts(spec):
+    """helper function to get (scheduler, kwargs) for set_opts from a
+    service description as used by LVSManager.apply()
+    """
+    kwargs = {}
+    if spec.get("persistence") is not None:
+        kwargs["persistence"] = spec["persistence"]
+        netmask = spec.get("netmask")
+        if netmask is not None and str(netmask) not in ("255.255.255.255",
+                                                        "128"):
+            kwargs["netmask"] = str(netmask)
+    if spec.get("flags"):
+        kwargs["flags"] = _schedflags(spec.get("scheduler"), spec["flags"])
+    return spec.get("scheduler"), kwargs
+
+def _serverspecs(servers):
+    """helper function to get the RealServers of a service description as
+    used by LVSManager.apply() as a list of (real_server, method, weight,
+    upper, lower, tun_type, tun_port, tun_csum) tuples
+    """
+    if isinstance(servers, dict):
+        return [(real_server, opts.get("method"), opts.get("weight", 1),
+                 opts.get("upper"), opts.get("lower"), opts.get("tun_type"),
+                 opts.get("tun_port"), opts.get("tun_csum"))
+                for real_server, opts in sorted(servers.items())]
+    return [tuple(server) + (None,) * (8 - len(server)) 
+            for server in servers]
+
+def _desired_servers(servers):
+    """helper function to normalise the RealServers of a service 
+    description as used by LVSManager.apply()
+    
+    returns a dict mapping the canonical address to a tuple of 
+    (real_server, method, weight, upper, lower, tun_type, tun_port, 
+    tun_csum)
+    """
+    result = {}
+    for server in _serverspecs(servers):
+        real_server, method, weight, upper, lower = server[:5]
+        if weight is None:
+            weight = 1
+        result[_canonaddr(real_server)] = (real_server, method, int(weight),
+                                           upper and int(upper) or None,
+                                           lower and int(lower) or None) + \
+                                          _tunopts(*server[5:])
+    return result
+
 def validatereal_server(service_addr, real_server, method="masq"):
     """validate that real_server is correct for given service_addr 
     and loadbalancing method
@@ -91,13 +487,13 @@ def validatereal_server(service_addr, real_server, method="masq"):
     #only masquerading realservers are allowed to have different ports
     if method != "masq":
         if portsa != portrs:
-            raise ValueError, "service_addr and RealServer port do not match, "\
-        "this is a must for the non Masquerading RealServers"
+            raise ValueError("service_addr and RealServer port do not match, "
+            "this is a must for the non Masquerading RealServers")
     
     #service_addr & realserver address should not be the same
     if ipsa == iprs:
-        raise ValueError, "service_addr & RealServer are the same, "\
-    "this is not allowed"
+        raise ValueError("service_addr & RealServer are the same, "
+                         "this is not allowed")
     
     #validate realserver ip address
     if not _chkip(iprs):
@@ -120,25 +516,1009 @@ def validateservice_addr(service_addr):
     return True
     
 
+def validatefwmark(fwmark):
+    """validate that fwmark is a valid firewall mark
+    """
+    try:
+        fwmark = int(fwmark)
+    except ValueError:
+        raise ValueError("invalid firewall mark specified")
+    if not _rangechk(1, 0xffffffff, fwmark):
+        raise ValueError("firewall mark outside range")
+    return True
+
+def _validateservice(proto, service_addr):
+    """validate proto and the service_addr or firewall mark of a service
+    """
+    if proto not in PROTOS:
+        raise ValueError("Provided name looks insane, proto part is "
+                         "invalid: {0}".format(proto))
+    if proto in FWM_PROTOS:
+        return validatefwmark(service_addr)
+    return validateservice_addr(service_addr)
+
+def _validateserver(proto, service_addr, real_server, method="masq"):
+    """validate a RealServer of any kind of service, firewall mark 
+    services have no port, so only the address family has to match
+    """
+    if proto not in FWM_PROTOS:
+        return validatereal_server(service_addr, real_server, method)
+    iprs = real_server.rsplit(':', 1)[0]
+    if proto == "fwm6" and not iprs.startswith("["):
+        raise ValueError("IPv4 RealServer not allowed with "
+                         "IPv6 Service")
+    if proto == "fwm" and iprs.startswith("["):
+        raise ValueError("IPv6 RealServer not allowed with "
+                         "IPv4 Service")
+    if not _chkip(iprs):
+        raise ValueError("invalid ip specified")
+    return True
+
+def _inrange(minval, maxval, candidate):
+    """like _rangechk, but False for candidates that are no integer
+    """
+    try:
+        return _rangechk(minval, maxval, candidate)
+    except (TypeError, ValueError):
+        return False
+
+def _cachedaddr(addresses, addr):
+    """helper function to parse addr only once per validate_state() call
+    
+    returns the Address, or the message telling why addr is invalid
+    """
+    result = addresses.get(addr)
+    if result is None:
+        try:
+            result = Address.parse(addr)
+            if not 0 <= result.port <= 65535:
+                result = "port outside range"
+        except (AttributeError, ValueError):
+            result = "invalid ip specified"
+        addresses[addr] = result
+    return result
+
+def _servererrors(proto, service, address, method, weight, upper, lower,
+                  tun_type=None, tun_port=None, tun_csum=None):
+    """list the violations of a RealServer of validate_state(), service 
+    being the Address of the service, None for firewall marks
+    """
+    errors = []
+    if service is None:
+        ipv6 = proto == "fwm6"
+    else:
+        ipv6 = service.family == socket.AF_INET6
+    if ipv6 and address.family != socket.AF_INET6:
+        errors.append("IPv4 RealServer not allowed with IPv6 Service")
+    elif not ipv6 and address.family == socket.AF_INET6:
+        errors.append("IPv6 RealServer not allowed with IPv4 Service")
+    if method not in METHODS:
+        errors.append("Invalid LoadBalancing Method: {0}".format(method))
+    elif service is not None and method != "masq" and \
+            address.port != service.port:
+        errors.append("service_addr and RealServer port do not match, "
+            "this is a must for the non Masquerading RealServers")
+    if service is not None and address.host == service.host:
+        errors.append("service_addr & RealServer are the same, "
+                      "this is not allowed")
+    if not _inrange(0, 65535, weight):
+        errors.append("weight outside of valid range, should be within 1 "
+                      "and 65535, was {0}".format(weight))
+    if upper is not None and not _inrange(1, 65535, upper):
+        errors.append("upper threshold outside of valid range, should be "
+                      "within 1 and 65535, was {0}".format(upper))
+    if lower is not None:
+        if upper is None:
+            errors.append("lower cannot appear without upper")
+        elif not _inrange(1, 65535, lower):
+            errors.append("lower threshold outside of valid range, should "
+                          "be within 1 and 65535, was {0}".format(lower))
+    return errors + _tunerrors(method, tun_type, tun_port, tun_csum)
+
+def validate_state(desired_state):
+    """validate a description of the IPVS table, as taken by 
+    LVSManager.apply(), and report every violation instead of the first
+    
+    every address is parsed once, no matter how often it appears
+    
+    returns a tuple (canonical, violations). canonical is desired_state 
+    with canonical service names and RealServer addresses, and servers 
+    as dicts, services and RealServers with violations are left out. 
+    violations is a list of LVSViolation tuples, empty if desired_state 
+    is valid, real_server is None for violations of the service
+    """
+    addresses = {}
+    canonical = {}
+    violations = []
+    for name in sorted(desired_state):
+        spec = desired_state[name]
+        proto, sep, service_addr = name.partition('_')
+        if not sep or proto not in PROTOS:
+            violations.append(LVSViolation(name, None, "Provided name looks "
+                "insane, proto part is invalid: {0}".format(proto)))
+            continue
+        service = None
+        if proto in FWM_PROTOS:
+            try:
+                validatefwmark(service_addr)
+            except ValueError as error:
+                violations.append(LVSViolation(name, None, str(error)))
+                continue
+            key = str(int(service_addr))
+        else:
+            service = _cachedaddr(addresses, service_addr)
+            if not isinstance(service, Address):
+                violations.append(LVSViolation(name, None, service))
+                continue
+            key = str(service)
+        cname = proto + "_" + key
+        if cname in canonical:
+            violations.append(LVSViolation(name, None, 
+                              "same service as {0}".format(cname)))
+            continue
+        
+        errors = []
+        scheduler = spec.get("scheduler")
+        persistence = spec.get("persistence")
+        if scheduler is not None and scheduler not in SCHEDULERS:
+            errors.append("selected scheduler is invalid")
+        elif spec.get("flags"):
+            try:
+                _schedflags(scheduler, spec["flags"])
+            except ValueError as error:
+                errors.append(str(error))
+        if persistence is not None and not _inrange(1, 65535, persistence):
+            errors.append("persistence outside of valid range, should be "
+                          "within 1 and 65535, was {0}".format(persistence))
+        elif persistence is not None and scheduler is None:
+            errors.append("persistence needs a scheduler")
+        if spec.get("netmask") is not None and persistence is None:
+            errors.append("netmask cannot appear without persistence")
+        violations += [LVSViolation(name, None, error) for error in errors]
+        
+        result = {}
+        for server in _serverspecs(spec.get("servers", ())):
+            real_server, method, weight, upper, lower = server[:5]
+            if weight is None:
+                weight = 1
+            address = _cachedaddr(addresses, real_server)
+            if not isinstance(address, Address):
+                violations.append(LVSViolation(name, real_server, address))
+                continue
+            address_errors = _servererrors(proto, service, address, method,
+                                           weight, upper, lower, *server[5:])
+            if str(address) in result:
+                address_errors.append("duplicate RealServer")
+            if address_errors:
+                violations += [LVSViolation(name, real_server, error) 
+                               for error in address_errors]
+                continue
+            result[str(address)] = {"method": method, "weight": int(weight),
+                                    "upper": upper and int(upper) or None,
+                                    "lower": lower and int(lower) or None}
+            tun_type, tun_port, tun_csum = _tunopts(*server[5:])
+            if tun_type is not None:
+                result[str(address)].update(tun_type=tun_type, 
+                    tun_port=tun_port, tun_csum=tun_csum)
+        if not errors:
+            canonical[cname] = dict(spec, servers=result)
+    return canonical, violations
+
+# flags of ipvsadm -Sn lines that take a value
+_VALUE_FLAGS = frozenset(("-t", "-u", "-f", "--sctp-service", "-s", "-p", 
+                          "-M", "-b", "-r", "-w", "-x", "-y", "--tun-type",
+                          "--tun-port"))
+
+def parse_dump(dump):
+    """tokenize the output of ipvsadm -Sn in a single pass per line
+    
+    dump: the output as string, or any iterable of lines like the stdout
+          pipe of ipvsadm, which is consumed as it is read
+    
+    yields a (command, proto, service_addr, options) tuple for every line,
+    like ("-a", "-t", "207.175.44.10:80", {"-r": "192.168.10.1:81", 
+    "-m": True, "-w": "1"}), flags without a value map to True
+    """
+    if hasattr(dump, "splitlines"):
+        dump = dump.splitlines()
+    value_flags = _VALUE_FLAGS
+    for line in dump:
+        tokens = line.split()
+        count = len(tokens)
+        if count < 3:
+            continue
+        options = {}
+        index = 3
+        while index < count:
+            token = tokens[index]
+            if token in value_flags and index + 1 < count:
+                options[token] = tokens[index + 1]
+                index += 2
+            else:
+                options[token] = True
+                index += 1
+        yield tokens[0], tokens[1], tokens[2], options
+
+class IpvsadmError(ValueError):
+    """raised when ipvsadm could not be run or exited with an error
+    
+    returncode: exit code of ipvsadm, None if it could not be run
+    stderr: what ipvsadm printed to stderr
+    """
+    
+    def __init__(self, message, returncode=None, stderr=""):
+        ValueError.__init__(self, message)
+        self.returncode = returncode
+        self.stderr = stderr
+
+def _ipvsadmerror(returncode, err):
+    """helper function to get the IpvsadmError of a failed ipvsadm run
+    """
+    message = "ipvsadm failed with exit code {0}".format(returncode)
+    if err and err.strip():
+        message += ": " + err.strip()
+    return IpvsadmError(message, returncode, err)
+
+def _commanderror(errmsg, error):
+    """helper function to get the IpvsadmError for a failed command, 
+    errmsg telling what failed, error being the ValueError of the backend
+    
+    the exit code and stderr of ipvsadm are kept
+    """
+    return IpvsadmError("{0}: {1}".format(errmsg, error), 
+                        getattr(error, "returncode", None),
+                        getattr(error, "stderr", ""))
+
+def netns_command(netns):
+    """argument list running ipvsadm in the network namespace netns
+    
+    netns: name of a namespace of ip netns, or the path of a namespace 
+           file like /proc/1234/ns/net, which is entered with nsenter
+    """
+    if "/" in netns:
+        return ["nsenter", "--net={0}".format(netns), IPVSADM]
+    return ["ip", "netns", "exec", netns, IPVSADM]
+
+
+class IpvsadmBackend(object):
+    """backend running commands through the ipvsadm command line client
+    
+    a backend takes ipvsadm style argument lists, so LVSManager and 
+    LVSInstance do not need to know how the IPVS table is actually changed
+    
+    backends changing the IPVS table of this host set procfs, so the 
+    read methods can use /proc/net/ip_vs instead of a dump
+    
+    every ipvsadm process is started by _popen(), failures raise 
+    IpvsadmError with the exit code and stderr of ipvsadm
+    """
+    
+    procfs = True
+    
+    def __init__(self, command=None):
+        """command: argument list running ipvsadm, like ["ssh", "lb1", 
+                 "sudo", "ipvsadm"] to manage another host, the local 
+                 ipvsadm if omitted. The table of another host is not in
+                 our procfs, so procfs is not used with a command
+        """
+        self.command = command
+        if command is not None:
+            self.procfs = False
+    
+    def _popen(self, args, stdin=False):
+        """start ipvsadm with args, stdout and stderr are captured
+        """
+        command = self.command
+        if command is None:
+            command = [IPVSADM]
+        try:
+            return subprocess.Popen(list(command) + args, 
+                                    stdin=subprocess.PIPE if stdin else None,
+                                    stdout=subprocess.PIPE, 
+                                    stderr=subprocess.PIPE,
+                                    universal_newlines=True)
+        except OSError as error:
+            raise IpvsadmError("ipvsadm failed: {0}".format(error))
+    
+    def execute(self, args):
+        """run a command that changes the IPVS table
+        """
+        cmd = self._popen(args)
+        out, err = cmd.communicate()
+        if cmd.returncode:
+            raise _ipvsadmerror(cmd.returncode, err)
+        return True
+    
+    def output(self, args):
+        """run a command and return what it printed
+        """
+        cmd = self._popen(args)
+        out, err = cmd.communicate()
+        if cmd.returncode:
+            raise _ipvsadmerror(cmd.returncode, err)
+        return out
+    
+    def stream(self, args):
+        """run a command and yield what it prints line by line, while it
+        is still running
+        """
+        cmd = self._popen(args)
+        try:
+            for line in iter(cmd.stdout.readline, ""):
+                yield line
+        finally:
+            cmd.stdout.close()
+            err = cmd.stderr.read()
+            cmd.stderr.close()
+            returncode = cmd.wait()
+        if returncode:
+            raise _ipvsadmerror(returncode, err)
+    
+    def restore(self, commands):
+        """apply a list of commands with a single ipvsadm -R call
+        
+        returns a list of (index, message) tuples for the commands that 
+        failed, ipvsadm does not tell which command failed, so index is 
+        always None
+        """
+        stream = "".join(" ".join(args) + "\n" for args in commands)
+        cmd = self._popen(["-R"], stdin=True)
+        out, err = cmd.communicate(stream)
+        
+        errors = [(None, line) for line in err.split("\n") if line]
+        if cmd.returncode and not errors:
+            errors.append((None, "ipvsadm -R failed with exit code "
+                                 "{0}".format(cmd.returncode)))
+        return errors
+    
+
+class Address(object):
+    """parsed ip:port address
+    
+    host is kept in its inet_ntop form, so equal addresses compare and
+    hash equal, str() gives the ip:port notation used by ipvsadm
+    """
+    
+    __slots__ = ("host", "port", "family")
+    
+    def __init__(self, host, port, family=socket.AF_INET):
+        self.host = host
+        self.port = int(port)
+        self.family = family
+    
+    @classmethod
+    def _from_dump(cls, addr):
+        """ip:port as printed by ipvsadm, which is already canonical
+        """
+        ipaddr, port = addr.rsplit(':', 1)
+        if ipaddr.startswith("["):
+            return cls(ipaddr[1:-1], port, socket.AF_INET6)
+        return cls(ipaddr, port)
+    
+    @classmethod
+    def parse(cls, addr):
+        """parse ip:port, IPv6 addresses have to be in brackets
+        """
+        try:
+            ipaddr, port = addr.rsplit(':', 1)
+            family = socket.AF_INET
+            if ipaddr.startswith("["):
+                family = socket.AF_INET6
+                ipaddr = ipaddr[1:-1]
+            ipaddr = socket.inet_ntop(family, socket.inet_pton(family, ipaddr))
+            return cls(ipaddr, port, family)
+        except (socket.error, ValueError):
+            raise ValueError("invalid address: {0}".format(addr))
+    
+    def __str__(self):
+        if self.family == socket.AF_INET6:
+            return "[{0}]:{1}".format(self.host, self.port)
+        return "{0}:{1}".format(self.host, self.port)
+    
+    def __repr__(self):
+        return "Address({0!r})".format(str(self))
+    
+    def __eq__(self, other):
+        if not isinstance(other, Address):
+            return NotImplemented
+        return self.host == other.host and self.port == other.port
+    
+    def __ne__(self, other):
+        if not isinstance(other, Address):
+            return NotImplemented
+        return not self == other
+    
+    def __hash__(self):
+        return hash((self.host, self.port))
+    
+
+class VirtualService(object):
+    """value type for a service of the IPVS table
+    """
+    
+    __slots__ = ("proto", "address", "scheduler", "persistence", "netmask",
+                 "flags")
+    
+    def __init__(self, proto, address, scheduler, persistence=None, 
+                 netmask=None, flags=()):
+        """proto: one of PROTOS
+        address: Address or ip:port string, the firewall mark for fwm
+                 and fwm6 services
+        scheduler: scheduler name
+        persistence: persistence timeout as integer, None if not set
+        netmask: persistence netmask, None if not set
+        flags: tuple of scheduler flags, empty if not set
+        """
+        if proto in FWM_PROTOS:
+            address = int(address)
+        elif not isinstance(address, Address):
+            address = Address.parse(address)
+        self.proto = proto
+        self.address = address
+        self.scheduler = scheduler
+        self.persistence = persistence
+        self.netmask = netmask
+        self.flags = tuple(flags)
+    
+    @property
+    def name(self):
+        """name of the service, as used by LVSManager.get_lvs_instance()
+        """
+        return self.proto + "_" + str(self.address)
+    
+    def opts(self, flags=False):
+        """(scheduler, persistence, netmask) as returned by 
+        LVSInstance.get_opts(), with the scheduler flags appended if flags
+        is set
+        """
+        persistence = self.persistence
+        if persistence is not None:
+            persistence = str(persistence)
+        if flags:
+            return (self.scheduler, persistence, self.netmask, self.flags)
+        return (self.scheduler, persistence, self.netmask)
+    
+    def _key(self):
+        return (self.proto, self.address, self.scheduler, self.persistence,
+                self.netmask, self.flags)
+    
+    def __eq__(self, other):
+        if not isinstance(other, VirtualService):
+            return NotImplemented
+        return self._key() == other._key()
+    
+    def __ne__(self, other):
+        if not isinstance(other, VirtualService):
+            return NotImplemented
+        return not self == other
+    
+    def __hash__(self):
+        return hash(self._key())
+    
+    def __repr__(self):
+        return "VirtualService({0!r}, {1!r}, {2!r}, {3!r}, {4!r}, " \
+               "{5!r})".format(self.proto, str(self.address), self.scheduler,
+                               self.persistence, self.netmask, self.flags)
+    
+
+class RealServer(object):
+    """value type for a RealServer of a service
+    """
+    
+    __slots__ = ("address", "method", "weight", "upper", "lower", 
+                 "tun_type", "tun_port", "tun_csum")
+    
+    def __init__(self, address, method, weight=1, upper=None, lower=None,
+                 tun_type=None, tun_port=None, tun_csum=None):
+        """address: Address or ip:port string
+        method: forwarding method (ipip, masq, route)
+        weight: weight as integer
+        upper, lower: thresholds as integers, None if not set
+        tun_type: encapsulation of ipip RealServers, gue or gre, None for
+                  plain ipip
+        tun_port: gue destination port as integer, None if not set
+        tun_csum: checksum option of gue and gre, see TUN_CSUMS
+        """
+        if not isinstance(address, Address):
+            address = Address.parse(address)
+        self.address = address
+        self.method = method
+        self.weight = int(weight)
+        self.upper = upper
+        self.lower = lower
+        self.tun_type = tun_type
+        self.tun_port = tun_port
+        self.tun_csum = tun_csum
+    
+    def as_tuple(self):
+        """(real_server, method, weight) as returned by 
+        LVSInstance.list_servers()
+        """
+        return (str(self.address), self.method, str(self.weight))
+    
+    def _key(self):
+        return (self.address, self.method, self.weight, self.upper, 
+                self.lower, self.tun_type, self.tun_port, self.tun_csum)
+    
+    def __eq__(self, other):
+        if not isinstance(other, RealServer):
+            return NotImplemented
+        return self._key() == other._key()
+    
+    def __ne__(self, other):
+        if not isinstance(other, RealServer):
+            return NotImplemented
+        return not self == other
+    
+    def __hash__(self):
+        return hash(self._key())
+    
+    def __repr__(self):
+        result = "RealServer({0!r}, {1!r}, {2!r}, {3!r}, {4!r}".format(
+            str(self.address), self.method, self.weight, self.upper, 
+            self.lower)
+        if self.tun_type is not None:
+            result += ", {0!r}, {1!r}, {2!r}".format(self.tun_type, 
+                                                     self.tun_port, 
+                                                     self.tun_csum)
+        return result + ")"
+    
+
+class LVSSnapshot(object):
+    """parsed copy of the IPVS table
+    
+    the output of ipvsadm -Sn is parsed once into VirtualService and
+    RealServer objects, services are indexed by (proto, service_addr) and 
+    RealServers by (proto, service_addr, real_server), so looking them up 
+    does not need another dump
+    """
+    
+    def __init__(self, dump, partial=False):
+        """dump: output of ipvsadm -Sn
+        partial: the dump was read from procfs, it does not include the 
+                 RealServer thresholds and persistence is in jiffies
+        """
+        self.created = _now()
+        self.partial = partial
+        self.services = {}
+        self.servers = {}
+        self.real_servers = {}
+        self.order = []
+        
+        # the parsed objects can not form reference cycles, so the cyclic
+        # garbage collector only slows down building millions of them
+        collect = gc.isenabled()
+        gc.disable()
+        try:
+            self._parse(dump)
+        finally:
+            if collect:
+                gc.enable()
+    
+    def _parse(self, dump):
+        """fill the indexes from the records of parse_dump()
+        """
+        services = self.services
+        # equal addresses share one Address object
+        addresses = {}
+        current = None
+        for command, proto, addr, options in parse_dump(dump):
+            if command == "-A":
+                if proto in _PROTOS:
+                    key = (_PROTOS[proto], addr)
+                    address = Address._from_dump(addr)
+                elif proto == "-f":
+                    key = (_fwmproto(options), addr)
+                    address = addr
+                else:
+                    continue
+                persistence = options.get("-p")
+                netmask = None
+                if persistence is not None:
+                    persistence = int(persistence)
+                    netmask = options.get("-M")
+                if key not in services:
+                    self.order.append(key)
+                    self.servers[key] = []
+                    self.real_servers[key] = {}
+                flags = options.get("-b")
+                services[key] = VirtualService(key[0], address, 
+                    options.get("-s"), persistence, netmask, 
+                    flags.split(",") if flags else ())
+                current = None
+            elif command == "-a" and "-r" in options:
+                # the RealServers of a service follow its -A line
+                if current != (proto, addr) or proto == "-f":
+                    if proto in _PROTOS:
+                        key = (_PROTOS[proto], addr)
+                    elif proto == "-f":
+                        key = (_fwmproto(options), addr)
+                    else:
+                        continue
+                    servers = self.servers.setdefault(key, [])
+                    index = self.real_servers.setdefault(key, {})
+                    current = (proto, addr)
+                real_server = options["-r"]
+                address = addresses.get(real_server)
+                if address is None:
+                    address = addresses[real_server] = \
+                        Address._from_dump(real_server)
+                if "-m" in options:
+                    method = "masq"
+                elif "-g" in options:
+                    method = "route"
+                elif "-i" in options:
+                    method = "ipip"
+                else:
+                    method = None
+                upper = options.get("-x")
+                lower = options.get("-y")
+                server = RealServer(address, method, options.get("-w", 1), 
+                                    upper and int(upper), 
+                                    lower and int(lower))
+                if "--tun-type" in options:
+                    for tun_csum in TUN_CSUMS:
+                        if "--tun-" + tun_csum in options:
+                            break
+                    else:
+                        tun_csum = None
+                    server.tun_type, server.tun_port, server.tun_csum = \
+                        _tunopts(options["--tun-type"], 
+                                 options.get("--tun-port"), tun_csum)
+                servers.append(server)
+                index[real_server] = server
+    
+    def age(self):
+        """seconds since this snapshot was taken
+        """
+        return _now() - self.created
+    
+    def has_service(self, proto, service_addr):
+        """check if the service is in the IPVS table
+        """
+        return _servicekey(proto, service_addr) in self.services
+    
+    def list_services(self):
+        """list of (proto, service_addr) tuples, in the order of the dump
+        """
+        return list(self.order)
+    
+    def get_service(self, proto, service_addr):
+        """VirtualService of the service, None if it does not exist
+        """
+        return self.services.get(_servicekey(proto, service_addr))
+    
+    def get_opts(self, proto, service_addr, flags=False):
+        """(scheduler, persistence, netmask) of the service, with the 
+        scheduler flags appended if flags is set, None if the service does
+        not exist
+        """
+        service = self.get_service(proto, service_addr)
+        if service is None:
+            return None
+        return service.opts(flags)
+    
+    def get_servers(self, proto, service_addr):
+        """list of the RealServer objects of the service
+        """
+        return list(self.servers.get(_servicekey(proto, service_addr), []))
+    
+    def list_servers(self, proto, service_addr):
+        """list of (real_server, method, weight) tuples of the service
+        """
+        return [server.as_tuple() for server 
+                in self.servers.get(_servicekey(proto, service_addr), [])]
+    
+    def get_real_server(self, proto, service_addr, real_server):
+        """RealServer object, None if the RealServer does not exist
+        """
+        servers = self.real_servers.get(_servicekey(proto, service_addr))
+        if servers is None:
+            return None
+        return servers.get(_canonaddr(real_server))
+    
+    def get_server(self, proto, service_addr, real_server):
+        """(real_server, method, weight) tuple, 
+        None if the RealServer does not exist
+        """
+        server = self.get_real_server(proto, service_addr, real_server)
+        if server is None:
+            return None
+        return server.as_tuple()
+    
+    def get_thresholds(self, proto, service_addr, real_server):
+        """(upper, lower) thresholds of a RealServer, None if not set
+        """
+        server = self.get_real_server(proto, service_addr, real_server)
+        if server is None:
+            return (None, None)
+        return (server.upper, server.lower)
+    
+
+def _dump_blocks(dump):
+    """split ipvsadm -Sn output into the lines of every service
+    
+    returns a list of (key, text) tuples in the order of the dump, key 
+    being the -A line up to the scheduler
+    """
+    blocks = []
+    lines = None
+    for line in dump.splitlines():
+        if line.startswith("-A "):
+            lines = [line]
+            blocks.append((line.split(" -s ", 1)[0], lines))
+        elif lines is not None and line.startswith("-a "):
+            lines.append(line)
+    return [(key, "\n".join(lines)) for key, lines in blocks]
+
+def _digest(text):
+    return hashlib.sha1(text.encode("utf8")).digest()
+
+
+class LVSWatcher(object):
+    """reports the changes of the IPVS table between two polls
+    
+    /proc/net/ip_vs is compared first if the manager can read it, so an 
+    unchanged table costs no ipvsadm call. Otherwise the ipvsadm -Sn 
+    output is compared, and an unchanged table is not parsed. Of a 
+    changed table only the services whose lines changed are parsed and 
+    compared.
+    
+    procfs does not show the RealServer thresholds, the tunnel options 
+    and the scheduler flags, so while it is unchanged the ipvsadm -Sn 
+    output is only compared every full_every polls, which is when a 
+    change of only these is noticed
+    """
+    
+    def __init__(self, manager, full_every=10):
+        """manager: LVSManager whose table is watched
+        full_every: compare the ipvsadm -Sn output every full_every polls
+                    even if procfs is unchanged, never if None
+        """
+        self.manager = manager
+        self.full_every = full_every
+        self.polls = 0
+        self.procfs_digest = None
+        self.digest = None
+        self.blocks = {}
+        self.services = {}
+        self.order = []
+    
+    def poll(self):
+        """read the IPVS table and return a list of LVSChange tuples, the
+        first poll only takes the table as a base and returns []
+        """
+        self.polls += 1
+        dump = self.manager._read_procfs()
+        if dump is not None:
+            procfs_digest = _digest(dump)
+            full = self.full_every and self.polls % self.full_every == 0
+            if procfs_digest == self.procfs_digest and not full:
+                return []
+            self.procfs_digest = procfs_digest
+        dump = "\n".join(self.manager._lines(["-Sn"]))
+        digest = _digest(dump)
+        if digest == self.digest:
+            return []
+        first = self.digest is None
+        self.digest = digest
+        changes = self._compare(_dump_blocks(dump))
+        if first:
+            return []
+        return changes
+    
+    def _compare(self, blocks):
+        """compare the blocks of the new dump with the previous ones and
+        keep them for the next poll
+        """
+        changes = []
+        services = {}
+        for key, text in blocks:
+            if self.blocks.get(key) == text:
+                services[key] = self.services[key]
+                continue
+            snapshot = LVSSnapshot(text)
+            for skey in snapshot.list_services():
+                service = snapshot.services[skey]
+                servers = _serverindex(snapshot, skey)
+                services[key] = (service, servers)
+                old, old_servers = self.services.get(key, (None, {}))
+                changes += self._diff(old, old_servers, service, servers)
+        for key in self.order:
+            if key not in services:
+                old, old_servers = self.services[key]
+                changes += self._diff(old, old_servers, None, {})
+        self.blocks = dict(blocks)
+        self.services = services
+        self.order = [key for key, text in blocks]
+        return changes
+    
+    @staticmethod
+    def _diff(old, old_servers, new, new_servers):
+        """list the changes between two versions of a service, either 
+        one can be None
+        """
+        name = (new or old).name
+        changes = []
+        if old is None:
+            changes.append(LVSChange('service_added', name, None, None, new))
+        elif new is not None and new != old:
+            changes.append(LVSChange('service_changed', name, None, old, 
+                                     new))
+        for real_server, server in new_servers.items():
+            before = old_servers.get(real_server)
+            if before is None:
+                changes.append(LVSChange('server_added', name, real_server,
+                                         None, server))
+            elif before != server:
+                changes.append(LVSChange('server_changed', name, 
+                                         real_server, before, server))
+        for real_server, server in old_servers.items():
+            if real_server not in new_servers:
+                changes.append(LVSChange('server_removed', name, 
+                                         real_server, server, None))
+        if new is None:
+            changes.append(LVSChange('service_removed', name, None, old, 
+                                     None))
+        return changes
+    
+    def changes(self, interval=1.0):
+        """poll every interval seconds, yield every LVSChange found
+        """
+        while True:
+            for change in self.poll():
+                yield change
+            time.sleep(interval)
+    
+
+def _serverindex(snapshot, key):
+    """RealServers of a service of a LVSSnapshot, keyed by ip:port
+    """
+    return collections.OrderedDict((str(server.address), server)
+                                   for server in snapshot.servers.get(key, ()))
+
+def diff_snapshots(old, new):
+    """list the changes from one LVSSnapshot to another as LVSChange 
+    tuples, like LVSWatcher reports them
+    
+    partial snapshots lack the RealServer thresholds and have persistence
+    in jiffies, so compare them only to partial ones
+    """
+    changes = []
+    for key in new.order:
+        changes += LVSWatcher._diff(old.services.get(key), 
+                                    _serverindex(old, key), 
+                                    new.services[key], _serverindex(new, key))
+    for key in old.order:
+        if key not in new.services:
+            changes += LVSWatcher._diff(old.services[key], 
+                                        _serverindex(old, key), None, {})
+    return changes
+
+
+def _linekeys(commands):
+    """helper function to key the -A and -a lines of ipvsadm -Sn, given 
+    as argument lists, by (service name, real_server), real_server being
+    None for -A lines
+    
+    returns a list of (key, args) tuples in the order of the lines
+    """
+    keyed = []
+    for args, (command, proto, addr, options) in zip(commands, 
+            parse_dump(" ".join(args) for args in commands)):
+        if proto in _PROTOS:
+            name = _PROTOS[proto] + "_" + addr
+        elif proto == "-f":
+            name = _fwmproto(options) + "_" + addr
+        else:
+            continue
+        keyed.append(((name, options.get("-r") if command == "-a" 
+                       else None), args))
+    return keyed
+
+
+class LVSCheckpoint(object):
+    """saved copy of the IPVS table, the timeouts and the tunables
+    
+    the file starts with a JSON header line with format, version, 
+    created, timeouts, tunables and the number of commands. The -A and 
+    -a lines of ipvsadm -Sn follow as they are, so they are written and
+    read without any parsing, and tail -n +2 of the file can be fed to 
+    ipvsadm -R
+    """
+    
+    def __init__(self, commands, timeouts=None, tunables=None, 
+                 created=None):
+        """commands: lists of ipvsadm arguments adding the services and 
+                  RealServers
+        timeouts: (tcp, tcpfin, udp) tuple, None if unknown
+        tunables: dict mapping TUNABLES to their values, None if unknown
+        created: unix time the table was saved
+        """
+        self.commands = commands
+        self.timeouts = timeouts
+        self.tunables = tunables
+        self.created = created
+    
+    @classmethod
+    def read(cls, path):
+        """read a checkpoint file, raises ValueError if it is none, is of
+        another version or is truncated
+        """
+        try:
+            with open(path) as checkpoint:
+                header = json.loads(checkpoint.readline())
+                commands = [line.split() for line in checkpoint]
+        except (IOError, OSError) as error:
+            raise ValueError("could not read checkpoint {0}: {1}".format(
+                             path, error))
+        except ValueError as error:
+            raise ValueError("invalid checkpoint {0}: {1}".format(path, 
+                                                                  error))
+        if (not isinstance(header, dict) or 
+                header.get("format") != CHECKPOINT_FORMAT):
+            raise ValueError("{0} is not a checkpoint".format(path))
+        if header.get("version") != CHECKPOINT_VERSION:
+            raise ValueError("unsupported checkpoint version {0} of "
+                             "{1}".format(header.get("version"), path))
+        if header.get("commands") != len(commands):
+            raise ValueError("checkpoint {0} is truncated, {1} of {2} "
+                             "commands found".format(path, len(commands),
+                                                     header.get("commands")))
+        for index, args in enumerate(commands):
+            if len(args) < 3 or args[0] not in ("-a", "-A"):
+                raise ValueError("invalid checkpoint {0}: line {1} is not "
+                                 "a -A or -a command".format(path, index + 2))
+        timeouts = header.get("timeouts")
+        return cls(commands, timeouts and tuple(timeouts), 
+                   header.get("tunables"), header.get("created"))
+    
+    def write(self, path):
+        """write the checkpoint file, to a temporary file first that is
+        renamed to path, so path is never left half written
+        """
+        header = {"format": CHECKPOINT_FORMAT, "version": CHECKPOINT_VERSION,
+                  "created": self.created, "timeouts": self.timeouts,
+                  "tunables": self.tunables, "commands": len(self.commands)}
+        temp = path + ".tmp"
+        try:
+            with open(temp, "w") as checkpoint:
+                checkpoint.write(json.dumps(header, sort_keys=True) + "\n")
+                checkpoint.write("".join(" ".join(args) + "\n" 
+                                         for args in self.commands))
+            os.rename(temp, path)
+        except (IOError, OSError) as error:
+            raise ValueError("could not write checkpoint {0}: {1}".format(
+                             path, error))
+    
+    def snapshot(self):
+        """return a LVSSnapshot of the saved table
+        """
+        return LVSSnapshot("\n".join(" ".join(args) 
+                                     for args in self.commands))
+    
+
 class LVSInstance():
     """represents an Instance of a loadbalanced Service 
     """
     
-    regex_mask = re.compile(".*-M (\S{1,})")
-    regex_pers = re.compile(".*-p (\S{1,})")
-    regex_sched = re.compile(".*-s (rr|wrr|lc|wlc|lblc|lblcr|dh|sh|sed|nq).*")
-    regex_rs = re.compile(".*-r (\S{1,}) (-(g|i|m)) -w (\S{1,})")
-    
-    def __init__(self, service_addr, proto):
+    def __init__(self, service_addr, proto, manager=None):
         """manage an existing LVS instance 
         
-        service_addr: ip:port
-        proto: udp or tcp
+        service_addr: ip:port, the firewall mark for fwm and fwm6
+        proto: one of PROTOS, fwm and fwm6 are IPv4 and IPv6 firewall
+               mark services
+        manager: LVSManager (or LVSTransaction) that runs the commands,
+                 a LVSManager with the default backend is used if omitted
         
         """
         self.service_addr = service_addr
         self.proto = proto
         self.prtcmd = _prtcmd(proto)
+        self.svccmd = _svccmd(proto, service_addr)
+        if manager is None:
+            manager = LVSManager()
+        self.manager = manager
         
     def __str__(self):
         """set name of this object
@@ -165,6 +1545,17 @@ class LVSInstance():
             return False
         else:
             return True
+    
+    def __hash__(self):
+        """hash like the name, so instances and names can be mixed in 
+        sets and dicts
+        """
+        return hash(self.__str__())
+
+    def _execute(self, args, errmsg):
+        """run ipvsadm arguments through our manager
+        """
+        return self.manager._execute(args, errmsg)
 
     def add_server(self, real_server, method, **kwargs):
         """add new RealServer
@@ -176,13 +1567,15 @@ class LVSInstance():
         weight: weight
         upper: upper threshold 
         lower: lover threshold, cannot appear without upper
+        tun_type: encapsulation of ipip, one of TUN_TYPES
+        tun_port: destination port of gue
+        tun_csum: checksum of gue and gre, one of TUN_CSUMS
         """
         
         #check if RealServer matches our service_addr
-        validatereal_server(self.service_addr, real_server, method)
+        _validateserver(self.proto, self.service_addr, real_server, method)
         
-        cmd = [IPVSADM, "-a", self.prtcmd, self.service_addr, 
-               "-r", real_server, _mthcmd(method)]
+        cmd = ["-a"] + self.svccmd + ["-r", real_server, _mthcmd(method)]
         
         # check for optional arguments & add them to the base command
         if 'weight' in kwargs:
@@ -209,12 +1602,10 @@ class LVSInstance():
                 raise ValueError("lower threshold outside of valid range, "
             "should be within 1 and 65535, was {0}".format(kwargs['lower']))
         
+        cmd = cmd + _tuncmd(method, **kwargs)
+        
         #lets try to add this RealServer
-        try:
-            subprocess.check_call(cmd)
-            return True
-        except:
-            raise ValueError("could not add RealServer to service_addr, "
+        return self._execute(cmd, "could not add RealServer to service_addr, "
                              "probably already added?")
         
         
@@ -225,17 +1616,13 @@ class LVSInstance():
         """
         
         #check if realserver matches our service_addr
-        validatereal_server(self.service_addr, real_server)
+        _validateserver(self.proto, self.service_addr, real_server)
         
-        cmd = [IPVSADM, "-d", self.prtcmd, self.service_addr, "-r", real_server]
+        cmd = ["-d"] + self.svccmd + ["-r", real_server]
         
         #lets try to remove this RealServer
-        try:
-            subprocess.check_call(cmd)
-            return True
-        except:
-            raise ValueError("could not remove RealServer from service_addr, "
-                             "probably already removed?")
+        return self._execute(cmd, "could not remove RealServer from "
+                             "service_addr, probably already removed?")
         
     def edit_server(self, real_server, method, **kwargs):
         """add new RealServer
@@ -247,13 +1634,13 @@ class LVSInstance():
         weight: weight
         upper: upper threshold 
         lower: lover threshold
+        tun_type, tun_port, tun_csum: see add_server()
         """
         
         #check if RealServer matches our service_addr        
-        validatereal_server(self.service_addr, real_server, method)
+        _validateserver(self.proto, self.service_addr, real_server, method)
         
-        cmd = [IPVSADM, "-e", self.prtcmd, self.service_addr,
-               "-r", real_server, _mthcmd(method)]
+        cmd = ["-e"] + self.svccmd + ["-r", real_server, _mthcmd(method)]
         
         # check for optional arguments & add them to the base command
         if 'weight' in kwargs:
@@ -280,44 +1667,25 @@ class LVSInstance():
                 raise ValueError("lower threshold outside of valid range, "
             "should be within 1 and 65535, was {0}".format(kwargs['lower']))
         
-        #lets try to add this RealServer
-
-        try:
-            subprocess.check_call(cmd)
-            return True
-        except:
-            raise ValueError("could not edit RealServer for this service_addr, "
-                             "probably not added?")
+        cmd = cmd + _tuncmd(method, **kwargs)
+        
+        #lets try to edit this RealServer
+        return self._execute(cmd, "could not edit RealServer for this "
+                             "service_addr, probably not added?")
         
     def list_servers(self):
         """ return a list with of tuples containing RealServers, 
         balancing method, and weight associated with this Service
         """
-        
-        cmd = subprocess.Popen([IPVSADM, "-Sn"], stdout=subprocess.PIPE)
-        out, err = cmd.communicate()
-
-        if err:
-            raise ValueError("something has failed: {0}".format(err))
-        candidates = out.split("\n")
-        
-        result = []
-        
-        for candidate in candidates:
-            if candidate.startswith("-a "+self.prtcmd+" "+self.service_addr+
-                                    " -r "):
-                match = self.regex_rs.match(candidate)
-                real_server = match.group(1)
-                proto = match.group(2)
-                if proto == "-m":
-                    proto = "masq"
-                elif proto == "-g":
-                    proto = "route"
-                else:
-                    proto = "ipip"
-                weight = match.group(4)
-                result.append((real_server, proto, weight))
-        return result
+        return self.manager.snapshot(partial=True).list_servers(
+            self.proto, self.service_addr)
+    
+    def get_servers(self):
+        """list RealServers of this service_addr as RealServer objects,
+        with integer weight and thresholds
+        """
+        return self.manager.snapshot().get_servers(self.proto, 
+                                                   self.service_addr)
             
     def set_opts(self, scheduler, **kwargs):
         """set options for a service_addr
@@ -327,111 +1695,241 @@ class LVSInstance():
         optional args:
         persistence:
         netmask:
+        flags: list of scheduler flags, like ["mh-fallback", "mh-port"],
+               see SCHED_FLAGS
         """
-        if scheduler in SCHEDULERS:
-            cmd = [IPVSADM, "-E", self.prtcmd, self.service_addr, 
-                   "-s", scheduler]
-        else:
-            raise ValueError("selected scheduler is invalid")
-        
-        if "persistence" in kwargs:
-            if _rangechk(1, 65535, kwargs["persistence"]):
-                cmd = cmd + ['-p', str(kwargs["persistence"])]
-            else:
-                raise ValueError("persistence outside of valid range, should "
-            "be within 1 and 65535, was {0}".format(kwargs['persistence']))
-        #FIXME: we should check that we have a valid netmask
-        if "netmask" in kwargs:
-            if not "persistence" in kwargs:
-                raise ValueError("netmask cannot appear without persistence")
-            cmd = cmd +["-M", kwargs["netmask"]]
-        
-        try:
-            subprocess.check_call(cmd)
-            return True
-        except:
-            raise ValueError("something went wrong")
+        cmd = ["-E"] + self.svccmd + _optscmd(scheduler, **kwargs)
+        return self._execute(cmd, "something went wrong")
                 
     
-    def get_opts(self):
+    def get_opts(self, flags=False):
         """get options for this service_addr
         
         will return a tuple like (scheduler, persistence, netmask)
         
         persistence and netmask are only returned if set
+        
+        flags: append the tuple of scheduler flags, like 
+               ("sh-fallback", "sh-port")
         """
-
-        cmd = subprocess.Popen([IPVSADM, "-Sn"], stdout=subprocess.PIPE)
-        out, err = cmd.communicate()
+        snapshot = self.manager.snapshot(partial=True)
+        opts = snapshot.get_opts(self.proto, self.service_addr, flags)
+        if snapshot.partial and opts is not None and (
+                flags or opts[1] is not None):
+            # procfs shows the persistence timeout in jiffies and does 
+            # not show the scheduler flags
+            snapshot = self.manager.snapshot()
+            opts = snapshot.get_opts(self.proto, self.service_addr, flags)
+        return opts
+    
+    def get_service(self):
+        """get this service_addr as VirtualService object, None if it is
+        not in the IPVS table
+        """
+        return self.manager.snapshot().get_service(self.proto, 
+                                                   self.service_addr)
         
-        if err:
-            raise ValueError("something has failed: {0}".format(err))
-        out = out.split("\n")
+    def get_stats(self, zero=False):
+        """get the statistics of this service_addr
         
-        for line in out:
-            if line.startswith("-A "+self.prtcmd+" "+self.service_addr):
-                scheduler = self.regex_sched.match(line).group(1)
-                persistence = None
-                netmask = None
-                persistence = self.regex_pers.match(line)
-                if persistence:
-                    persistence = persistence.group(1)
-                    netmask = self.regex_mask.match(line)
-                    if netmask:
-                        netmask = netmask.group(1)
-                return (scheduler, persistence, netmask)
+        returns a tuple (stats, servers), stats being a LVSStats with the
+        counters, rates and connections of the service, and servers a dict
+        mapping every RealServer to its LVSStats
+        
+        zero: reset the counters right after they are read, packets 
+              arriving between the read and the reset are lost
+        """
+        stats = self.manager._get_stats(self.svccmd)
+        if zero:
+            self.zero()
+        for name, result in stats.items():
+            return result
+        raise ValueError("{0} not found in IPVS table".format(self))
+    
+    def get_conn_distribution(self, sync=False):
+        """count the entries of the connection table of this service_addr
+        
+        returns a tuple (servers, states), servers being a dict mapping 
+        every RealServer to a dict of per state counts like 
+        {"ESTABLISHED": 10, "FIN_WAIT": 2}, and states the per state 
+        counts of the whole service
         
+        sync: read ip_vs_conn_sync instead of ip_vs_conn
+        
+        the connection table is streamed from procfs, so this works with
+        millions of entries, but takes its time. It does not show 
+        firewall marks, so this does not work for fwm and fwm6 services
+        """
+        if self.proto in FWM_PROTOS:
+            raise ValueError("the connection table does not show firewall "
+                             "marks")
+        try:
+            return procfs.aggregate_connections(self.proto, self.service_addr,
+                                                self.manager.proc_root, sync)
+        except (IOError, OSError) as error:
+            raise ValueError("could not read connection table: "
+                             "{0}".format(error))
+    
     def zero(self):
         """Zero the packet, byte and rate counters for this service_addr
         """
-        try:
-            subprocess.check_call([IPVSADM, "-Z", self.prtcmd, 
-                                   self.service_addr])
-            return True
-        except:
-            raise ValueError("could not reset counters")
+        return self._execute(["-Z"] + self.svccmd,
+                             "could not reset counters")
     
 class LVSManager():
     """class for handling LVSInstances
     """
     
-    def __init__(self):
-        pass
+    def __init__(self, backend=None, ttl=0, proc_root=None, netns=None):
+        """backend: object running the ipvsadm style commands, 
+                 IpvsadmBackend if omitted (see pylvs.netlink for a 
+                 backend talking to the kernel directly)
+        ttl: seconds a snapshot of the IPVS table is reused by the
+             read methods, changes made through this manager invalidate
+             it right away
+        proc_root: where procfs is mounted, /proc if omitted
+        netns: network namespace to manage instead of ours, ipvsadm 
+               is run in it with netns_command(), so backend must be 
+               omitted. The table is read with ipvsadm too, but the 
+               sysctl and connection table methods read proc_root, 
+               which should then be a procfs mounted inside netns
+        """
+        if netns is not None:
+            if backend is not None:
+                raise ValueError("netns and backend exclude each other")
+            backend = IpvsadmBackend(netns_command(netns))
+        if backend is None:
+            backend = IpvsadmBackend()
+        self.backend = backend
+        self.netns = netns
+        self.ttl = ttl
+        self.proc_root = proc_root
+        self._snapshot = None
+    
+    def _execute(self, args, errmsg):
+        """run ipvsadm arguments through our backend
+        
+        raises IpvsadmError with errmsg and the error of the backend, 
+        keeping its exit code and stderr, if this fails
+        """
+        try:
+            return self.backend.execute(args)
+        except ValueError as error:
+            raise _commanderror(errmsg, error)
+        finally:
+            self.invalidate()
+    
+    def snapshot(self, max_age=None, partial=False):
+        """return a LVSSnapshot of the IPVS table
+        
+        max_age: reuse the cached snapshot if it is not older than this,
+                 defaults to the ttl of this manager
+        partial: the RealServer thresholds are not needed, so the table 
+                 can be read from /proc/net/ip_vs without running ipvsadm
+        """
+        if max_age is None:
+            max_age = self.ttl
+        snapshot = self._snapshot
+        if (snapshot is None or snapshot.age() > max_age or max_age <= 0 or
+                (snapshot.partial and not partial)):
+            dump = None
+            if partial:
+                dump = self._read_procfs()
+            if dump is None:
+                snapshot = LVSSnapshot(self._lines(["-Sn"]))
+            else:
+                snapshot = LVSSnapshot(dump, partial=True)
+            self._snapshot = snapshot
+        return snapshot
+    
+    def _read_procfs(self):
+        """the IPVS table from procfs in ipvsadm -Sn format, None if our
+        backend does not manage the table of this host, ip_vs is missing
+        or does not tell everything a partial snapshot needs
+        """
+        if not getattr(self.backend, "procfs", False):
+            return None
+        try:
+            return procfs.dump_services(self.proc_root)
+        except (IOError, OSError, ValueError):
+            return None
+    
+    def invalidate(self):
+        """drop the cached snapshot, the next read dumps the table again
+        """
+        self._snapshot = None
+    
+    def _lines(self, args):
+        """run ipvsadm arguments through our backend, yield the output 
+        line by line, as it arrives if the backend can stream it
+        """
+        try:
+            stream = getattr(self.backend, "stream", None)
+            if stream is None:
+                lines = self.backend.output(args).splitlines()
+            else:
+                lines = stream(args)
+            for line in lines:
+                yield line
+        except ValueError as error:
+            raise ValueError("something has failed: {0}".format(error))
+    
+    def _output(self, args):
+        """run ipvsadm arguments through our backend, return the output
+        """
+        try:
+            return self.backend.output(args)
+        except ValueError as error:
+            raise ValueError("something has failed: {0}".format(error))
+    
+    def transaction(self):
+        """start a new LVSTransaction
+        
+        use it as a context manager, all changes made through the 
+        transaction (or through LVSInstance objects obtained from it)
+        are applied with a single ipvsadm -R call when the block exits
+        """
+        return LVSTransaction(self.backend, self)
     
-    def add_lvs_instance(self, service_addr, proto):
+    def add_lvs_instance(self, service_addr, proto, scheduler=None, **kwargs):
         """add new new LVS instance, will return an LVSInstance object
         
-        service_addr: service_addr:port of the service to add
-        proto: udp or tcp
+        service_addr: service_addr:port of the service to add, the 
+                      firewall mark for fwm and fwm6
+        proto: one of PROTOS
+        
+        optional args, see LVSInstance.set_opts():
+        scheduler: ipvsadm picks its default scheduler if omitted
+        persistence:
+        netmask:
+        flags:
         """
         
-        validateservice_addr(service_addr)
+        _validateservice(proto, service_addr)
         
-        prtcmd = _prtcmd(proto)
+        cmd = ["-A"] + _svccmd(proto, service_addr)
+        if scheduler is not None:
+            cmd = cmd + _optscmd(scheduler, **kwargs)
+        elif kwargs:
+            raise ValueError("persistence, netmask and flags need a "
+                             "scheduler")
             
-        try:
-            subprocess.check_call([IPVSADM, "-A", prtcmd, service_addr])
-            return LVSInstance(service_addr, proto)
-        except:
-            raise ValueError("could not create LVS instance, "
-                             "seems to already exist ")
+        self._execute(cmd, "could not create LVS instance, "
+                      "seems to already exist ")
+        return LVSInstance(service_addr, proto, self)
         
     def del_lvs_instance(self, service_addr, proto):
         """deletes LVS instance
         
-        service_addr: service_addr:port of the service to deleate 
-        proto: udp or tcp
+        service_addr: service_addr:port of the service to deleate, the
+                      firewall mark for fwm and fwm6
+        proto: one of PROTOS
         """
         
-        validateservice_addr(service_addr)
-        
-        prtcmd = _prtcmd(proto)
+        _validateservice(proto, service_addr)
         
-        try:
-            subprocess.check_call([IPVSADM, "-D", prtcmd, service_addr])
-            return True
-        except:
-            raise ValueError("could not delete LVS instance, already gone?")
+        return self._execute(["-D"] + _svccmd(proto, service_addr),
+                             "could not delete LVS instance, already gone?")
         
     def get_lvs_instance(self, name):
         """get an LVSInstance object, for an existing Service
@@ -442,45 +1940,118 @@ class LVSManager():
         proto, service_addr = name.split('_')
         
         if proto not in PROTOS:
-            raise ValueError, "Provided name looks insane, proto part is "
-        "invalid: {0}".format(proto)
+            raise ValueError("Provided name looks insane, proto part is "
+                             "invalid: {0}".format(proto))
         
-        if name in self.list_lvs_instances():
-            return LVSInstance(service_addr, proto)
+        if self.snapshot(partial=True).has_service(proto, service_addr):
+            return LVSInstance(service_addr, proto, self)
         else:
-            raise ValueError, "{0} not found in IPVS table".format(name)
+            raise ValueError("{0} not found in IPVS table".format(name))
     
     def list_lvs_instances(self):
         """list all ipvs instance found in the ipvs table
         
         return a list of LVSInstance objects representing discovered LVS Services  
         """
-        cmd = subprocess.Popen(["ipvsadm", "-Sn"], stdout=subprocess.PIPE)
-        out, err = cmd.communicate()
-
-        if err:
-            raise ValueError("something has failed: {0}".format(err))
+        return [LVSInstance(service_addr, proto, self) for proto, service_addr
+                in self.snapshot(partial=True).list_services()]
+    
+    def apply(self, desired_state, dry_run=False):
+        """bring the IPVS table into the desired state
+        
+        only the needed changes are made, RealServers and options are
+        edited in place instead of being removed and added again, so
+        existing connections are not disturbed
         
-        result = []
+        desired_state: dict mapping service names, as returned by 
+            list_lvs_instances(), to a dict describing the service:
+            scheduler: scheduler, the current one is kept if omitted
+            persistence: optional, cannot appear without scheduler
+            netmask: optional, cannot appear without persistence
+            flags: optional scheduler flags, see SCHED_FLAGS
+            servers: dict mapping real_server to a dict with method, 
+                     weight, upper, lower, tun_type, tun_port and 
+                     tun_csum, or a list of (real_server, method, weight)
+                     tuples as returned by LVSInstance.list_servers()
+            services not found in desired_state are removed
+        dry_run: do not change anything, only return the plan
         
-        for line in out.split('\n'):
-            if line.startswith("-A -t"):
-                result.append(LVSInstance(line.split()[2], "tcp"))
-            elif line.startswith("-A -u"):
-                result.append(LVSInstance(line.split()[2], "udp"))
+        returns the list of ipvsadm commands that were (or would be) run,
+        the changes are applied as one LVSTransaction
+        
+        desired_state is checked with validate_state() first, 
+        LVSValidationError tells all of its violations
+        """
+        violations = validate_state(desired_state)[1]
+        if violations:
+            raise LVSValidationError(violations)
+        snapshot = self.snapshot(0)
+        txn = self.transaction()
+        wanted = set()
+        
+        for name in sorted(desired_state):
+            spec = desired_state[name]
+            proto, service_addr = name.split('_')
+            key = _servicekey(proto, service_addr)
+            wanted.add(key)
+            scheduler, kwargs = _desired_opts(spec)
+            servers = _desired_servers(spec.get("servers", ()))
+            
+            if key not in snapshot.services:
+                instance = txn.add_lvs_instance(service_addr, proto, 
+                                                scheduler, **kwargs)
+                current = {}
             else:
-                continue
-        return result
+                instance = LVSInstance(service_addr, proto, txn)
+                if scheduler is not None:
+                    persistence = kwargs.get("persistence")
+                    if persistence is not None:
+                        persistence = str(persistence)
+                    options = (scheduler, persistence, kwargs.get("netmask"),
+                               kwargs.get("flags", ()))
+                    if options != snapshot.services[key].opts(flags=True):
+                        instance.set_opts(scheduler, **kwargs)
+                current = {}
+                for server in snapshot.servers[key]:
+                    current[str(server.address)] = (server.method, 
+                        server.weight, server.upper, server.lower,
+                        server.tun_type, server.tun_port, server.tun_csum)
+            
+            for address in sorted(servers):
+                real_server, method, weight, upper, lower, tun_type, \
+                    tun_port, tun_csum = servers[address]
+                opts = {"weight": weight}
+                if upper is not None:
+                    opts["upper"] = upper
+                if lower is not None:
+                    opts["lower"] = lower
+                if tun_type is not None:
+                    opts.update(tun_type=tun_type, tun_csum=tun_csum)
+                    if tun_port is not None:
+                        opts["tun_port"] = tun_port
+                if address not in current:
+                    instance.add_server(real_server, method, **opts)
+                elif current[address] != servers[address][1:]:
+                    instance.edit_server(real_server, method, **opts)
+            
+            for address in sorted(current):
+                if address not in servers:
+                    instance.del_server(address)
+        
+        for proto, service_addr in snapshot.list_services():
+            if (proto, service_addr) not in wanted:
+                txn.del_lvs_instance(service_addr, proto)
+        
+        plan = [" ".join(args) for args, errmsg in txn.commands]
+        if not dry_run:
+            txn.commit()
+        return plan
     
     def clear_ipvs(self):
         """clear the whole LVS table
         
         """
-        try:
-            subprocess.check_call([IPVSADM, "-C"])
-            return True
-        except:
-            raise ValueError("could not clear IPVS table")
+        return self._execute(["-C"], "could not clear IPVS table")
         
     def set_timeouts(self, tcp, tcpfin, udp):
         """set ipvs connection timeout values
@@ -491,18 +2062,619 @@ class LVSManager():
         tcp = str(tcp)
         tcpfin = str(tcpfin)
         udp = str(udp)
-        try:
-            subprocess.check_call([IPVSADM, "--set", tcp, tcpfin, udp])
-            return True
-        except:
-            raise ValueError("could not set timeouts, "
+        return self._execute(["--set", tcp, tcpfin, udp],
+                             "could not set timeouts, "
                              "arguments seem to be invalid")
     
+    def get_timeouts(self):
+        """get ipvs connection timeout values
+        
+        returns a tuple of integers (tcp, tcpfin, udp), as taken by 
+        set_timeouts()
+        """
+        out = self._output(["-L", "--timeout"])
+        label, sep, values = out.partition("):")
+        try:
+            return tuple(int(value) for value in values.split())
+        except ValueError:
+            raise ValueError("could not read timeouts: {0}".format(out))
+    
+    def get_info(self):
+        """IPVS version and size of the connection hash table
+        
+        returns a dict like {"version": "1.2.1", "conn_tab_size": 4096, 
+        "conn_tab_bits": 12}. The size is fixed when ip_vs is loaded, by 
+        its conn_tab_bits parameter. With many more connections than that
+        the hash chains get long
+        """
+        line = None
+        if getattr(self.backend, "procfs", False):
+            try:
+                line = procfs.read_header(self.proc_root)
+            except (IOError, OSError):
+                pass
+        if line is None:
+            # only the header line of the listing is needed
+            lines = self._lines(["-Ln"])
+            try:
+                line = next(lines, "")
+            finally:
+                lines.close()
+        return _parse_info(line)
+    
+    def watch(self, interval=1.0, callback=None, full_every=10):
+        """watch the IPVS table for changes, made through pylvs or not
+        
+        returns an endless iterator of LVSChange tuples, kind being one 
+        of CHANGES. service is the service name, real_server the 
+        RealServer for server changes. old and new are the VirtualService
+        or RealServer before and after the change, None if it did not 
+        exist
+        
+        interval: seconds between two polls, see LVSWatcher for what a 
+                  poll costs
+        callback: call this with every LVSChange instead of returning an
+                  iterator, watching stops when it returns False
+        full_every: see below
+        
+        the table at the time of the call is the base, it is not 
+        reported
+        
+        if /proc/net/ip_vs can be read, a poll reads the ipvsadm -Sn 
+        output only if procfs changed, or every full_every polls. procfs
+        does not show the RealServer thresholds, the tunnel options and 
+        the scheduler flags, so a change of only these is reported up to
+        full_every polls late, and never if full_every is None
+        """
+        watcher = LVSWatcher(self, full_every)
+        watcher.poll()
+        changes = watcher.changes(interval)
+        if callback is None:
+            return changes
+        for change in changes:
+            if callback(change) is False:
+                return None
+    
+    def start_daemon(self, state, mcast_interface, syncid=0, **kwargs):
+        """start a connection synchronisation daemon
+        
+        state: master sends the connections of this host, backup 
+               receives the connections of a master
+        mcast_interface: interface the sync messages are sent or received
+        syncid: only sync with daemons using the same syncid, 0-255
+        
+        kwargs:
+        sync_maxlen: maximum length of a sync message
+        mcast_group: multicast group of the sync messages
+        mcast_port: udp port of the sync messages
+        mcast_ttl: ttl of the sync messages
+        
+        the kernel picks defaults for the omitted kwargs, see ipvsadm 
+        manpage for details
+        """
+        if state not in DAEMON_STATES:
+            raise ValueError("Invalid sync daemon state: {0}".format(state))
+        if not _rangechk(0, 255, syncid):
+            raise ValueError("syncid outside range")
+        args = ["--start-daemon", state, "--mcast-interface", 
+                mcast_interface, "--syncid", str(syncid)]
+        for key, minval, maxval in (('sync_maxlen', 1, 65507), 
+                                    ('mcast_group', None, None),
+                                    ('mcast_port', 1, 65535),
+                                    ('mcast_ttl', 1, 255)):
+            value = kwargs.get(key)
+            if value is None:
+                continue
+            if minval is None:
+                family = socket.AF_INET6 if ':' in value else socket.AF_INET
+                try:
+                    socket.inet_pton(family, value)
+                except socket.error:
+                    raise ValueError("invalid mcast_group specified")
+            elif not _rangechk(minval, maxval, value):
+                raise ValueError("{0} outside range".format(key))
+            args += ["--" + key.replace('_', '-'), str(value)]
+        return self._execute(args, "could not start {0} sync daemon".format(
+                                   state))
+    
+    def stop_daemon(self, state):
+        """stop the master or backup connection synchronisation daemon
+        """
+        if state not in DAEMON_STATES:
+            raise ValueError("Invalid sync daemon state: {0}".format(state))
+        return self._execute(["--stop-daemon", state], 
+                             "could not stop {0} sync daemon".format(state))
+    
+    def list_daemons(self):
+        """list the running connection synchronisation daemons
+        
+        returns a list of LVSDaemon tuples, the fields the kernel does 
+        not report are None
+        """
+        return _parse_daemons(self._output(["-L", "--daemon"]))
+    
+    def get_sync_stats(self):
+        """count the entries of the connection table per origin
+        
+        returns a dict like {"Local": 10, "Sync": 200}, connections 
+        created on this host and connections received from a master sync
+        daemon. A backup with a growing Sync count receives the sync 
+        messages of its master
+        """
+        try:
+            return procfs.aggregate_origins(self.proc_root)
+        except (IOError, OSError) as error:
+            raise ValueError("could not read connection table: "
+                             "{0}".format(error))
+    
+    def get_schedulers(self):
+        """schedulers of SCHEDULERS the kernel supports, as a tuple
+        
+        backends with a schedulers attribute, like the simulator, tell 
+        their own, otherwise the kernel modules are probed, see 
+        procfs.probe_schedulers()
+        """
+        available = getattr(self.backend, "schedulers", None)
+        if available is None:
+            try:
+                available = procfs.probe_schedulers(self.proc_root)
+            except (IOError, OSError) as error:
+                raise ValueError("could not probe schedulers: "
+                                 "{0}".format(error))
+        return tuple(scheduler for scheduler in SCHEDULERS 
+                     if scheduler in available)
+    
+    def get_sync_tunables(self):
+        """read the sync_* sysctls of /proc/sys/net/ipv4/vs
+        
+        returns a dict mapping their names to ints, or tuples of ints 
+        for vectors like sync_threshold
+        """
+        try:
+            return procfs.read_sysctls("sync_", self.proc_root)
+        except (IOError, OSError) as error:
+            raise ValueError("could not read IPVS sysctls: "
+                             "{0}".format(error))
+    
+    def get_tunables(self):
+        """read all sysctls of /proc/sys/net/ipv4/vs
+        
+        returns a dict mapping their names to ints, tuples of ints for 
+        vectors like sync_threshold, or strings
+        """
+        try:
+            return procfs.read_sysctls("", self.proc_root)
+        except (IOError, OSError) as error:
+            raise ValueError("could not read IPVS sysctls: "
+                             "{0}".format(error))
+    
+    def diff_tunables(self, profile):
+        """compare a tunables profile to the current values
+        
+        profile: name of one of TUNABLE_PROFILES, or a dict mapping 
+                 TUNABLES to their values
+        
+        returns a dict mapping the sysctls that differ to a tuple 
+        (current, wanted), the profile is checked first and ValueError
+        tells all invalid values
+        """
+        wanted = _tunables(profile)
+        current = self.get_tunables()
+        missing = sorted(set(wanted) - set(current))
+        if missing:
+            raise ValueError("sysctls not supported by the kernel: "
+                             "{0}".format(", ".join(missing)))
+        return dict((name, (current[name], wanted[name])) 
+                    for name in wanted if current[name] != wanted[name])
+    
+    def set_tunables(self, profile, dry_run=False):
+        """apply a tunables profile, see diff_tunables()
+        
+        only the sysctls that differ are written. If one can not be 
+        written, the ones written before are set back to their old values
+        
+        dry_run: do not change anything, only return the diff
+        
+        returns the diff that was (or would be) applied
+        """
+        diff = self.diff_tunables(profile)
+        if dry_run:
+            return diff
+        written = []
+        try:
+            for name in sorted(diff):
+                procfs.write_sysctl(name, diff[name][1], self.proc_root)
+                written.append(name)
+        except (IOError, OSError) as error:
+            for done in reversed(written):
+                try:
+                    procfs.write_sysctl(done, diff[done][0], self.proc_root)
+                except (IOError, OSError):
+                    pass
+            raise ValueError("could not set {0}, changes rolled back: "
+                             "{1}".format(name, error))
+        return diff
+    
+    def save(self, path):
+        """save the IPVS table, the timeouts and the tunables to a 
+        checkpoint file, see LVSCheckpoint
+        
+        the tunables are only saved if our backend manages the table of 
+        this host and the sysctls can be read
+        
+        returns the LVSCheckpoint
+        """
+        commands = self._table_commands()
+        timeouts = self.get_timeouts()
+        tunables = None
+        if getattr(self.backend, "procfs", False):
+            try:
+                current = self.get_tunables()
+            except ValueError:
+                pass
+            else:
+                tunables = dict((name, current[name]) for name in TUNABLES
+                                if name in current)
+        checkpoint = LVSCheckpoint(commands, timeouts, tunables, 
+                                   time.time())
+        checkpoint.write(path)
+        return checkpoint
+    
+    def _table_commands(self):
+        """the -A and -a lines of ipvsadm -Sn as argument lists
+        """
+        return [line.split() for line in self._lines(["-Sn"]) 
+                if line.startswith(("-A ", "-a "))]
+    
+    def load(self, path, timeouts=True, tunables=True):
+        """restore a checkpoint file written by save()
+        
+        the tunables are restored first. The table is then compared line
+        by line to the saved one, and only the services and RealServers 
+        that differ are added, edited or removed, by a single 
+        LVSTransaction, so this is one ipvsadm -R call and the 
+        connections of unchanged services are kept
+        
+        timeouts, tunables: restore these too, if the checkpoint has them
+        
+        returns the LVSCheckpoint
+        """
+        checkpoint = LVSCheckpoint.read(path)
+        if tunables and checkpoint.tunables:
+            self.set_tunables(checkpoint.tunables)
+        current = _linekeys(self._table_commands())
+        saved = _linekeys(checkpoint.commands)
+        keys = set(key for key, args in saved)
+        errmsg = "could not restore checkpoint"
+        txn = self.transaction()
+        # the table for the check of the transaction, it was just read
+        table = {}
+        servers = {}
+        removed = set()
+        for key, args in current:
+            name, real_server = key
+            proto, service_addr = name.split("_", 1)
+            if name not in servers:
+                servers[name] = table.setdefault(
+                    _servicekey(proto, service_addr), set())
+            if real_server is not None:
+                servers[name].add(real_server)
+            if key in keys or name in removed:
+                continue
+            if real_server is None:
+                # removing the service removes its RealServers too
+                removed.add(name)
+                txn.commands.append((["-D"] + _svccmd(proto, service_addr), 
+                                     errmsg))
+            else:
+                txn.commands.append((["-d"] + _svccmd(proto, service_addr) + 
+                                     ["-r", real_server], errmsg))
+        current = dict(current)
+        for key, args in saved:
+            before = current.get(key)
+            if before is None:
+                txn.commands.append((args, errmsg))
+            elif before != args:
+                edit = "-E" if args[0] == "-A" else "-e"
+                txn.commands.append(([edit] + args[1:], errmsg))
+        if timeouts and checkpoint.timeouts:
+            txn.set_timeouts(*checkpoint.timeouts)
+        if txn.commands:
+            txn._commit(table)
+        return checkpoint
+    
+    def _get_stats(self, selector=()):
+        """read counters, rates and connections of all services, or of the
+        service selected by selector, using one ipvsadm call for each
+        """
+        selector = list(selector)
+        rates = {}
+        for name, fields, servers in _parse_listing(self._output(
+                _RATE_LISTING + selector)):
+            rates[name] = (_counters(fields), 
+                dict((real_server, _counters(values)) 
+                     for real_server, values in servers))
+        conns = {}
+        for name, fields, servers in _parse_listing(self._output(
+                _CONN_LISTING + selector)):
+            conns[name] = dict((real_server, _counters(values[2:], 2)) 
+                               for real_server, values in servers)
+        
+        result = {}
+        for name, fields, servers in _parse_listing(self._output(
+                _STATS_LISTING + selector)):
+            service_rates, server_rates = rates.get(name, ([0] * 5, {}))
+            server_conns = conns.get(name, {})
+            server_stats = {}
+            active = 0
+            inactive = 0
+            for real_server, values in servers:
+                connections = server_conns.get(real_server, [0, 0])
+                active += connections[0]
+                inactive += connections[1]
+                server_stats[real_server] = LVSStats(*(_counters(values) + 
+                    server_rates.get(real_server, [0] * 5) + connections))
+            result[name] = (LVSStats(*(_counters(fields) + service_rates + 
+                                       [active, inactive])), server_stats)
+        return result
+    
+    def get_stats(self, zero=False):
+        """get the statistics of all services
+        
+        returns a dict mapping the service names, as returned by 
+        list_lvs_instances(), to a tuple (stats, servers) as returned by
+        LVSInstance.get_stats()
+        
+        the whole table is read with one ipvsadm call for the counters,
+        one for the rates and one for the connections
+        
+        zero: reset the counters right after they are read, packets 
+              arriving between the read and the reset are lost
+        """
+        stats = self._get_stats()
+        if zero:
+            self.zero()
+        return stats
+    
     def zero(self):
         """Zero the packet, byte and rate counters for all services
         """
+        return self._execute(["-Z"], "could not reset counters")
+
+class LVSValidationError(ValueError):
+    """raised when a description of the IPVS table is invalid
+    
+    violations: list of LVSViolation tuples as returned by 
+                validate_state()
+    """
+    
+    def __init__(self, violations):
+        messages = []
+        for service, real_server, message in violations:
+            if real_server is not None:
+                service = "{0} {1}".format(service, real_server)
+            messages.append("{0}: {1}".format(service, message))
+        ValueError.__init__(self, "{0} violations: {1}".format(
+                            len(violations), "; ".join(messages)))
+        self.violations = violations
+
+class LVSTransactionError(ValueError):
+    """raised when a LVSTransaction could not be applied
+    
+    index: position of the failing command in the batch, None if unknown
+    command: the failing command as passed to ipvsadm -R, None if unknown
+    applied: number of commands applied before the batch stopped, 
+             None if ipvsadm failed and the table may be partially updated
+    errors: lines ipvsadm printed to stderr
+    """
+    
+    def __init__(self, message, index=None, command=None, applied=None,
+                 errors=None):
+        ValueError.__init__(self, message)
+        self.index = index
+        self.command = command
+        self.applied = applied
+        self.errors = errors or []
+
+class LVSTransaction(LVSManager):
+    """collects changes to the IPVS table and applies them all at once
+    
+    commands are validated when they are queued, and are checked against
+    the current IPVS table before anything is sent to ipvsadm, so a failing
+    command stops the batch before the table is touched
+    
+    >>> with manager.transaction() as txn:
+    ...     instance = txn.add_lvs_instance("207.175.44.10:80", "tcp")
+    ...     instance.add_server("192.168.10.1:81", "masq")
+    """
+    
+    def __init__(self, backend=None, parent=None):
+        """backend: backend used to apply the batch
+        parent: LVSManager whose cached snapshot is invalidated on commit
+        """
+        proc_root = None
+        if parent is not None:
+            proc_root = parent.proc_root
+        LVSManager.__init__(self, backend, proc_root=proc_root)
+        self.parent = parent
+        self.commands = []
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+    
+    def __len__(self):
+        return len(self.commands)
+    
+    def _execute(self, args, errmsg):
+        """queue ipvsadm arguments instead of running them
+        """
+        self.commands.append((list(args), errmsg))
+        return True
+    
+    def transaction(self):
+        """transactions can not be nested
+        """
+        raise ValueError("transactions can not be nested")
+    
+    def get_lvs_instance(self, name):
+        """get an LVSInstance object bound to this transaction
+        
+        name: is the name as returned by LVSManager.list_lvs_instances()
+        
+        the existence of the service is only checked on commit, so services
+        added earlier in the same transaction can be used
+        """
+        proto, service_addr = name.split('_')
+        _validateservice(proto, service_addr)
+        return LVSInstance(service_addr, proto, self)
+    
+    def invalidate(self):
+        """drop the cached snapshot, and the one of our parent
+        """
+        LVSManager.invalidate(self)
+        if self.parent is not None:
+            self.parent.invalidate()
+    
+    def rollback(self):
+        """discard all queued commands
+        """
+        self.commands = []
+        return True
+    
+    def _read_table(self):
+        """read the services and RealServers currently in the IPVS table
+        
+        returns a dict mapping (proto, service_addr) to a set of RealServers
+        """
         try:
-            subprocess.check_call([IPVSADM, "-Z"])
+            snapshot = self.snapshot(0)
+        except ValueError as error:
+            raise LVSTransactionError("could not read IPVS table: {0}, "
+                                      "nothing was applied".format(error),
+                                      applied=0)
+        return self._table(snapshot)
+    
+    @staticmethod
+    def _table(snapshot):
+        """the services and RealServers of a LVSSnapshot, as used by _check()
+        """
+        table = {}
+        for key in snapshot.list_services():
+            table[key] = set(str(server.address) 
+                             for server in snapshot.servers[key])
+        return table
+    
+    def _check(self, table):
+        """replay the queued commands against table, 
+        raise LVSTransactionError for the first one that would fail
+        """
+        # big batches name the same services and RealServers many times
+        keys = {}
+        addresses = {}
+        for index, (args, errmsg) in enumerate(self.commands):
+            action = args[0]
+            
+            if action == "-C":
+                table.clear()
+                continue
+            if action not in ("-A", "-E", "-D", "-a", "-e", "-d"):
+                continue
+            
+            if args[1] == "-f":
+                key = _servicekey("fwm6" if "-6" in args else "fwm", args[2])
+            else:
+                key = keys.get((args[1], args[2]))
+                if key is None:
+                    key = keys[(args[1], args[2])] = _servicekey(
+                        _PROTOS.get(args[1], args[1]), args[2])
+            if action == "-A":
+                failed = key in table
+                table[key] = set()
+            elif key not in table:
+                failed = True
+            elif action == "-D":
+                failed = False
+                del table[key]
+            elif action == "-E":
+                failed = False
+            else:
+                real_server = args[args.index("-r") + 1]
+                if real_server in addresses:
+                    real_server = addresses[real_server]
+                else:
+                    real_server = addresses[real_server] = \
+                        _canonaddr(real_server)
+                if action == "-a":
+                    failed = real_server in table[key]
+                    table[key].add(real_server)
+                else:
+                    failed = real_server not in table[key]
+                    if action == "-d":
+                        table[key].discard(real_server)
+            
+            if failed:
+                command = " ".join(args)
+                raise LVSTransactionError("command {0} of {1} failed: "
+                    "{2}: {3}, batch stopped before it, nothing was "
+                    "applied".format(
+                    index + 1, len(self.commands), command, errmsg),
+                    index=index, command=command, applied=0)
+    
+    def commit(self):
+        """apply all queued commands with a single ipvsadm -R call
+        (or a single batch, depending on the backend)
+        
+        raises LVSTransactionError if the batch could not be applied
+        """
+        if not self.commands:
             return True
-        except:
-            raise ValueError("could not reset counters")
+        
+        if self.commands[0][0] == ["-C"]:
+            # the batch starts on an empty table, no need to read it
+            return self._commit({})
+        return self._commit(self._read_table())
+    
+    def _commit(self, table):
+        """check the queued commands against table, as returned by 
+        _read_table(), and apply them
+        """
+        self._check(table)
+        try:
+            failed = self.backend.restore([args for args, errmsg 
+                                           in self.commands])
+        except ValueError as error:
+            raise LVSTransactionError("could not apply batch: {0}, "
+                                      "nothing was applied".format(error),
+                                      applied=0)
+        finally:
+            self.invalidate()
+        
+        self._raise_failed(failed)
+        self.commands = []
+        return True
+    
+    def _raise_failed(self, failed):
+        """raise LVSTransactionError for the (index, message) tuples 
+        returned by the restore method of a backend
+        """
+        if failed:
+            errors = [message for index, message in failed]
+            index = failed[0][0]
+            if index is None:
+                raise LVSTransactionError("batch failed: {0}, the IPVS table "
+                    "may be partially updated".format("; ".join(errors)),
+                    errors=errors)
+            command = " ".join(self.commands[index][0])
+            raise LVSTransactionError("command {0} of {1} failed: {2}: {3}, "
+                "{4} of {1} commands were applied".format(index + 1,
+                len(self.commands), command, errors[0],
+                len(self.commands) - len(failed)), index=index,
+                command=command, applied=len(self.commands) - len(failed),
+                errors=errors)
@@ -0,0 +1,280 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+"""
+simulator.py
+
+in-memory IPVS table for dry-runs, planning and tests without root
+
+SimulatedBackend takes the place of the kernel behind NetlinkBackend:
+ipvsadm arguments are translated into netlink commands exactly like they
+would be for the kernel, and the commands are checked the way the kernel
+checks them, so a plan that fails on the simulator fails for real.
+
+    >>> import pylvs
+    >>> from pylvs.simulator import SimulatedBackend
+    >>> backend = SimulatedBackend(pylvs.IpvsadmBackend().output(["-Sn"]))
+    >>> pylvs.LVSManager(backend=backend).apply(desired_state)
+"""
+
+import copy
+import errno
+import socket
+
+from .netlink import (NetlinkBackend, parse_attrs, decode_service,
+                      decode_dest, decode_daemon,
+                      _service_key, _dest_key,
+                      _strerror, _get_u32, IPVS_CMD_NEW_SERVICE,
+                      IPVS_CMD_SET_SERVICE, IPVS_CMD_DEL_SERVICE,
+                      IPVS_CMD_NEW_DEST, IPVS_CMD_DEL_DEST,
+                      IPVS_CMD_NEW_DAEMON, IPVS_CMD_DEL_DAEMON,
+                      IPVS_CMD_SET_CONFIG, IPVS_CMD_ZERO, IPVS_CMD_FLUSH,
+                      IPVS_CMD_ATTR_SERVICE, IPVS_CMD_ATTR_DEST,
+                      IPVS_CMD_ATTR_DAEMON, IPVS_DAEMON_ATTR_STATE,
+                      IPVS_CMD_ATTR_TIMEOUT_TCP, IPVS_CMD_ATTR_TIMEOUT_TCP_FIN,
+                      IPVS_CMD_ATTR_TIMEOUT_UDP, IP_VS_CONN_F_TUNNEL,
+                      IP_VS_CONN_F_TUNNEL_TYPE_GUE,
+                      IP_VS_TUNNEL_ENCAP_FLAG_REMCSUM)
+from .pylvs import SCHEDULERS
+
+# what the kernel fills in for a sync daemon started without them, the
+# maxlen fits a 1500 byte MTU
+DAEMON_DEFAULTS = {"sync_maxlen": 1472, "mcast_group": "224.0.0.81",
+                   "mcast_port": 8848, "mcast_ttl": 1}
+
+
+class _Unsupported(object):
+    """fallback of the simulator, commands that have no netlink
+    equivalent can not be simulated
+    """
+
+    def execute(self, args):
+        raise ValueError("not supported by the simulator: "
+                         "{0}".format(" ".join(args)))
+
+    output = execute
+
+
+class SimulatedBackend(NetlinkBackend):
+    """backend keeping the IPVS table in memory
+
+    dump: output of ipvsadm -Sn to start with, an empty table if omitted
+    schedulers: scheduler modules the simulated kernel has
+    version: IPVS version reported by the listings
+
+    nothing is ever forwarded, so all counters stay 0
+    """
+
+    procfs = False
+
+    def __init__(self, dump=None, schedulers=SCHEDULERS, version="1.2.1"):
+        self.fallback = _Unsupported()
+        self.schedulers = frozenset(schedulers)
+        self.version = version
+        self.services = {}
+        self.dests = {}
+        self.timeouts = (900, 120, 300)
+        self.daemons = {}
+        if dump:
+            self.load(dump)
+
+    def close(self):
+        pass
+
+    def load(self, dump):
+        """add the services and RealServers of an ipvsadm -Sn dump
+        """
+        failed = self.restore([line.split() for line in dump.splitlines()
+                               if line.strip()])
+        if failed:
+            raise ValueError("could not load dump, line {0}: {1}".format(
+                             failed[0][0] + 1, failed[0][1]))
+        return True
+
+    def copy(self):
+        """return an independent simulator with the same table, to try
+        changes without touching this one
+        """
+        other = copy.copy(self)
+        other.services = dict((key, dict(service)) for key, service
+                              in self.services.items())
+        other.dests = dict((key, dict((dkey, dict(dest)) for dkey, dest
+                                      in dests.items()))
+                           for key, dests in self.dests.items())
+        other.daemons = dict((state, dict(daemon)) for state, daemon
+                             in self.daemons.items())
+        return other
+
+    def _send_batch(self, messages):
+        """apply a list of (cmd, attrs) tuples
+
+        returns a list with the errno for every message, 0 on success
+        """
+        return [self._handle(cmd, parse_attrs(b"".join(attrs)))
+                for cmd, attrs in messages]
+
+    def _handle(self, cmd, attrs):
+        """apply a single command the way the kernel would, returns the
+        errno
+        """
+        if cmd == IPVS_CMD_FLUSH:
+            self.services.clear()
+            self.dests.clear()
+            return 0
+        if cmd == IPVS_CMD_SET_CONFIG:
+            # the kernel leaves timeouts of 0 unchanged
+            values = [_get_u32(attrs[atype]) for atype in
+                      (IPVS_CMD_ATTR_TIMEOUT_TCP, IPVS_CMD_ATTR_TIMEOUT_TCP_FIN,
+                       IPVS_CMD_ATTR_TIMEOUT_UDP)]
+            self.timeouts = tuple(value or old for value, old
+                                  in zip(values, self.timeouts))
+            return 0
+        if cmd in (IPVS_CMD_NEW_DAEMON, IPVS_CMD_DEL_DAEMON):
+            return self._handle_daemon(cmd, attrs)
+        if IPVS_CMD_ATTR_SERVICE not in attrs:
+            if cmd == IPVS_CMD_ZERO:
+                return 0
+            return errno.EINVAL
+
+        service = decode_service(attrs[IPVS_CMD_ATTR_SERVICE])
+        key = _service_key(service)
+        if cmd == IPVS_CMD_NEW_SERVICE:
+            if key in self.services:
+                return errno.EEXIST
+            error = self._check_service(service)
+            if not error:
+                self.services[key] = service
+                self.dests[key] = {}
+            return error
+        if key not in self.services:
+            return errno.ESRCH
+        if cmd == IPVS_CMD_SET_SERVICE:
+            error = self._check_service(service)
+            if not error:
+                self.services[key] = service
+            return error
+        if cmd == IPVS_CMD_DEL_SERVICE:
+            del self.services[key]
+            del self.dests[key]
+            return 0
+        if cmd == IPVS_CMD_ZERO:
+            return 0
+
+        if IPVS_CMD_ATTR_DEST not in attrs:
+            return errno.EINVAL
+        dest = decode_dest(attrs[IPVS_CMD_ATTR_DEST], service["af"])
+        dests = self.dests[key]
+        dkey = _dest_key(dest)
+        if cmd == IPVS_CMD_NEW_DEST:
+            if dkey in dests:
+                return errno.EEXIST
+        elif dkey not in dests:
+            return errno.ENOENT
+        if cmd == IPVS_CMD_DEL_DEST:
+            del dests[dkey]
+            return 0
+        error = self._check_dest(self.services[key], dest)
+        if not error:
+            dests[dkey] = dest
+        return error
+
+    def _handle_daemon(self, cmd, attrs):
+        """start or stop a sync daemon, there is one master and one backup
+        daemon at most
+        """
+        if IPVS_CMD_ATTR_DAEMON not in attrs:
+            return errno.EINVAL
+        if cmd == IPVS_CMD_DEL_DAEMON:
+            daemon = parse_attrs(attrs[IPVS_CMD_ATTR_DAEMON])
+            state = _get_u32(daemon[IPVS_DAEMON_ATTR_STATE])
+            if state not in self.daemons:
+                return errno.ESRCH
+            del self.daemons[state]
+            return 0
+        daemon = dict(DAEMON_DEFAULTS)
+        daemon.update(decode_daemon(attrs[IPVS_CMD_ATTR_DAEMON]))
+        if daemon["state"] in self.daemons:
+            return errno.EEXIST
+        self.daemons[daemon["state"]] = daemon
+        return 0
+
+    def _check_service(self, service):
+        """the checks the kernel runs on new and changed services
+        """
+        if service.get("sched_name") not in self.schedulers:
+            return errno.ENOENT
+        if (service["af"] == socket.AF_INET6 and
+                not 1 <= service.get("netmask", 128) <= 128):
+            return errno.EINVAL
+        return 0
+
+    def _check_dest(self, service, dest):
+        """the checks the kernel runs on new and changed RealServers
+        """
+        # only tunnelling can cross address families
+        if (dest["af"] != service["af"] and
+                dest.get("fwd_method") != IP_VS_CONN_F_TUNNEL):
+            return errno.EINVAL
+        if dest.get("l_thresh", 0) > dest.get("u_thresh", 0):
+            return errno.ERANGE
+        if dest.get("fwd_method") == IP_VS_CONN_F_TUNNEL:
+            gue = dest.get("tun_type") == IP_VS_CONN_F_TUNNEL_TYPE_GUE
+            if gue and not dest.get("tun_port"):
+                return errno.EINVAL
+            if (dest.get("tun_flags", 0) & IP_VS_TUNNEL_ENCAP_FLAG_REMCSUM
+                    and not gue):
+                return errno.EINVAL
+        return 0
+
+    def _lookup(self, service):
+        key = _service_key(service)
+        if key not in self.services:
+            raise ValueError(_strerror(IPVS_CMD_DEL_SERVICE, errno.ESRCH))
+        return key
+
+    def get_services(self):
+        """return a list of dicts describing all services
+        """
+        return [dict(service) for service in self.services.values()]
+
+    def get_service(self, service):
+        """return a dict describing a single service
+        """
+        return dict(self.services[self._lookup(service)])
+
+    def get_dests(self, service):
+        """return a list of dicts describing the RealServers of service
+        """
+        return [dict(dest) for dest
+                in self.dests[self._lookup(service)].values()]
+
+    def get_info(self):
+        """return the IPVS version and the size of the connection table
+        """
+        return {"version": self.version, "conn_tab_size": 4096}
+
+    def get_timeouts(self):
+        """return the tcp, tcpfin and udp timeouts
+        """
+        return self.timeouts
+
+    def get_daemons(self):
+        """return a list of dicts describing the running sync daemons
+        """
+        return [dict(self.daemons[state]) for state in sorted(self.daemons)]
+
+    def restore(self, commands):
+        """apply a list of ipvsadm style commands, every command is
+        tried even if an earlier one failed
+
+        returns a list of (index, message) tuples for the failed commands
+        """
+        failed = []
+        for index, args in enumerate(commands):
+            try:
+                self.execute(args)
+            except ValueError as error:
+                failed.append((index, str(error)))
+        return failed
@@ -1,2 +0,0 @@
-#!/bin/bash
-ipvsadm -C
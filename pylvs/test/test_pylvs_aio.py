@@ -0,0 +1,253 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+import asyncio
+import os
+import stat
+import threading
+
+import pytest
+import pylvs
+from pylvs.aio import AsyncInstrumentedBackend, AsyncIpvsadmBackend, \
+                      AsyncLVSManager
+from pylvs import procfs
+from pylvs.instrument import InstrumentedBackend
+
+DUMP = """-A -t 207.175.44.10:80 -s rr
+-a -t 207.175.44.10:80 -r 192.168.10.1:81 -m -w 1
+-A -t 207.175.44.30:80 -s wlc -p 120 -M 255.255.255.224
+-a -t 207.175.44.30:80 -r 192.168.10.1:81 -m -w 1
+"""
+
+# logs every call, dumps are slow so concurrent callers overlap,
+# commands for 192.168.10.9 fail like the kernel would
+IPVSADM = """#!/bin/sh
+echo "start $*" >> {log}
+case "$*" in
+    -Sn) sleep 0.2; cat {dump} ;;
+    -R) cat >> {log} ;;
+    *192.168.10.9*) echo "Memory allocation problem" >&2; exit 2 ;;
+    *) sleep {delay} ;;
+esac
+echo "end $*" >> {log}
+"""
+
+
+@pytest.fixture
+def ipvsadm(tmp_path):
+    def make(delay=0):
+        script = tmp_path / "ipvsadm"
+        (tmp_path / "dump").write_text(DUMP)
+        script.write_text(IPVSADM.format(log=tmp_path / "log",
+                                         dump=tmp_path / "dump", delay=delay))
+        script.chmod(script.stat().st_mode | stat.S_IEXEC)
+        return str(script)
+    return make
+
+
+def _log(ipvsadm):
+    path = os.path.join(os.path.dirname(ipvsadm), "log")
+    if not os.path.exists(path):
+        return []
+    with open(path) as log:
+        return log.read().splitlines()
+
+
+def _manager(ipvsadm, limit=4, **kwargs):
+    backend = AsyncIpvsadmBackend(limit, ipvsadm=ipvsadm)
+    backend.procfs = False
+    return AsyncLVSManager(backend=backend, **kwargs)
+
+
+class Test_AsyncLVSManager:
+
+    def test_reads_are_coalesced(self, ipvsadm):
+        path = ipvsadm()
+        manager = _manager(path)
+
+        async def run():
+            return await asyncio.gather(manager.list_lvs_instances(),
+                                        manager.list_lvs_instances(),
+                                        manager.get_lvs_instance("tcp_207.175.44.10:80"))
+        instances, again, instance = asyncio.run(run())
+        assert [str(i) for i in instances] == ["tcp_207.175.44.10:80",
+                                               "tcp_207.175.44.30:80"]
+        assert instance == "tcp_207.175.44.10:80"
+        assert _log(path).count("start -Sn") == 1
+
+    def test_instance_reads(self, ipvsadm):
+        path = ipvsadm()
+        manager = _manager(path, ttl=60)
+
+        async def run():
+            instance = await manager.get_lvs_instance("tcp_207.175.44.30:80")
+            return await instance.get_opts(), await instance.list_servers()
+        assert asyncio.run(run()) == (("wlc", "120", "255.255.255.224"),
+                                      [("192.168.10.1:81", "masq", "1")])
+        assert _log(path).count("start -Sn") == 1
+
+    def test_writes(self, ipvsadm):
+        path = ipvsadm()
+        manager = _manager(path)
+
+        async def run():
+            instance = await manager.add_lvs_instance("207.175.44.20:80", "tcp",
+                                                      "wrr", persistence=60)
+            await instance.add_server("192.168.10.1:80", "route", weight=2)
+            await instance.del_server("192.168.10.1:80")
+        asyncio.run(run())
+        assert [line for line in _log(path) if line.startswith("start")] == [
+            "start -A -t 207.175.44.20:80 -s wrr -p 60",
+            "start -a -t 207.175.44.20:80 -r 192.168.10.1:80 -g -w 2",
+            "start -d -t 207.175.44.20:80 -r 192.168.10.1:80"]
+
+    def test_write_error(self, ipvsadm):
+        manager = _manager(ipvsadm())
+
+        async def run():
+            instance = await manager.get_lvs_instance("tcp_207.175.44.10:80")
+            await instance.add_server("192.168.10.9:81", "masq")
+        with pytest.raises(pylvs.IpvsadmError) as error:
+            asyncio.run(run())
+        assert error.value.returncode == 2
+        assert error.value.stderr == "Memory allocation problem\n"
+
+    def test_invalid_arguments(self, ipvsadm):
+        path = ipvsadm()
+        manager = _manager(path)
+        with pytest.raises(ValueError):
+            asyncio.run(manager.add_lvs_instance("207.175.44.20:80", "icmp"))
+        assert _log(path) == []
+
+    def test_limit(self, ipvsadm):
+        path = ipvsadm(delay=0.1)
+        manager = _manager(path, limit=1)
+
+        async def run():
+            await asyncio.gather(*[manager.set_timeouts(900, 120, 300 + i)
+                                   for i in range(3)])
+        asyncio.run(run())
+        log = _log(path)
+        assert len(log) == 6
+        assert [line.split()[0] for line in log] == ["start", "end"] * 3
+
+    def test_cancel_lets_ipvsadm_finish(self, ipvsadm):
+        path = ipvsadm(delay=0.3)
+        manager = _manager(path, limit=1)
+
+        async def run():
+            call = asyncio.ensure_future(manager.zero())
+            await asyncio.sleep(0.1)
+            call.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await call
+            assert _log(path) == ["start -Z"]
+            # the slot is freed once the cancelled ipvsadm exited
+            await manager.clear_ipvs()
+        asyncio.run(run())
+        assert _log(path) == ["start -Z", "end -Z", "start -C", "end -C"]
+
+    def test_transaction(self, ipvsadm):
+        path = ipvsadm()
+        manager = _manager(path)
+
+        async def run():
+            async with manager.transaction() as txn:
+                instance = await txn.get_lvs_instance("tcp_207.175.44.10:80")
+                await instance.add_server("192.168.10.2:81", "masq")
+                await instance.edit_server("192.168.10.1:81", "masq", weight=5)
+        asyncio.run(run())
+        assert _log(path)[-4:] == [
+            "start -R",
+            "-a -t 207.175.44.10:80 -r 192.168.10.2:81 -m",
+            "-e -t 207.175.44.10:80 -r 192.168.10.1:81 -m -w 5",
+            "end -R"]
+
+    def test_apply(self, ipvsadm):
+        path = ipvsadm()
+        manager = _manager(path)
+        state = {"tcp_207.175.44.10:80": {"scheduler": "rr",
+                                          "servers": [("192.168.10.1:81", "masq", 1)]}}
+        plan = asyncio.run(manager.apply(state))
+        assert plan == ["-D -t 207.175.44.30:80"]
+        assert _log(path)[-3:] == ["start -R", "-D -t 207.175.44.30:80", "end -R"]
+
+
+class Test_AsyncInstrumentedBackend:
+
+    def test_calls_are_timed(self, ipvsadm):
+        backend = AsyncInstrumentedBackend(_manager(ipvsadm()).backend)
+        post = []
+        backend.add_hook(post=post.append)
+        manager = AsyncLVSManager(backend=backend)
+
+        async def run():
+            instance = await manager.get_lvs_instance("tcp_207.175.44.10:80")
+            with pytest.raises(pylvs.IpvsadmError):
+                await instance.add_server("192.168.10.9:81", "masq")
+            async with manager.transaction() as txn:
+                instance = await txn.get_lvs_instance("tcp_207.175.44.10:80")
+                await instance.add_server("192.168.10.2:81", "masq")
+        asyncio.run(run())
+        assert [(call.operation, call.failed) for call in post] == [
+            ("dump", False), ("add_server", True), ("dump", False),
+            ("restore", False)]
+        # -Sn of the fake ipvsadm takes 0.2 seconds
+        assert post[0].duration >= 0.2
+        assert post[1].returncode == 2
+        assert post[1].stderr == "Memory allocation problem\n"
+        report = backend.report()
+        assert (report["add_server"].count, report["add_server"].errors) == (1, 1)
+        assert report["dump"].count == 2
+
+    def test_backend_kinds(self, ipvsadm):
+        backend = _manager(ipvsadm()).backend
+        with pytest.raises(ValueError) as error:
+            InstrumentedBackend(backend)
+        assert "AsyncInstrumentedBackend" in str(error.value)
+        with pytest.raises(ValueError):
+            AsyncInstrumentedBackend(pylvs.IpvsadmBackend())
+        assert isinstance(AsyncInstrumentedBackend().backend, AsyncIpvsadmBackend)
+
+
+class Test_AsyncLVSManager_procfs:
+
+    def test_file_io_off_the_loop(self, ipvsadm, tmp_path, monkeypatch):
+        vs = tmp_path / "sys" / "net" / "ipv4" / "vs"
+        vs.mkdir(parents=True)
+        (vs / "drop_entry").write_text("0\n")
+        (vs / "sync_threshold").write_text("3\t50\n")
+        net = tmp_path / "net"
+        net.mkdir()
+        (net / "ip_vs").write_text("IP Virtual Server version 1.2.1 (size=4096)\n")
+        threads = []
+
+        def recording(function):
+            def wrapper(*args, **kwargs):
+                threads.append(threading.get_ident())
+                return function(*args, **kwargs)
+            return wrapper
+
+        for name in ("read_sysctls", "write_sysctl", "read_header"):
+            monkeypatch.setattr(procfs, name, recording(getattr(procfs, name)))
+        monkeypatch.setattr(procfs, "probe_schedulers",
+                            recording(lambda *args: set(["rr"])))
+        backend = AsyncIpvsadmBackend(ipvsadm=ipvsadm())
+        manager = AsyncLVSManager(backend=backend, proc_root=str(tmp_path))
+
+        async def run():
+            loop = threading.get_ident()
+            assert await manager.get_tunables() == {"drop_entry": 0,
+                                                    "sync_threshold": (3, 50)}
+            assert await manager.get_sync_tunables() == {"sync_threshold": (3, 50)}
+            assert await manager.set_tunables({"drop_entry": 1}) == {
+                "drop_entry": (0, 1)}
+            assert await manager.diff_tunables({"drop_entry": 1}) == {}
+            assert (await manager.get_info())["conn_tab_size"] == 4096
+            await manager.get_schedulers()
+            return loop
+        loop = asyncio.run(run())
+        assert len(threads) == 7
+        assert loop not in threads
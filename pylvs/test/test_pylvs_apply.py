@@ -0,0 +1,144 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+import pytest
+import pylvs
+
+DUMP = """-A -t 207.175.44.10:80 -s rr
+-a -t 207.175.44.10:80 -r 192.168.10.1:81 -m -w 1
+-a -t 207.175.44.10:80 -r 192.168.10.2:81 -m -w 1
+-a -t 207.175.44.10:80 -r 192.168.10.3:81 -m -w 1 -x 10 -y 5
+-A -t 207.175.44.20:80 -s wrr -p 120
+-a -t 207.175.44.20:80 -r 192.168.10.1:80 -i -w 1
+-A -u 207.175.44.30:80 -s wlc -p 120 -M 255.255.255.224
+-a -u 207.175.44.30:80 -r 192.168.10.1:81 -m -w 1
+"""
+
+STATE = {
+    "tcp_207.175.44.10:80": {
+        "scheduler": "rr",
+        "servers": [("192.168.10.1:81", "masq", "1"),
+                    ("192.168.10.2:81", "masq", "1"),
+                    ("192.168.10.3:81", "masq", 1, 10, 5)]},
+    "tcp_207.175.44.20:80": {
+        "scheduler": "wrr",
+        "persistence": 120,
+        "servers": {"192.168.10.1:80": {"method": "ipip"}}},
+    "udp_207.175.44.30:80": {
+        "scheduler": "wlc",
+        "persistence": 120,
+        "netmask": "255.255.255.224",
+        "servers": [("192.168.10.1:81", "masq", 1)]},
+}
+
+
+class RecordingBackend(object):
+    """backend returning a fixed dump and recording applied batches
+    """
+
+    def __init__(self, dump):
+        self.dump = dump
+        self.batches = []
+
+    def execute(self, args):
+        raise AssertionError("apply should only use batches")
+
+    def output(self, args):
+        return self.dump
+
+    def restore(self, commands):
+        self.batches.append(commands)
+        return []
+
+
+def _state(**changes):
+    state = dict((name, dict(spec)) for name, spec in STATE.items())
+    state.update(changes)
+    return state
+
+
+class Test_LVSManager_apply:
+
+    def setup_method(self, method):
+        self.backend = RecordingBackend(DUMP)
+        self.manager = pylvs.LVSManager(backend=self.backend)
+
+    def test_no_changes(self):
+        assert self.manager.apply(STATE) == []
+        assert self.backend.batches == []
+
+    def test_weight_change_is_an_edit(self):
+        state = _state()
+        state["tcp_207.175.44.10:80"]["servers"] = [("192.168.10.1:81", "masq", 5),
+                                                    ("192.168.10.2:81", "masq", 1),
+                                                    ("192.168.10.3:81", "masq", 1, 10, 5)]
+        assert self.manager.apply(state, dry_run=True) == [
+            "-e -t 207.175.44.10:80 -r 192.168.10.1:81 -m -w 5"]
+        assert self.backend.batches == []
+
+    def test_threshold_removed_is_an_edit(self):
+        state = _state()
+        state["tcp_207.175.44.10:80"]["servers"] = [("192.168.10.1:81", "masq", 1),
+                                                    ("192.168.10.2:81", "masq", 1),
+                                                    ("192.168.10.3:81", "masq", 1)]
+        assert self.manager.apply(state, dry_run=True) == [
+            "-e -t 207.175.44.10:80 -r 192.168.10.3:81 -m -w 1"]
+
+    def test_method_change_is_an_edit(self):
+        state = _state()
+        state["tcp_207.175.44.20:80"]["servers"] = {"192.168.10.1:80": {"method": "route", "weight": 1}}
+        assert self.manager.apply(state, dry_run=True) == [
+            "-e -t 207.175.44.20:80 -r 192.168.10.1:80 -g -w 1"]
+
+    def test_options_change_is_an_edit(self):
+        state = _state()
+        state["tcp_207.175.44.20:80"]["scheduler"] = "lc"
+        assert self.manager.apply(state, dry_run=True) == [
+            "-E -t 207.175.44.20:80 -s lc -p 120"]
+
+    def test_scheduler_omitted_keeps_options(self):
+        state = _state()
+        state["udp_207.175.44.30:80"] = {
+            "servers": state["udp_207.175.44.30:80"]["servers"]}
+        assert self.manager.apply(state, dry_run=True) == []
+
+    def test_persistence_without_scheduler(self):
+        for name in ("tcp_207.175.44.10:80", "tcp_207.175.44.40:80"):
+            state = _state()
+            state[name] = {"persistence": 300}
+            with pytest.raises(pylvs.LVSValidationError) as error:
+                self.manager.apply(state)
+            assert [(violation.service, violation.message) for violation
+                    in error.value.violations] == [
+                (name, "persistence needs a scheduler")]
+        assert self.backend.batches == []
+
+    def test_add_and_remove(self):
+        state = _state()
+        del state["udp_207.175.44.30:80"]
+        state["tcp_207.175.44.10:80"]["servers"] = [("192.168.10.1:81", "masq", 1),
+                                                    ("192.168.10.3:81", "masq", 1, 10, 5),
+                                                    ("192.168.10.4:81", "masq", 1)]
+        state["tcp_207.175.44.40:443"] = {"scheduler": "sh",
+                                          "servers": [("192.168.10.1:443", "route", 2)]}
+        plan = ["-a -t 207.175.44.10:80 -r 192.168.10.4:81 -m -w 1",
+                "-d -t 207.175.44.10:80 -r 192.168.10.2:81",
+                "-A -t 207.175.44.40:443 -s sh",
+                "-a -t 207.175.44.40:443 -r 192.168.10.1:443 -g -w 2",
+                "-D -u 207.175.44.30:80"]
+        assert self.manager.apply(state) == plan
+        assert self.backend.batches == [[command.split() for command in plan]]
+
+    def test_empty_state_removes_everything(self):
+        assert self.manager.apply({}, dry_run=True) == ["-D -t 207.175.44.10:80",
+                                                        "-D -t 207.175.44.20:80",
+                                                        "-D -u 207.175.44.30:80"]
+
+    def test_invalid_state(self):
+        state = _state()
+        state["tcp_207.175.44.20:80"]["servers"] = {"192.168.10.1:81": {"method": "route"}}
+        with pytest.raises(ValueError):
+            self.manager.apply(state)
+        assert self.backend.batches == []
@@ -0,0 +1,187 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+import json
+import pytest
+import pylvs
+from pylvs.simulator import SimulatedBackend
+
+DUMP = """-A -t 207.175.44.10:80 -s mh -b mh-port
+-a -t 207.175.44.10:80 -r 192.168.10.1:80 -g -w 5 -x 100 -y 50
+-a -t 207.175.44.10:80 -r 192.168.10.2:80 -i -w 1 --tun-type gue --tun-port 6080 --tun-nocsum
+-A -f 1 -s wlc -p 300
+-a -f 1 -r 192.168.10.3:0 -g -w 1
+"""
+
+
+class ProcfsBackend(SimulatedBackend):
+    """simulator pretending to manage the table of this host
+    """
+
+    procfs = True
+
+
+@pytest.fixture
+def proc_root(tmp_path):
+    vs = tmp_path / "proc" / "sys" / "net" / "ipv4" / "vs"
+    vs.mkdir(parents=True)
+    for name, value in (("drop_entry", "1\n"), ("sync_threshold", "3\t50\n"),
+                        ("lblc_expiration", "86400\n")):
+        (vs / name).write_text(value)
+    return str(tmp_path / "proc")
+
+
+class Test_checkpoint:
+
+    def test_roundtrip(self, tmp_path):
+        path = str(tmp_path / "table")
+        backend = SimulatedBackend(DUMP)
+        backend.execute(["--set", "600", "60", "200"])
+        manager = pylvs.LVSManager(backend=backend)
+        checkpoint = manager.save(path)
+        assert len(checkpoint.commands) == 5
+        assert checkpoint.tunables is None
+        with open(path) as saved:
+            header = json.loads(saved.readline())
+            assert saved.read() == DUMP
+        assert header["format"] == "pylvs-checkpoint"
+        assert header["timeouts"] == [600, 60, 200]
+
+        manager.clear_ipvs()
+        manager.add_lvs_instance("207.175.44.20:80", "tcp")
+        manager.set_timeouts(900, 120, 300)
+        manager.load(path)
+        assert backend.output(["-Sn"]) == DUMP
+        assert manager.get_timeouts() == (600, 60, 200)
+
+    def test_tunables(self, tmp_path, proc_root):
+        path = str(tmp_path / "table")
+        manager = pylvs.LVSManager(backend=ProcfsBackend(DUMP),
+                                   proc_root=proc_root)
+        assert manager.save(path).tunables == {"drop_entry": 1,
+                                               "sync_threshold": (3, 50)}
+        manager.set_tunables({"drop_entry": 0, "sync_threshold": (2, 40)})
+        manager.load(path, timeouts=False)
+        assert manager.diff_tunables({"drop_entry": 1,
+                                      "sync_threshold": (3, 50)}) == {}
+        manager.set_tunables({"drop_entry": 0})
+        manager.load(path, tunables=False)
+        assert manager.get_tunables()["drop_entry"] == 0
+
+    def test_single_restore(self, tmp_path):
+        path = str(tmp_path / "table")
+        pylvs.LVSManager(backend=SimulatedBackend(DUMP)).save(path)
+        restored = []
+
+        class Backend(SimulatedBackend):
+            def restore(self, commands):
+                restored.append(commands)
+                return SimulatedBackend.restore(self, commands)
+
+        backend = Backend()
+        pylvs.LVSManager(backend=backend).load(path)
+        assert len(restored) == 1
+        assert ["-C"] not in restored[0]
+        assert restored[0][-1] == ["--set", "900", "120", "300"]
+        assert backend.output(["-Sn"]) == DUMP
+
+    def test_changes_only(self, tmp_path):
+        path = str(tmp_path / "table")
+        backend = SimulatedBackend(DUMP)
+        manager = pylvs.LVSManager(backend=backend)
+        manager.save(path)
+        instance = manager.get_lvs_instance("tcp_207.175.44.10:80")
+        instance.edit_server("192.168.10.1:80", "route", weight=3, upper=100,
+                             lower=50)
+        instance.del_server("192.168.10.2:80")
+        manager.get_lvs_instance("fwm_1").set_opts("rr")
+        manager.add_lvs_instance("207.175.44.20:80", "tcp")
+        manager.add_lvs_instance("207.175.44.10:53", "udp").add_server(
+            "192.168.10.4:53", "route")
+        restored = []
+
+        def restore(commands):
+            restored.append(commands)
+            return SimulatedBackend.restore(backend, commands)
+
+        backend.restore = restore
+        manager.load(path, timeouts=False)
+        assert backend.output(["-Sn"]) == DUMP
+        assert restored == [[
+            ["-D", "-t", "207.175.44.20:80"],
+            ["-D", "-u", "207.175.44.10:53"],
+            ["-e", "-t", "207.175.44.10:80", "-r", "192.168.10.1:80", "-g", 
+             "-w", "5", "-x", "100", "-y", "50"],
+            DUMP.splitlines()[2].split(),
+            ["-E", "-f", "1", "-s", "wlc", "-p", "300"]]]
+        restored[:] = []
+        manager.load(path, timeouts=False)
+        assert restored == []
+
+    def test_tunables_first(self, tmp_path, proc_root):
+        path = str(tmp_path / "table")
+        drop_entry = tmp_path / "proc" / "sys" / "net" / "ipv4" / "vs" / \
+            "drop_entry"
+        found = []
+
+        class Backend(ProcfsBackend):
+            def restore(self, commands):
+                found.append(drop_entry.read_text())
+                return ProcfsBackend.restore(self, commands)
+
+        manager = pylvs.LVSManager(backend=Backend(DUMP), proc_root=proc_root)
+        manager.save(path)
+        manager.clear_ipvs()
+        manager.set_tunables({"drop_entry": 0})
+        found[:] = []
+        manager.load(path, timeouts=False)
+        assert found == ["1\n"]
+
+    def test_invalid(self, tmp_path):
+        path = tmp_path / "table"
+        pylvs.LVSManager(backend=SimulatedBackend(DUMP)).save(str(path))
+        header, body = path.read_text().split("\n", 1)
+        for text, message in (
+                ("", "invalid checkpoint"),
+                ("[1]\n" + body, "is not a checkpoint"),
+                (header.replace('"version": 1', '"version": 2') + "\n" + body,
+                 "unsupported checkpoint version 2"),
+                (header + "\n" + body.split("\n", 1)[1],
+                 "is truncated, 4 of 5 commands found"),
+                (header + "\n" + body.replace("-a -f 1", "--start-daemon", 1),
+                 "line 6 is not a -A or -a command")):
+            path.write_text(text)
+            with pytest.raises(ValueError) as error:
+                pylvs.LVSCheckpoint.read(str(path))
+            assert message in str(error.value)
+        with pytest.raises(ValueError):
+            pylvs.LVSCheckpoint.read(str(tmp_path / "missing"))
+
+
+class Test_diff_snapshots:
+
+    def test_diff(self):
+        old = pylvs.LVSSnapshot(DUMP)
+        new = pylvs.LVSSnapshot(DUMP.replace("-w 5", "-w 7").replace(
+            "-A -f 1 -s wlc -p 300\n-a -f 1 -r 192.168.10.3:0 -g -w 1\n",
+            "-A -u 207.175.44.10:53 -s rr\n"))
+        assert pylvs.diff_snapshots(old, old) == []
+        assert [(change.kind, change.service, change.real_server)
+                for change in pylvs.diff_snapshots(old, new)] == [
+            ("server_changed", "tcp_207.175.44.10:80", "192.168.10.1:80"),
+            ("service_added", "udp_207.175.44.10:53", None),
+            ("server_removed", "fwm_1", "192.168.10.3:0"),
+            ("service_removed", "fwm_1", None)]
+
+    def test_checkpoint(self, tmp_path):
+        path = str(tmp_path / "table")
+        manager = pylvs.LVSManager(backend=SimulatedBackend(DUMP))
+        checkpoint = manager.save(path)
+        manager.get_lvs_instance("fwm_1").del_server("192.168.10.3:0")
+        assert [change.kind for change in pylvs.diff_snapshots(
+            pylvs.LVSCheckpoint.read(path).snapshot(), manager.snapshot())
+            ] == ["server_removed"]
+        assert pylvs.diff_snapshots(checkpoint.snapshot(),
+            pylvs.LVSCheckpoint.read(path).snapshot()) == []
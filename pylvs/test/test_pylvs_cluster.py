@@ -0,0 +1,128 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+import threading
+import time
+import pytest
+import pylvs
+from pylvs.cluster import ClusterManager, LVSClusterError
+from pylvs.simulator import SimulatedBackend
+
+STATE = {"tcp_207.175.44.10:80": {"scheduler": "wrr", "servers": [
+    ("192.168.10.1:80", "route", 5)]}}
+
+
+def _cluster(count=3, broken=(), **kwargs):
+    directors = {}
+    for index in range(count):
+        name = "lb{0}".format(index + 1)
+        if name in broken:
+            # a kernel without wrr
+            directors[name] = SimulatedBackend(schedulers=("rr",))
+        else:
+            directors[name] = SimulatedBackend()
+    return ClusterManager(directors, **kwargs)
+
+
+class Test_ClusterManager:
+
+    def test_apply(self):
+        cluster = _cluster()
+        results = cluster.apply(STATE)
+        assert sorted(results) == ["lb1", "lb2", "lb3"]
+        for name, result in results.items():
+            assert result.status == "ok" and result.error is None
+            assert result.result == ["-A -t 207.175.44.10:80 -s wrr",
+                "-a -t 207.175.44.10:80 -r 192.168.10.1:80 -g -w 5"]
+            assert result.duration >= 0
+            assert cluster.managers[name].list_lvs_instances() == [
+                "tcp_207.175.44.10:80"]
+        assert cluster.apply(STATE, dry_run=True)["lb2"].result == []
+
+    def test_all_policy(self):
+        cluster = _cluster(broken=("lb2",))
+        with pytest.raises(LVSClusterError) as error:
+            cluster.apply(STATE)
+        assert str(error.value).startswith("1 of 3 directors failed: lb2: ")
+        results = error.value.results
+        assert [results[name].status for name in sorted(results)] == [
+            "ok", "failed", "ok"]
+        assert isinstance(results["lb2"].error, ValueError)
+
+    def test_quorum_policy(self):
+        results = _cluster(broken=("lb2",), policy="quorum").apply(STATE)
+        assert results["lb2"].status == "failed"
+        with pytest.raises(LVSClusterError) as error:
+            _cluster(broken=("lb2",), policy="quorum", quorum=3).apply(STATE)
+        assert str(error.value).startswith("2 of 3 directors succeeded, quorum is 3")
+        with pytest.raises(LVSClusterError):
+            _cluster(broken=("lb1", "lb2"), policy="quorum").apply(STATE)
+
+    def test_quorum_subset(self):
+        cluster = _cluster(broken=("lb2",), policy="quorum")
+        assert cluster.run(lambda manager: manager.apply(STATE),
+                           ["lb1"])["lb1"].status == "ok"
+        with pytest.raises(LVSClusterError) as error:
+            cluster.apply(STATE, directors=["lb2", "lb3"])
+        assert str(error.value).startswith("1 of 2 directors succeeded, "
+                                           "quorum is 2: lb2: ")
+        cluster = _cluster(policy="quorum", quorum=3)
+        assert sorted(cluster.apply(STATE, directors=["lb1", "lb3"])) == [
+            "lb1", "lb3"]
+
+    def test_invalid_quorum(self):
+        for quorum in (0, 4):
+            with pytest.raises(ValueError):
+                _cluster(policy="quorum", quorum=quorum)
+        assert _cluster(count=1, quorum=1).quorum == 1
+
+    def test_abort_policy(self):
+        cluster = _cluster(broken=("lb2",), policy="abort", workers=1)
+        with pytest.raises(LVSClusterError) as error:
+            cluster.apply(STATE)
+        results = error.value.results
+        assert [results[name].status for name in sorted(results)] == [
+            "ok", "failed", "skipped"]
+        assert cluster.managers["lb3"].list_lvs_instances() == []
+
+    def test_workers(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def change(manager):
+            with lock:
+                running.append(manager)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(manager)
+            return manager.get_timeouts()
+
+        results = _cluster(count=6, workers=2).run(change)
+        assert max(peak) == 2
+        assert set(result.result for result in results.values()) == set(
+            [(900, 120, 300)])
+
+    def test_invalid(self):
+        cluster = _cluster()
+        with pytest.raises(pylvs.LVSValidationError):
+            cluster.apply({"tcp_207.175.44.10:80": {"scheduler": "xyz"}})
+        with pytest.raises(ValueError):
+            cluster.run(lambda manager: None, directors=["lb9"])
+        with pytest.raises(ValueError):
+            _cluster(policy="majority")
+        results = cluster.run(lambda manager: manager.clear_ipvs(),
+                              directors=["lb1"])
+        assert list(results) == ["lb1"]
+
+
+class Test_command:
+
+    def test_command_prefix(self):
+        backend = pylvs.IpvsadmBackend(["sh", "-c", 'echo "$@"', "ipvsadm"])
+        assert backend.output(["-Sn"]) == "-Sn\n"
+        assert backend.procfs is False
+        assert pylvs.IpvsadmBackend().procfs is True
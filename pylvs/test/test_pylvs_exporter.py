@@ -0,0 +1,90 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+import threading
+
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
+
+import pylvs
+from pylvs.exporter import MetricsCollector, MetricsServer
+from pylvs.simulator import SimulatedBackend
+
+DUMP = """-A -t 207.175.44.10:80 -s rr
+-a -t 207.175.44.10:80 -r 192.168.10.1:81 -m -w 3
+-a -t 207.175.44.10:80 -r 192.168.10.2:81 -m -w 0
+"""
+
+
+class CountingBackend(SimulatedBackend):
+
+    def __init__(self, dump):
+        SimulatedBackend.__init__(self, dump)
+        self.calls = 0
+
+    def output(self, args):
+        self.calls += 1
+        return SimulatedBackend.output(self, args)
+
+
+class Test_exporter:
+
+    def setup_method(self, method):
+        self.backend = CountingBackend(DUMP)
+        self.collector = MetricsCollector(pylvs.LVSManager(backend=self.backend),
+                                          max_age=60)
+
+    def test_metrics(self):
+        lines = self.collector.collect().splitlines()
+        assert "# TYPE pylvs_service_connections_total counter" in lines
+        assert 'pylvs_service_connections_total{service="tcp_207.175.44.10:80"} 0' in lines
+        assert ('pylvs_server_active_connections{real_server="192.168.10.1:81",'
+                'service="tcp_207.175.44.10:80"} 0') in lines
+        assert ('pylvs_server_weight{real_server="192.168.10.2:81",'
+                'service="tcp_207.175.44.10:80"} 0') in lines
+        assert "pylvs_up 1" in lines
+
+    def test_cached(self):
+        threads = [threading.Thread(target=self.collector.collect)
+                   for index in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert self.collector.reads == 1
+        calls = self.backend.calls
+        self.collector.max_age = 0
+        self.collector.created -= 1
+        self.collector.collect()
+        assert self.collector.reads == 2
+        assert self.backend.calls == 2 * calls
+
+    def test_down(self):
+        def output(args):
+            raise ValueError("ipvsadm failed")
+
+        self.backend.output = output
+        assert "pylvs_up 0" in self.collector.collect().splitlines()
+
+    def test_server(self):
+        server = MetricsServer(("127.0.0.1", 0), self.collector)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            url = "http://127.0.0.1:{0}".format(server.server_address[1])
+            response = urlopen(url + "/metrics")
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert b"pylvs_up 1" in response.read()
+            try:
+                urlopen(url + "/")
+                assert False
+            except IOError as error:
+                assert error.code == 404
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
@@ -0,0 +1,100 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+import pytest
+import pylvs
+from pylvs.simulator import SimulatedBackend
+
+DUMP = """-A -t 207.175.44.10:80 -s rr
+-a -t 207.175.44.10:80 -r 192.168.10.1:81 -m -w 1
+-A -f 1 -s wrr -p 120
+-a -f 1 -r 192.168.10.1:0 -g -w 1
+-a -f 1 -r 192.168.10.2:0 -g -w 2
+-A -f 1 -6 -s rr
+-a -f 1 -r [::192.168.10.1]:0 -g -w 1
+-A --sctp-service 207.175.44.10:5060 -s sh
+-a --sctp-service 207.175.44.10:5060 -r 192.168.10.1:5060 -m -w 1
+"""
+
+
+class Test_fwmark:
+
+    def setup_method(self, method):
+        self.backend = SimulatedBackend(DUMP)
+        self.manager = pylvs.LVSManager(backend=self.backend)
+
+    def test_snapshot(self):
+        snapshot = self.manager.snapshot()
+        assert snapshot.list_services() == [
+            ("tcp", "207.175.44.10:80"), ("sctp", "207.175.44.10:5060"),
+            ("fwm", "1"), ("fwm6", "1")]
+        assert snapshot.get_opts("fwm", "1") == ("wrr", "120", None)
+        assert snapshot.list_servers("fwm", "1") == [("192.168.10.1:0", "route", "1"),
+                                                     ("192.168.10.2:0", "route", "2")]
+        # the family of the RealServers is enough without -6
+        assert snapshot.list_servers("fwm6", "1") == [("[::192.168.10.1]:0", "route", "1")]
+        assert snapshot.get_service("fwm6", "1").name == "fwm6_1"
+
+    def test_manage(self):
+        instance = self.manager.add_lvs_instance("2", "fwm6", "sh", persistence=60)
+        assert instance == "fwm6_2"
+        assert instance.svccmd == ["-f", "2", "-6"]
+        instance.add_server("[::192.168.10.1]:8080", "route", weight=3)
+        instance.edit_server("[::192.168.10.1]:8080", "route", weight=4)
+        assert self.backend.output(["-Sn"]).splitlines()[-2:] == [
+            "-A -f 2 -6 -s sh -p 60",
+            "-a -f 2 -6 -r [::192.168.10.1]:8080 -g -w 4"]
+        assert self.manager.get_lvs_instance("fwm6_2").get_opts() == ("sh", "60", None)
+        with pytest.raises(ValueError):
+            self.manager.add_lvs_instance("2", "fwm6", "sh")
+        instance.del_server("[::192.168.10.1]:8080")
+        self.manager.del_lvs_instance("2", "fwm6")
+        with pytest.raises(ValueError):
+            self.manager.get_lvs_instance("fwm6_2")
+
+    def test_validation(self):
+        for mark in ("0", "abc", "4294967296"):
+            with pytest.raises(ValueError):
+                self.manager.add_lvs_instance(mark, "fwm")
+        instance = self.manager.get_lvs_instance("fwm_1")
+        with pytest.raises(ValueError):
+            instance.add_server("[::192.168.10.1]:80", "route")
+        with pytest.raises(ValueError):
+            self.manager.get_lvs_instance("fwm6_1").add_server("192.168.10.1:80", "route")
+        with pytest.raises(ValueError):
+            instance.get_conn_distribution()
+
+    def test_sctp(self):
+        instance = self.manager.get_lvs_instance("sctp_207.175.44.10:5060")
+        assert instance.list_servers() == [("192.168.10.1:5060", "masq", "1")]
+        self.manager.add_lvs_instance("207.175.44.11:5060", "sctp", "rr")
+        assert "-A --sctp-service 207.175.44.11:5060 -s rr" in self.backend.output(["-Sn"])
+
+    def test_stats(self):
+        stats = self.manager.get_stats()
+        assert sorted(stats) == ["fwm6_1", "fwm_1", "sctp_207.175.44.10:5060",
+                                 "tcp_207.175.44.10:80"]
+        stats, servers = self.manager.get_lvs_instance("fwm6_1").get_stats()
+        assert list(servers) == ["[::192.168.10.1]:0"]
+
+    def test_transaction_and_apply(self):
+        with self.manager.transaction() as txn:
+            instance = txn.get_lvs_instance("fwm6_1")
+            instance.add_server("[::192.168.10.2]:0", "route")
+            with pytest.raises(ValueError):
+                txn.get_lvs_instance("fwm_x")
+        assert len(self.manager.get_lvs_instance("fwm6_1").list_servers()) == 2
+
+        with pytest.raises(pylvs.LVSTransactionError) as error:
+            with self.manager.transaction() as txn:
+                txn.get_lvs_instance("fwm6_1").del_server("[::192.168.10.9]:0")
+        assert error.value.index == 0
+
+        plan = self.manager.apply({"fwm_1": {"scheduler": "wrr", "persistence": 120,
+                                             "servers": [("192.168.10.1:0", "route", 1)]}})
+        assert plan == ["-d -f 1 -r 192.168.10.2:0",
+                        "-D -t 207.175.44.10:80",
+                        "-D --sctp-service 207.175.44.10:5060",
+                        "-D -f 1 -6"]
@@ -0,0 +1,213 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+import asyncio
+import socket
+import time
+
+import pytest
+from pylvs.aio import AsyncLVSManager
+from pylvs.health import HealthChecker, HTTPCheck, TCPCheck
+
+
+class TableBackend(object):
+    """async backend keeping the RealServers of one service in memory
+    """
+
+    def __init__(self, service, servers):
+        self.service = service
+        # real_server -> [method flag, weight, extra args]
+        self.servers = servers
+        self.batches = []
+
+    async def execute(self, args):
+        raise AssertionError("the checker should only use batches")
+
+    async def output(self, args):
+        lines = ["-A -t {0} -s rr".format(self.service)]
+        for real_server, (method, weight, extra) in sorted(self.servers.items()):
+            lines.append("-a -t {0} -r {1} {2} -w {3}{4}".format(
+                self.service, real_server, method, weight, extra))
+        return "\n".join(lines) + "\n"
+
+    async def restore(self, commands):
+        self.batches.append([" ".join(args) for args in commands])
+        for args in commands:
+            weight = args.index("-w")
+            self.servers[args[4]] = [args[5], int(args[weight + 1]),
+                                     "".join(" " + arg for arg
+                                             in args[weight + 2:])]
+        return []
+
+
+async def _http_server(status, port=0):
+    async def handle(reader, writer):
+        await reader.readline()
+        writer.write("HTTP/1.0 {0} X\r\n\r\n".format(status).encode("ascii"))
+        await writer.drain()
+        writer.close()
+    server = await asyncio.start_server(handle, "127.0.0.1", port)
+    return server, server.sockets[0].getsockname()[1]
+
+
+def _closed_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class Test_HealthChecker:
+
+    def test_tcp_and_http_checks(self):
+        async def run():
+            ok, ok_port = await _http_server(200)
+            broken, broken_port = await _http_server(503)
+            closed = _closed_port()
+            results = await asyncio.gather(
+                TCPCheck()("127.0.0.1:{0}".format(ok_port)),
+                HTTPCheck("/health")("127.0.0.1:{0}".format(ok_port)),
+                HTTPCheck("/health")("127.0.0.1:{0}".format(broken_port)),
+                TCPCheck()("127.0.0.1:{0}".format(closed)),
+                return_exceptions=True)
+            ok.close()
+            broken.close()
+            return results
+        results = asyncio.run(run())
+        assert results[:3] == [True, True, False]
+        assert isinstance(results[3], OSError)
+
+    def test_quiesce_and_restore(self):
+        async def run():
+            up, up_port = await _http_server(200)
+            down_port = _closed_port()
+            up_server = "127.0.0.1:{0}".format(up_port)
+            down_server = "127.0.0.1:{0}".format(down_port)
+            backend = TableBackend("207.175.44.10:80", {
+                up_server: ["-m", 5, ""],
+                down_server: ["-m", 7, " -x 100 -y 50"]})
+            checker = HealthChecker(AsyncLVSManager(backend=backend),
+                                    timeout=1, rise=2, fall=2)
+            await checker.add_service("tcp_207.175.44.10:80", HTTPCheck())
+
+            assert await checker.run_round(now=0) == []
+            assert await checker.run_round(now=0) == []
+            # not due yet
+            assert await checker.run_round(now=1) == []
+            changes = await checker.run_round(now=10)
+            assert changes == [("tcp_207.175.44.10:80", down_server, False)]
+            assert backend.batches == [["-e -t 207.175.44.10:80 -r {0} -m -w 0 "
+                                        "-x 100 -y 50".format(down_server)]]
+
+            # the RealServer comes back
+            server, port = await _http_server(200, down_port)
+            assert await checker.run_round(now=20) == []
+            changes = await checker.run_round(now=30)
+            assert changes == [("tcp_207.175.44.10:80", down_server, True)]
+            assert backend.batches[-1] == ["-e -t 207.175.44.10:80 -r {0} -m -w 7 "
+                                           "-x 100 -y 50".format(down_server)]
+            assert backend.servers[up_server][1] == 5
+            up.close()
+            server.close()
+        asyncio.run(run())
+
+    def test_tunnel_options_kept(self):
+        gue = " --tun-type gue --tun-port 6080 --tun-csum"
+        backend = TableBackend("10.0.0.1:80", {"10.0.0.2:80": ["-i", 5, gue]})
+        checker = HealthChecker(AsyncLVSManager(backend=backend), fall=1, rise=1)
+        healthy = []
+
+        async def check(real_server):
+            return bool(healthy)
+
+        async def run():
+            checker.add("tcp_10.0.0.1:80", "10.0.0.2:80", check)
+            assert await checker.run_round(now=0) == [
+                ("tcp_10.0.0.1:80", "10.0.0.2:80", False)]
+            assert backend.servers["10.0.0.2:80"] == ["-i", 0, gue]
+            healthy.append(True)
+            assert await checker.run_round(now=10) == [
+                ("tcp_10.0.0.1:80", "10.0.0.2:80", True)]
+        asyncio.run(run())
+        assert backend.servers["10.0.0.2:80"] == ["-i", 5, gue]
+
+    def test_missing_server_keeps_state(self):
+        backend = TableBackend("207.175.44.10:80", {"192.168.10.1:80": ["-g", 1, ""]})
+        checker = HealthChecker(AsyncLVSManager(backend=backend), fall=1)
+
+        async def run():
+            checker.add("tcp_207.175.44.10:80", "192.168.10.1:80", lambda rs: False)
+            checker.add("tcp_207.175.44.10:80", "192.168.10.2:80", lambda rs: False)
+            return await checker.run_round(now=0)
+        assert asyncio.run(run()) == [("tcp_207.175.44.10:80", "192.168.10.1:80", False)]
+        states = dict((target.real_server, target.healthy)
+                      for target in checker.targets.values())
+        assert states == {"192.168.10.1:80": False, "192.168.10.2:80": True}
+
+    def test_one_batch_per_round(self):
+        servers = dict(("192.168.10.{0}:80".format(i), ["-g", 1, ""])
+                       for i in range(1, 51))
+        backend = TableBackend("207.175.44.10:80", servers)
+        checker = HealthChecker(AsyncLVSManager(backend=backend), fall=1)
+
+        async def failing(real_server):
+            return real_server.endswith("0:80") is False
+
+        async def run():
+            await checker.add_service("tcp_207.175.44.10:80", failing)
+            return await checker.run_round(now=0)
+        changes = asyncio.run(run())
+        assert len(changes) == 5
+        assert len(backend.batches) == 1
+        assert len(backend.batches[0]) == 5
+
+    def test_timeout_and_callable(self):
+        backend = TableBackend("207.175.44.10:80", {"192.168.10.1:80": ["-g", 3, ""],
+                                                   "192.168.10.2:80": ["-g", 3, ""]})
+        checker = HealthChecker(AsyncLVSManager(backend=backend), fall=1)
+
+        async def slow(real_server):
+            await asyncio.sleep(10)
+            return True
+
+        async def run():
+            checker.add("tcp_207.175.44.10:80", "192.168.10.1:80", slow, timeout=0.05)
+            checker.add("tcp_207.175.44.10:80", "192.168.10.2:80", lambda rs: True)
+            return await checker.run_round(now=0)
+        assert asyncio.run(run()) == [("tcp_207.175.44.10:80", "192.168.10.1:80", False)]
+        assert backend.servers["192.168.10.1:80"][1] == 0
+
+    def test_blocking_callable(self):
+        backend = TableBackend("207.175.44.10:80", {"192.168.10.1:80": ["-g", 3, ""],
+                                                   "192.168.10.2:80": ["-g", 3, ""]})
+        checker = HealthChecker(AsyncLVSManager(backend=backend), fall=1)
+
+        def blocking(real_server):
+            time.sleep(0.5)
+            return True
+
+        async def run():
+            checker.add("tcp_207.175.44.10:80", "192.168.10.1:80", blocking,
+                        timeout=0.05)
+            checker.add("tcp_207.175.44.10:80", "192.168.10.2:80",
+                        lambda rs: True)
+            start = time.monotonic()
+            changes = await checker.run_round(now=0)
+            return changes, time.monotonic() - start
+        changes, duration = asyncio.run(run())
+        assert changes == [("tcp_207.175.44.10:80", "192.168.10.1:80", False)]
+        assert duration < 0.4
+
+    def test_invalid(self):
+        checker = HealthChecker(AsyncLVSManager(backend=TableBackend("207.175.44.10:80", {})))
+        with pytest.raises(ValueError):
+            checker.add("icmp_207.175.44.10:80", "192.168.10.1:80")
+        with pytest.raises(ValueError):
+            checker.add("tcp_207.175.44.10:80", "192.168.10.1:80", check="tcp")
+        with pytest.raises(ValueError):
+            checker.add("tcp_207.175.44.10:80", "[2001:db8::1]:80")
+        with pytest.raises(ValueError):
+            checker.add("fwm6_1", "192.168.10.1:80")
@@ -4,10 +4,17 @@ Copyright (c) 2012 Stephan Schultchen
 """
 
 import pytest
-import subprocess
 import pylvs
 import os
-import inspect
+from pylvs.simulator import SimulatedBackend
+
+def _fixture():
+    """the table set up by ipvsadm.sh, as ipvsadm arguments
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ipvsadm.sh")
+    with open(path) as script:
+        return "".join(line.replace("ipvsadm ", "", 1) for line in script
+                       if line.startswith("ipvsadm -") and "-C" not in line)
         
 class TestLVSInstance_tcp_207_175_44_10_Port80:
     #def __init__(self):
@@ -18,18 +25,8 @@ class TestLVSInstance_tcp_207_175_44_10_Port80:
         """ setup any state specific to the execution of the given class (which
         usually contains tests).
         """
-        scriptpath = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
-        subprocess.check_call([scriptpath+'/ipvsadm.sh'])
-        manager = pylvs.LVSManager()
+        manager = pylvs.LVSManager(backend=SimulatedBackend(_fixture()))
         self.instance = manager.get_lvs_instance('tcp_207.175.44.10:80')
-
-    @classmethod
-    def teardown_class(self):
-        """ teardown any state that was previously setup with a call to
-        setup_class.
-        """
-        scriptpath = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
-        subprocess.check_call([scriptpath+'/ipvsadm_cleanup.sh'])
         
     # test LVSInstance.add_server()
     # masquerading target
@@ -54,28 +51,36 @@ class TestLVSInstance_tcp_207_175_44_10_Port80:
     
     # they should fail
     def test_add_server_masq_dublicate(self):
-        pytest.raises(ValueError, "self.instance.add_server('192.168.10.11:81', 'masq')")
+        with pytest.raises(ValueError):
+            self.instance.add_server('192.168.10.11:81', 'masq')
     
     def test_add_server_masq_same_as_service_addr(self):
-        pytest.raises(ValueError, "self.instance.add_server('207.175.44.10:81', 'masq')")
+        with pytest.raises(ValueError):
+            self.instance.add_server('207.175.44.10:81', 'masq')
     
     def test_add_server_masq_wrong_method(self):
-        pytest.raises(ValueError, "self.instance.add_server('192.168.10.17:81', 'blubber')")
+        with pytest.raises(ValueError):
+            self.instance.add_server('192.168.10.17:81', 'blubber')
     
     def test_add_server_masq_weigth_out_of_range(self):
-        pytest.raises(ValueError, "self.instance.add_server('192.168.10.17:81', 'masq', weight = 'ui')")
+        with pytest.raises(ValueError):
+            self.instance.add_server('192.168.10.17:81', 'masq', weight = 'ui')
     
     def test_add_server_masq_upper_out_of_range(self):
-        pytest.raises(ValueError, "self.instance.add_server('192.168.10.17:81', 'masq', upper = 75555)")
+        with pytest.raises(ValueError):
+            self.instance.add_server('192.168.10.17:81', 'masq', upper = 75555)
     
     def test_add_server_masq_upper_lower_out_of_range(self):
-        pytest.raises(ValueError, "self.instance.add_server('192.168.10.17:81', 'masq', upper = 10, lower = 884642)")
+        with pytest.raises(ValueError):
+            self.instance.add_server('192.168.10.17:81', 'masq', upper = 10, lower = 884642)
     
     def test_add_server_masq_weigth_upper_out_of_range(self):
-        pytest.raises(ValueError, "self.instance.add_server('192.168.10.17:81', 'masq', weight = 10, upper = 'blubber')")
+        with pytest.raises(ValueError):
+            self.instance.add_server('192.168.10.17:81', 'masq', weight = 10, upper = 'blubber')
     
     def test_add_server_masq_weigth_upper_lower_out_of_range(self):
-        pytest.raises(ValueError, "self.instance.add_server('192.168.10.17:81', 'masq', weight = 10, upper = 10, lower = -10)")
+        with pytest.raises(ValueError):
+            self.instance.add_server('192.168.10.17:81', 'masq', weight = 10, upper = 10, lower = -10)
     
     # ipip tunnel target
     # the should pass
@@ -99,31 +104,40 @@ class TestLVSInstance_tcp_207_175_44_10_Port80:
     
     # they should fail
     def test_add_server_ipip_dublicate(self):
-        pytest.raises(ValueError, "self.instance.add_server('192.168.10.21:80', 'ipip')")
+        with pytest.raises(ValueError):
+            self.instance.add_server('192.168.10.21:80', 'ipip')
     
     def test_add_server_ipip_same_as_service_addr(self):
-        pytest.raises(ValueError, "self.instance.add_server('207.175.44.10:80', 'ipip')")
+        with pytest.raises(ValueError):
+            self.instance.add_server('207.175.44.10:80', 'ipip')
         
     def test_add_server_ipip_wrong_method(self):
-        pytest.raises(ValueError, "self.instance.add_server('192.168.10.27:80', 'blubber')")
+        with pytest.raises(ValueError):
+            self.instance.add_server('192.168.10.27:80', 'blubber')
     
     def test_add_server_ipip_wrong_port(self):
-        pytest.raises(ValueError, "self.instance.add_server('192.168.10.27:81', 'ipip')")
+        with pytest.raises(ValueError):
+            self.instance.add_server('192.168.10.27:81', 'ipip')
     
     def test_add_server_ipip_weigth_out_of_range(self):
-        pytest.raises(ValueError, "self.instance.add_server('192.168.10.27:80', 'ipip', weight = 'ui')")
+        with pytest.raises(ValueError):
+            self.instance.add_server('192.168.10.27:80', 'ipip', weight = 'ui')
     
     def test_add_server_ipip_upper_out_of_range(self):
-        pytest.raises(ValueError, "self.instance.add_server('192.168.10.27:80', 'ipip', upper = 75555)")
+        with pytest.raises(ValueError):
+            self.instance.add_server('192.168.10.27:80', 'ipip', upper = 75555)
     
     def test_add_server_ipip_upper_lower_out_of_range(self):
-        pytest.raises(ValueError, "self.instance.add_server('192.168.10.27:80', 'ipip', upper = 10, lower = 884642)")
+        with pytest.raises(ValueError):
+            self.instance.add_server('192.168.10.27:80', 'ipip', upper = 10, lower = 884642)
     
     def test_add_server_ipip_weigth_upper_out_of_range(self):
-        pytest.raises(ValueError, "self.instance.add_server('192.168.10.27:80', 'ipip', weight = 10, upper = 'blubber')")
+        with pytest.raises(ValueError):
+            self.instance.add_server('192.168.10.27:80', 'ipip', weight = 10, upper = 'blubber')
     
     def test_add_server_ipip_weigth_upper_lower_out_of_range(self):
-        pytest.raises(ValueError, "self.instance.add_server('192.168.10.27:80', 'ipip', weight = 10, upper = 10, lower = -10)")
+        with pytest.raises(ValueError):
+            self.instance.add_server('192.168.10.27:80', 'ipip', weight = 10, upper = 10, lower = -10)
     
     # direct routing target
     # they should pass   
@@ -147,31 +161,40 @@ class TestLVSInstance_tcp_207_175_44_10_Port80:
     
     # they should fail
     def test_add_server_route_dublicate(self):
-        pytest.raises(ValueError, "self.instance.add_server('192.168.10.31:80', 'route')")
+        with pytest.raises(ValueError):
+            self.instance.add_server('192.168.10.31:80', 'route')
     
     def test_add_server_route_same_as_service_addr(self):
-        pytest.raises(ValueError, "self.instance.add_server('207.175.44.10:80', 'route')")
+        with pytest.raises(ValueError):
+            self.instance.add_server('207.175.44.10:80', 'route')
         
     def test_add_server_route_wrong_method(self):
-        pytest.raises(ValueError, "self.instance.add_server('192.168.10.37:80', 'blubber')")
+        with pytest.raises(ValueError):
+            self.instance.add_server('192.168.10.37:80', 'blubber')
     
     def test_add_server_route_wrong_port(self):
-        pytest.raises(ValueError, "self.instance.add_server('192.168.10.31:81', 'route')")
+        with pytest.raises(ValueError):
+            self.instance.add_server('192.168.10.31:81', 'route')
     
     def test_add_server_route_weigth_out_of_range(self):
-        pytest.raises(ValueError, "self.instance.add_server('192.168.10.37:80', 'route', weight = 'ui')")
+        with pytest.raises(ValueError):
+            self.instance.add_server('192.168.10.37:80', 'route', weight = 'ui')
     
     def test_add_server_route_upper_out_of_range(self):
-        pytest.raises(ValueError, "self.instance.add_server('192.168.10.37:80', 'route', upper = 75555)")
+        with pytest.raises(ValueError):
+            self.instance.add_server('192.168.10.37:80', 'route', upper = 75555)
     
     def test_add_server_route_upper_lower_out_of_range(self):
-        pytest.raises(ValueError, "self.instance.add_server('192.168.10.37:80', 'route', upper = 10, lower = 884642)")
+        with pytest.raises(ValueError):
+            self.instance.add_server('192.168.10.37:80', 'route', upper = 10, lower = 884642)
     
     def test_add_server_route_weigth_upper_out_of_range(self):
-        pytest.raises(ValueError, "self.instance.add_server('192.168.10.37:80', 'route', weight = 10, upper = 'blubber')")
+        with pytest.raises(ValueError):
+            self.instance.add_server('192.168.10.37:80', 'route', weight = 10, upper = 'blubber')
     
     def test_add_server_route_weigth_upper_lower_out_of_range(self):
-        pytest.raises(ValueError, "self.instance.add_server('192.168.10.37:80', 'route', weight = 10, upper = 10, lower = -10)")
+        with pytest.raises(ValueError):
+            self.instance.add_server('192.168.10.37:80', 'route', weight = 10, upper = 10, lower = -10)
     
     
     #test LVSInstance.edit_server()
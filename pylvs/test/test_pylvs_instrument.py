@@ -0,0 +1,148 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+import logging
+import subprocess
+import pytest
+import pylvs
+from pylvs import instrument
+from pylvs.instrument import InstrumentedBackend
+from pylvs.simulator import SimulatedBackend
+
+DUMP = """-A -t 207.175.44.10:80 -s rr
+-a -t 207.175.44.10:80 -r 192.168.10.1:81 -m -w 1
+"""
+
+
+class FakePopen(object):
+    """pretends to be an ipvsadm process failing with exit code 2
+    """
+
+    def __init__(self, args, **kwargs):
+        self.args = args
+        self.returncode = 2
+
+    def communicate(self, stdin=None):
+        return "", "Service not defined\n"
+
+
+class Test_instrument:
+
+    def setup_method(self, method):
+        self.backend = InstrumentedBackend(SimulatedBackend(DUMP))
+        self.manager = pylvs.LVSManager(backend=self.backend)
+
+    def test_operation(self):
+        assert instrument.operation("execute", ["-A", "-t", "1.2.3.4:80"]) == "add_service"
+        assert instrument.operation("output", ["-Sn"]) == "dump"
+        assert instrument.operation("stream", ["-L", "-n", "-c"]) == "list"
+        assert instrument.operation("restore", [["-C"]]) == "restore"
+        assert instrument.operation("output", ["-v"]) == "other"
+
+    def test_counts(self):
+        instance = self.manager.get_lvs_instance("tcp_207.175.44.10:80")
+        instance.add_server("192.168.10.2:81", "masq")
+        with pytest.raises(ValueError):
+            instance.add_server("192.168.10.2:81", "masq")
+        report = self.backend.report()
+        assert report["add_server"].count == 2
+        assert report["add_server"].errors == 1
+        assert report["dump"].count >= 1
+        histogram = report["add_server"].histogram()
+        assert histogram[-1] == (float("inf"), 2)
+        assert [count for bound, count in histogram] == sorted(
+               count for bound, count in histogram)
+        # report returns copies
+        report["add_server"].count = 10
+        assert self.backend.report()["add_server"].count == 2
+        self.backend.reset()
+        assert self.backend.report() == {}
+
+    def test_hooks(self):
+        pre, post = [], []
+        self.backend.add_hook(pre=lambda call: pre.append(call.duration),
+                              post=post.append)
+        self.manager.add_lvs_instance("207.175.44.20:80", "tcp", "rr")
+        with pytest.raises(ValueError):
+            self.manager.add_lvs_instance("207.175.44.20:80", "tcp", "rr")
+        assert pre == [None, None]
+        assert [call.args[:3] for call in post] == [["-A", "-t", "207.175.44.20:80"]] * 2
+        assert not post[0].failed and post[0].returncode == 0
+        assert post[0].duration >= 0
+        assert post[1].failed and isinstance(post[1].error, ValueError)
+        assert post[1].stderr == str(post[1].error)
+        self.backend.remove_hook(post=post.append)
+        self.manager.del_lvs_instance("207.175.44.20:80", "tcp")
+        assert len(post) == 2 and len(pre) == 3
+
+    def test_broken_hook(self, caplog):
+        def broken(call):
+            raise RuntimeError("broken")
+
+        self.backend.add_hook(post=broken)
+        with caplog.at_level(logging.ERROR, logger="pylvs"):
+            self.manager.add_lvs_instance("207.175.44.20:80", "tcp", "rr")
+        assert "hook" in caplog.text
+        assert self.manager.get_lvs_instance("tcp_207.175.44.20:80") is not None
+
+    def test_slow(self, caplog, monkeypatch):
+        ticks = iter([0.0, 2.0])
+        monkeypatch.setattr(instrument, "_timer", lambda: next(ticks))
+        self.backend.slow = 1
+        with caplog.at_level(logging.WARNING, logger="pylvs"):
+            self.backend.execute(["-A", "-t", "207.175.44.20:80", "-s", "rr"])
+        assert "slow IPVS add_service call: 2.000s: -A -t 207.175.44.20:80" in caplog.text
+
+    def test_stream_and_restore(self):
+        post = []
+        self.backend.add_hook(post=post.append)
+        lines = list(self.backend.stream(["-Sn"]))
+        assert len(lines) == 2
+        failed = self.backend.restore([["-A", "-t", "207.175.44.20:80", "-s", "rr"],
+                                       ["-A", "-t", "207.175.44.20:80", "-s", "rr"]])
+        assert [index for index, message in failed] == [1]
+        assert [call.method for call in post] == ["stream", "restore"]
+        assert post[1].failed and post[1].stderr == failed[0][1]
+        report = self.backend.report()
+        assert report["restore"].errors == 1
+
+    def test_procfs_is_delegated(self):
+        assert self.backend.procfs is False
+        assert InstrumentedBackend(pylvs.IpvsadmBackend()).procfs is True
+
+
+class Test_IpvsadmError:
+
+    def test_exit_code_and_stderr(self, monkeypatch):
+        monkeypatch.setattr(subprocess, "Popen", FakePopen)
+        post = []
+        backend = InstrumentedBackend(pylvs.IpvsadmBackend())
+        backend.add_hook(post=post.append)
+        with pytest.raises(pylvs.IpvsadmError) as error:
+            backend.execute(["-D", "-t", "207.175.44.10:80"])
+        assert error.value.returncode == 2
+        assert error.value.stderr == "Service not defined\n"
+        assert str(error.value) == "ipvsadm failed with exit code 2: Service not defined"
+        assert isinstance(error.value, ValueError)
+        assert (post[0].returncode, post[0].stderr) == (2, "Service not defined\n")
+
+    def test_manager_keeps_exit_code(self, monkeypatch):
+        monkeypatch.setattr(subprocess, "Popen", FakePopen)
+        manager = pylvs.LVSManager()
+        with pytest.raises(pylvs.IpvsadmError) as error:
+            manager.del_lvs_instance("207.175.44.10:80", "tcp")
+        assert str(error.value) == ("could not delete LVS instance, already "
+            "gone?: ipvsadm failed with exit code 2: Service not defined")
+        assert error.value.returncode == 2
+        assert error.value.stderr == "Service not defined\n"
+
+    def test_not_installed(self, monkeypatch):
+        def popen(args, **kwargs):
+            raise OSError(2, "No such file or directory")
+
+        monkeypatch.setattr(subprocess, "Popen", popen)
+        with pytest.raises(pylvs.IpvsadmError) as error:
+            pylvs.IpvsadmBackend().output(["-Sn"])
+        assert error.value.returncode is None
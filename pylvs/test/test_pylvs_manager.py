@@ -4,31 +4,25 @@ Copyright (c) 2012 Stephan Schultchen
 """
 
 import pytest
-import subprocess
 import pylvs
 import os
-import inspect
+from pylvs.simulator import SimulatedBackend
+
+def _fixture():
+    """the table set up by ipvsadm.sh, as ipvsadm arguments
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ipvsadm.sh")
+    with open(path) as script:
+        return "".join(line.replace("ipvsadm ", "", 1) for line in script
+                       if line.startswith("ipvsadm -") and "-C" not in line)
         
 class Test_LVSManager:
     
     def _initlvs(self):
-        scriptpath = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
-        subprocess.check_call([scriptpath+'/ipvsadm.sh'])
-
-    @classmethod
-    def setup_class(self):
-        """ setup any state specific to the execution of the given class (which
-        usually contains tests).
-        """
-        pass
-
-    @classmethod
-    def teardown_class(self):
-        """ teardown any state that was previously setup with a call to
-        setup_class.
-        """
-        scriptpath = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
-        subprocess.check_call([scriptpath+'/ipvsadm_cleanup.sh'])
+        self.backend = SimulatedBackend(_fixture())
+    
+    def _manager(self):
+        return pylvs.LVSManager(backend=self.backend)
 
     # validate LVSManager.add_lvs_instance
     def test_add_lvs_instance(self):
@@ -40,7 +34,7 @@ class Test_LVSManager:
         for i in options:
             service_addr, proto = i
             self._initlvs()
-            manager = pylvs.LVSManager()
+            manager = self._manager()
             assert manager.add_lvs_instance(service_addr, proto) == proto+"_"+service_addr
 
     def test_add_lvs_instance_duplicate(self):
@@ -52,8 +46,9 @@ class Test_LVSManager:
         for i in options:
             service_addr, proto = i
             self._initlvs()
-            manager = pylvs.LVSManager()
-            pytest.raises(ValueError, "manager.add_lvs_instance(service_addr, proto)")
+            manager = self._manager()
+            with pytest.raises(ValueError):
+                manager.add_lvs_instance(service_addr, proto)
     
     def test_add_lvs_instance_invalid_ip(self):
         options = (("207.175.666.10:80", "tcp"), 
@@ -64,8 +59,9 @@ class Test_LVSManager:
         for i in options:
             service_addr, proto = i
             self._initlvs()
-            manager = pylvs.LVSManager()
-            pytest.raises(ValueError, "manager.add_lvs_instance(service_addr, proto)")
+            manager = self._manager()
+            with pytest.raises(ValueError):
+                manager.add_lvs_instance(service_addr, proto)
         
     def test_add_lvs_instance_invalid_port(self):
         options = (("192.168.10.10:-80", "tcp"), 
@@ -76,8 +72,9 @@ class Test_LVSManager:
         for i in options:
             service_addr, proto = i
             self._initlvs()
-            manager = pylvs.LVSManager()
-            pytest.raises(ValueError, "manager.add_lvs_instance(service_addr, proto)")
+            manager = self._manager()
+            with pytest.raises(ValueError):
+                manager.add_lvs_instance(service_addr, proto)
     
     def test_add_lvs_instance_invalid_proto(self):
         options = (("192.168.10.10:80", "fwmark"), 
@@ -88,8 +85,9 @@ class Test_LVSManager:
         for i in options:
             service_addr, proto = i
             self._initlvs()
-            manager = pylvs.LVSManager()
-            pytest.raises(ValueError, "manager.add_lvs_instance(service_addr, proto)")
+            manager = self._manager()
+            with pytest.raises(ValueError):
+                manager.add_lvs_instance(service_addr, proto)
     
     # validate LVSManager.del_lvs_instance
     def test_del_lvs_instance(self):
@@ -101,7 +99,7 @@ class Test_LVSManager:
         for i in options:
             service_addr, proto = i
             self._initlvs()
-            manager = pylvs.LVSManager()
+            manager = self._manager()
             assert manager.del_lvs_instance(service_addr, proto) == True
         
     def test_del_lvs_instance_non_existent(self):
@@ -113,8 +111,9 @@ class Test_LVSManager:
         for i in options:
             service_addr, proto = i
             self._initlvs()
-            manager = pylvs.LVSManager()
-            pytest.raises(ValueError, "manager.del_lvs_instance(service_addr, proto)")
+            manager = self._manager()
+            with pytest.raises(ValueError):
+                manager.del_lvs_instance(service_addr, proto)
         
     def test_del_lvs_instance_invalid_ip(self):
         options = (("192.168.666.10:80", "tcp"), 
@@ -125,8 +124,9 @@ class Test_LVSManager:
         for i in options:
             service_addr, proto = i
             self._initlvs()
-            manager = pylvs.LVSManager()
-            pytest.raises(ValueError, "manager.del_lvs_instance(service_addr, proto)")
+            manager = self._manager()
+            with pytest.raises(ValueError):
+                manager.del_lvs_instance(service_addr, proto)
         
     def test_del_lvs_instance_invalid_port(self):
         options = (("207.175.44.10:-80", "tcp"), 
@@ -137,8 +137,9 @@ class Test_LVSManager:
         for i in options:
             service_addr, proto = i
             self._initlvs()
-            manager = pylvs.LVSManager()
-            pytest.raises(ValueError, "manager.del_lvs_instance(service_addr, proto)")
+            manager = self._manager()
+            with pytest.raises(ValueError):
+                manager.del_lvs_instance(service_addr, proto)
     
     def test_del_lvs_instance_invalid_proto(self):
         options = (("207.175.44.10:80", "fwmark"), 
@@ -149,8 +150,9 @@ class Test_LVSManager:
         for i in options:
             service_addr, proto = i
             self._initlvs()
-            manager = pylvs.LVSManager()
-            pytest.raises(ValueError, "manager.del_lvs_instance(service_addr, proto)")
+            manager = self._manager()
+            with pytest.raises(ValueError):
+                manager.del_lvs_instance(service_addr, proto)
     
     def test_get_lvs_instance(self):
         options = ("tcp_207.175.44.10:80", 
@@ -160,7 +162,7 @@ class Test_LVSManager:
                    )
         for name in options:
             self._initlvs()
-            manager = pylvs.LVSManager()
+            manager = self._manager()
             assert manager.get_lvs_instance(name) == name
     
     def test_get_lvs_instance_invalid(self):
@@ -171,17 +173,18 @@ class Test_LVSManager:
                    )
         for name in options:
             self._initlvs()
-            manager = pylvs.LVSManager()
-            pytest.raises(ValueError, "manager.get_lvs_instance(name)")
+            manager = self._manager()
+            with pytest.raises(ValueError):
+                manager.get_lvs_instance(name)
     
     def test_list_lvs_instances_count(self):
         self._initlvs()
-        manager = pylvs.LVSManager()
+        manager = self._manager()
         assert len(manager.list_lvs_instances()) == 12
         
     def test_list_lvs_instances_members(self):
         self._initlvs()
-        manager = pylvs.LVSManager()
+        manager = self._manager()
         instances_a = ["tcp_207.175.44.10:80", 
                      "tcp_207.175.44.20:80", 
                      "tcp_207.175.44.30:80", 
@@ -201,15 +204,81 @@ class Test_LVSManager:
     
     def test_clear_ipvs(self):
         self._initlvs()
-        manager = pylvs.LVSManager()
+        manager = self._manager()
         assert manager.clear_ipvs() == True
     
     def test_set_timeouts(self):
         self._initlvs()
-        manager = pylvs.LVSManager()
+        manager = self._manager()
         assert manager.set_timeouts(10, 10, 10) == True
         
     def test_zero(self):
         self._initlvs()
-        manager = pylvs.LVSManager()
-        assert manager.zero() == True
\ No newline at end of file
+        manager = self._manager()
+        assert manager.zero() == True
+
+class Test_LVSTransaction:
+    
+    def _initlvs(self):
+        self.backend = SimulatedBackend(_fixture())
+    
+    def _manager(self):
+        return pylvs.LVSManager(backend=self.backend)
+
+    def test_transaction_commit(self):
+        self._initlvs()
+        manager = self._manager()
+        with manager.transaction() as txn:
+            instance = txn.add_lvs_instance("192.168.10.10:80", "tcp")
+            instance.set_opts("wrr")
+            instance.add_server("192.168.20.1:80", "route", weight = 5)
+            instance.add_server("192.168.20.2:80", "route", weight = 5)
+            txn.get_lvs_instance("tcp_207.175.44.10:80").del_server("192.168.10.1:81")
+            assert len(txn) == 5
+        assert "tcp_192.168.10.10:80" in manager.list_lvs_instances()
+        instance = manager.get_lvs_instance("tcp_192.168.10.10:80")
+        assert instance.get_opts() == ('wrr', None, None)
+        assert instance.list_servers() == [('192.168.20.1:80', 'route', '5'),
+                                           ('192.168.20.2:80', 'route', '5')]
+        instance = manager.get_lvs_instance("tcp_207.175.44.10:80")
+        assert ('192.168.10.1:81', 'masq', '1') not in instance.list_servers()
+
+    def test_transaction_duplicate_stops_batch(self):
+        self._initlvs()
+        manager = self._manager()
+        with pytest.raises(pylvs.LVSTransactionError) as excinfo:
+            with manager.transaction() as txn:
+                instance = txn.get_lvs_instance("tcp_207.175.44.10:80")
+                instance.add_server("192.168.10.6:81", "masq")
+                instance.add_server("192.168.10.1:81", "masq")
+        assert excinfo.value.index == 1
+        assert excinfo.value.applied == 0
+        instance = manager.get_lvs_instance("tcp_207.175.44.10:80")
+        assert len(instance.list_servers()) == 5
+
+    def test_transaction_missing_service(self):
+        self._initlvs()
+        manager = self._manager()
+        txn = manager.transaction()
+        txn.del_lvs_instance("207.175.44.11:80", "tcp")
+        with pytest.raises(pylvs.LVSTransactionError):
+            txn.commit()
+
+    def test_transaction_rollback_on_exception(self):
+        self._initlvs()
+        manager = self._manager()
+        with pytest.raises(RuntimeError):
+            with manager.transaction() as txn:
+                txn.del_lvs_instance("207.175.44.10:80", "tcp")
+                raise RuntimeError("abort")
+        assert len(manager.list_lvs_instances()) == 12
+
+    def test_transaction_invalid_args(self):
+        self._initlvs()
+        manager = self._manager()
+        txn = manager.transaction()
+        with pytest.raises(ValueError):
+            txn.add_lvs_instance("207.175.666.10:80", "tcp")
+        with pytest.raises(ValueError):
+            txn.get_lvs_instance("tcp_207.175.44.10:80").add_server("192.168.10.6:81", "blubber")
+        assert len(txn) == 0
@@ -0,0 +1,270 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+import errno
+import socket
+import struct
+import threading
+
+import pytest
+import pylvs
+from pylvs import netlink
+
+
+class FakeIPVS(threading.Thread):
+    """speaks the IPVS generic netlink protocol on one end of a socketpair
+    """
+
+    family = 0x23
+
+    def __init__(self, sock):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.sock = sock
+        self.services = []
+        self.timeouts = (900, 120, 300)
+        self.datagrams = 0
+
+    def _find(self, attrs):
+        service = netlink.parse_attrs(attrs[netlink.IPVS_CMD_ATTR_SERVICE])
+        for entry in self.services:
+            if all(entry[0].get(key) == service.get(key) for key in
+                   (netlink.IPVS_SVC_ATTR_AF, netlink.IPVS_SVC_ATTR_PROTOCOL,
+                    netlink.IPVS_SVC_ATTR_ADDR, netlink.IPVS_SVC_ATTR_PORT,
+                    netlink.IPVS_SVC_ATTR_FWMARK)):
+                return service, entry
+        return service, None
+
+    def _find_dest(self, entry, attrs):
+        dest = netlink.parse_attrs(attrs[netlink.IPVS_CMD_ATTR_DEST])
+        for candidate in entry[1]:
+            if (candidate[netlink.IPVS_DEST_ATTR_ADDR] == dest[netlink.IPVS_DEST_ATTR_ADDR] and
+                candidate[netlink.IPVS_DEST_ATTR_PORT] == dest[netlink.IPVS_DEST_ATTR_PORT]):
+                return dest, candidate
+        return dest, None
+
+    def handle(self, cmd, attrs):
+        """returns (errno, list of attribute dicts to reply with)
+        """
+        if cmd == netlink.IPVS_CMD_FLUSH:
+            self.services = []
+        elif cmd == netlink.IPVS_CMD_GET_SERVICE:
+            return 0, [{netlink.IPVS_CMD_ATTR_SERVICE: entry[0]} for entry in self.services]
+        elif cmd == netlink.IPVS_CMD_GET_INFO:
+            return 0, [{netlink.IPVS_INFO_ATTR_VERSION: struct.pack("=I", 0x10205),
+                        netlink.IPVS_INFO_ATTR_CONN_TAB_SIZE: struct.pack("=I", 4096)}]
+        elif cmd == netlink.IPVS_CMD_GET_CONFIG:
+            return 0, [dict(zip((netlink.IPVS_CMD_ATTR_TIMEOUT_TCP,
+                                 netlink.IPVS_CMD_ATTR_TIMEOUT_TCP_FIN,
+                                 netlink.IPVS_CMD_ATTR_TIMEOUT_UDP),
+                                [struct.pack("=I", value) for value in self.timeouts]))]
+        elif cmd == netlink.IPVS_CMD_SET_CONFIG:
+            self.timeouts = tuple(struct.unpack("=I", attrs[key])[0] for key in
+                                  (netlink.IPVS_CMD_ATTR_TIMEOUT_TCP,
+                                   netlink.IPVS_CMD_ATTR_TIMEOUT_TCP_FIN,
+                                   netlink.IPVS_CMD_ATTR_TIMEOUT_UDP))
+        elif cmd == netlink.IPVS_CMD_ZERO:
+            pass
+        else:
+            service, entry = self._find(attrs)
+            if cmd == netlink.IPVS_CMD_NEW_SERVICE:
+                if entry:
+                    return errno.EEXIST, []
+                self.services.append([service, []])
+            elif entry is None:
+                return errno.ESRCH, []
+            elif cmd == netlink.IPVS_CMD_SET_SERVICE:
+                entry[0].update(service)
+            elif cmd == netlink.IPVS_CMD_DEL_SERVICE:
+                self.services.remove(entry)
+            elif cmd == netlink.IPVS_CMD_GET_DEST:
+                return 0, [{netlink.IPVS_CMD_ATTR_DEST: dest} for dest in entry[1]]
+            else:
+                dest, existing = self._find_dest(entry, attrs)
+                if cmd == netlink.IPVS_CMD_NEW_DEST:
+                    if existing:
+                        return errno.EEXIST, []
+                    entry[1].append(dest)
+                elif existing is None:
+                    return errno.ENOENT, []
+                elif cmd == netlink.IPVS_CMD_SET_DEST:
+                    existing.update(dest)
+                else:
+                    entry[1].remove(existing)
+        return 0, []
+
+    def _encode(self, attrs):
+        result = []
+        for atype, value in attrs.items():
+            if isinstance(value, dict):
+                result.append(netlink.nested(atype, self._encode(value)))
+            else:
+                result.append(netlink.attr(atype, value))
+        return result
+
+    def run(self):
+        while True:
+            try:
+                data = self.sock.recv(1 << 20)
+            except socket.error:
+                return
+            if not data:
+                return
+            self.datagrams += 1
+            replies = []
+            for msg_type, flags, seq, payload in netlink.parse_messages(data):
+                cmd = struct.unpack_from("=B", payload)[0]
+                attrs = netlink.parse_attrs(payload[4:])
+                header = struct.pack("=IHHII", 16 + len(payload), msg_type, flags, seq, 0)
+                if msg_type == netlink.GENL_ID_CTRL:
+                    replies.append(netlink.build_message(netlink.GENL_ID_CTRL,
+                        netlink.CTRL_CMD_NEWFAMILY,
+                        [netlink.attr(netlink.CTRL_ATTR_FAMILY_ID, struct.pack("=H", self.family))],
+                        0, seq))
+                    continue
+                assert msg_type == self.family
+                error, answers = self.handle(cmd, attrs)
+                if error:
+                    replies.append(struct.pack("=IHHII", 36, netlink.NLMSG_ERROR, 0, seq, 0) +
+                                   struct.pack("=i", -error) + header)
+                    continue
+                dump = (flags & netlink.NLM_F_DUMP) == netlink.NLM_F_DUMP
+                for answer in answers:
+                    replies.append(netlink.build_message(self.family, cmd, self._encode(answer),
+                                                         dump and netlink.NLM_F_MULTI or 0, seq))
+                if dump:
+                    replies.append(struct.pack("=IHHII", 20, netlink.NLMSG_DONE,
+                                               netlink.NLM_F_MULTI, seq, 0) + struct.pack("=i", 0))
+                elif flags & netlink.NLM_F_ACK:
+                    replies.append(struct.pack("=IHHII", 36, netlink.NLMSG_ERROR, 0, seq, 0) +
+                                   struct.pack("=i", 0) + header)
+            self.sock.send(b"".join(replies))
+
+
+class Test_NetlinkBackend:
+
+    def setup_method(self, method):
+        client, server = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.fake = FakeIPVS(server)
+        self.fake.start()
+        self.backend = netlink.NetlinkBackend(sock=client)
+        self.manager = pylvs.LVSManager(backend=self.backend)
+
+    def teardown_method(self, method):
+        self.backend.close()
+
+    def test_resolve_family(self):
+        assert self.backend.family == FakeIPVS.family
+
+    def test_add_lvs_instance(self):
+        assert self.manager.add_lvs_instance("207.175.44.10:80", "tcp") == "tcp_207.175.44.10:80"
+        assert self.manager.add_lvs_instance("[::207.175.44.10]:80", "udp") == "udp_[::207.175.44.10]:80"
+        assert self.manager.list_lvs_instances() == ["tcp_207.175.44.10:80", "udp_[::207.175.44.10]:80"]
+
+    def test_add_lvs_instance_duplicate(self):
+        self.manager.add_lvs_instance("207.175.44.10:80", "tcp")
+        with pytest.raises(ValueError):
+            self.manager.add_lvs_instance("207.175.44.10:80", "tcp")
+
+    def test_del_lvs_instance(self):
+        self.manager.add_lvs_instance("207.175.44.10:80", "tcp")
+        assert self.manager.del_lvs_instance("207.175.44.10:80", "tcp") == True
+        assert self.manager.list_lvs_instances() == []
+        with pytest.raises(ValueError):
+            self.manager.del_lvs_instance("207.175.44.10:80", "tcp")
+
+    def test_servers(self):
+        instance = self.manager.add_lvs_instance("207.175.44.10:80", "tcp")
+        assert instance.add_server("192.168.10.1:81", "masq") == True
+        assert instance.add_server("192.168.10.2:80", "route", weight = 10) == True
+        assert instance.add_server("192.168.10.3:80", "ipip", weight = 5, upper = 10, lower = 5) == True
+        assert instance.list_servers() == [('192.168.10.1:81', 'masq', '1'),
+                                           ('192.168.10.2:80', 'route', '10'),
+                                           ('192.168.10.3:80', 'ipip', '5')]
+        assert instance.edit_server("192.168.10.2:80", "route", weight = 0) == True
+        assert instance.del_server("192.168.10.1:81") == True
+        assert instance.list_servers() == [('192.168.10.2:80', 'route', '0'),
+                                           ('192.168.10.3:80', 'ipip', '5')]
+        with pytest.raises(ValueError):
+            instance.del_server("192.168.10.1:81")
+
+    def test_opts(self):
+        instance = self.manager.add_lvs_instance("207.175.44.10:80", "tcp")
+        assert instance.get_opts() == ('wlc', None, None)
+        instance.set_opts("wrr", persistence = 120, netmask = "255.255.255.0")
+        assert instance.get_opts() == ('wrr', '120', '255.255.255.0')
+        instance = self.manager.add_lvs_instance("[::207.175.44.10]:80", "tcp")
+        instance.set_opts("sh", persistence = 60, netmask = "64")
+        assert instance.get_opts() == ('sh', '60', '64')
+
+    def test_transaction_single_send(self):
+        with self.manager.transaction() as txn:
+            for number in range(20):
+                instance = txn.add_lvs_instance("207.175.44.{0}:80".format(number), "tcp")
+                for server in range(10):
+                    instance.add_server("192.168.{0}.{1}:80".format(number, server), "route")
+        datagrams = self.fake.datagrams
+        assert len(self.manager.list_lvs_instances()) == 20
+        instance = self.manager.get_lvs_instance("tcp_207.175.44.7:80")
+        assert len(instance.list_servers()) == 10
+        # family lookup, one dump for the preflight check, one send for 220 commands
+        assert datagrams == 3
+
+    def test_restore_reports_failed_index(self):
+        failed = self.backend.restore([["-A", "-t", "207.175.44.10:80"],
+                                       ["-A", "-t", "207.175.44.10:80"],
+                                       ["-a", "-t", "207.175.44.10:80", "-r", "192.168.10.1:80"]])
+        assert failed == [(1, "Service already exists")]
+
+    def test_batch_size(self):
+        self.backend.batch_size = 256
+        commands = [["-A", "-t", "207.175.44.{0}:80".format(number)] for number in range(30)]
+        assert self.backend.restore(commands) == []
+        assert self.fake.datagrams > 2
+        assert len(self.backend.get_services()) == 30
+
+    def test_info_and_timeouts(self):
+        assert self.backend.get_info() == {"version": "1.2.5", "conn_tab_size": 4096}
+        assert self.backend.get_timeouts() == (900, 120, 300)
+        assert self.manager.set_timeouts(10, 20, 30) == True
+        assert self.backend.get_timeouts() == (10, 20, 30)
+
+    def test_clear_and_zero(self):
+        self.manager.add_lvs_instance("207.175.44.10:80", "tcp")
+        assert self.manager.zero() == True
+        assert self.manager.clear_ipvs() == True
+        assert self.manager.list_lvs_instances() == []
+
+    def test_get_stats(self):
+        instance = self.manager.add_lvs_instance("207.175.44.10:80", "tcp")
+        instance.add_server("192.168.10.1:80", "route")
+        counters = dict((atype, struct.pack("=Q", atype * 10)) for atype in range(1, 11))
+        self.fake.services[0][0][netlink.IPVS_SVC_ATTR_STATS64] = counters
+        self.fake.services[0][1][0][netlink.IPVS_DEST_ATTR_STATS64] = counters
+        self.fake.services[0][1][0][netlink.IPVS_DEST_ATTR_ACTIVE_CONNS] = struct.pack("=I", 7)
+        self.fake.services[0][1][0][netlink.IPVS_DEST_ATTR_INACT_CONNS] = struct.pack("=I", 2)
+        expected = pylvs.LVSStats(10, 20, 30, 40, 50, 60, 70, 80, 90, 100, 7, 2)
+        assert self.manager.get_stats() == {"tcp_207.175.44.10:80": (
+            expected, {"192.168.10.1:80": expected})}
+        assert instance.get_stats() == (expected, {"192.168.10.1:80": expected})
+        with pytest.raises(ValueError):
+            pylvs.LVSInstance("207.175.44.11:80", "tcp", self.manager).get_stats()
+
+    def test_parse_command_unsupported(self):
+        with pytest.raises(NotImplementedError):
+            netlink.parse_command(["-A", "-t", "207.175.44.10:80", "--pe", "sip"])
+
+    def test_parse_command_like_ipvsadm(self):
+        cmd, attrs = netlink.parse_command(["-a", "-t", "207.175.44.10:80",
+                                            "-r", "192.168.10.1:8080", "-g"])
+        dest = netlink.decode_dest(netlink.parse_attrs(b"".join(attrs))[
+            netlink.IPVS_CMD_ATTR_DEST], socket.AF_INET)
+        assert dest["port"] == 80
+        cmd, attrs = netlink.parse_command(["-A", "-f", "7", "-6", "-s", "rr"])
+        service = netlink.decode_service(netlink.parse_attrs(attrs[0])[netlink.IPVS_CMD_ATTR_SERVICE])
+        assert (service["fwmark"], service["af"]) == (7, socket.AF_INET6)
+        with pytest.raises(ValueError):
+            netlink.parse_command(["-a", "-t", "207.175.44.10:80", "-r",
+                                   "192.168.10.1:80", "-w", "70000"])
@@ -0,0 +1,99 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+import pytest
+import pylvs
+from pylvs.cluster import LVSClusterError
+from pylvs.netns import NetnsManager, list_namespaces
+
+# a toy ipvsadm keeping the table of every namespace in a file of its own
+IPVSADM = """\
+dir=$1; netns=$2; shift 2
+if [ "$netns" = broken ]; then
+    echo "Can't initialize ipvs: Protocol not available" >&2
+    exit 2
+fi
+case "$1" in
+    -Sn) cat "$dir/$netns" 2>/dev/null || true ;;
+    -R) cat >> "$dir/$netns" ;;
+esac
+"""
+
+
+@pytest.fixture
+def command(tmp_path):
+    script = tmp_path / "ipvsadm"
+    script.write_text(IPVSADM)
+    tables = tmp_path / "tables"
+    tables.mkdir()
+    return lambda netns: ["sh", str(script), str(tables), netns]
+
+
+class Test_netns_command:
+
+    def test_named(self):
+        assert pylvs.netns_command("web1") == [
+            "ip", "netns", "exec", "web1", "ipvsadm"]
+
+    def test_path(self):
+        assert pylvs.netns_command("/proc/1234/ns/net") == [
+            "nsenter", "--net=/proc/1234/ns/net", "ipvsadm"]
+
+    def test_manager(self):
+        manager = pylvs.LVSManager(netns="web1")
+        assert manager.netns == "web1"
+        assert manager.backend.command == pylvs.netns_command("web1")
+        assert manager.backend.procfs is False
+        assert pylvs.LVSManager().netns is None
+        with pytest.raises(ValueError):
+            pylvs.LVSManager(backend=pylvs.IpvsadmBackend(), netns="web1")
+
+
+class Test_list_namespaces:
+
+    def test_list(self, tmp_path):
+        for name in ("web2", "cni-1", "web1"):
+            (tmp_path / name).write_text("")
+        assert list_namespaces(str(tmp_path)) == ["cni-1", "web1", "web2"]
+        assert NetnsManager(netns_root=str(tmp_path)).managers[
+            "web1"].backend.command == pylvs.netns_command("web1")
+
+    def test_missing(self, tmp_path):
+        assert list_namespaces(str(tmp_path / "netns")) == []
+
+
+class Test_NetnsManager:
+
+    def test_batch(self, command):
+        namespaces = NetnsManager(["web1", "web2", "web3"], command, workers=2)
+        results = namespaces.batch(
+            lambda txn: txn.add_lvs_instance("10.0.0.1:80", "tcp"),
+            ["web1", "web3"])
+        assert sorted(results) == ["web1", "web3"]
+        assert namespaces.list_lvs_instances() == {
+            "web1": ["tcp_10.0.0.1:80"], "web2": [],
+            "web3": ["tcp_10.0.0.1:80"]}
+
+    def test_apply(self, command):
+        namespaces = NetnsManager(["web1", "web2"], command)
+        namespaces.apply({"tcp_10.0.0.2:80": {"servers": [
+            ("192.168.10.1:80", "route")]}})
+        for netns in ("web1", "web2"):
+            manager = namespaces.managers[netns]
+            assert manager.netns == netns
+            servers = manager.get_lvs_instance("tcp_10.0.0.2:80").get_servers()
+            assert [str(server.address) for server in servers] == [
+                "192.168.10.1:80"]
+
+    def test_failed_namespace(self, command):
+        namespaces = NetnsManager(["web1", "broken"], command)
+        with pytest.raises(LVSClusterError) as error:
+            namespaces.list_lvs_instances()
+        assert error.value.results["web1"].result == []
+        assert "Protocol not available" in str(
+            error.value.results["broken"].error)
+        namespaces.policy = "quorum"
+        namespaces.quorum = 1
+        assert namespaces.list_lvs_instances() == {"web1": []}
@@ -0,0 +1,202 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+import pytest
+import pylvs
+from pylvs import procfs
+
+HEADER = ("Pro FromIP   FPrt ToIP     TPrt DestIP   DPrt State       "
+          "Expires PEName PEData\n")
+HEADER_SYNC = ("Pro FromIP   FPrt ToIP     TPrt DestIP   DPrt State       "
+               "Origin Expires\n")
+
+CONNS = [
+    ("TCP", "10.0.0.1:40000", "207.175.44.10:80", "192.168.10.1:81", "ESTABLISHED"),
+    ("TCP", "10.0.0.2:40001", "207.175.44.10:80", "192.168.10.1:81", "ESTABLISHED"),
+    ("TCP", "10.0.0.3:40002", "207.175.44.10:80", "192.168.10.2:81", "FIN_WAIT"),
+    ("TCP", "10.0.0.4:40003", "207.175.44.10:80", "192.168.10.2:81", "TIME_WAIT"),
+    ("UDP", "10.0.0.5:53000", "207.175.44.10:80", "192.168.10.1:80", "UDP"),
+    ("TCP", "10.0.0.6:40004", "207.175.44.30:80", "192.168.10.1:81", "ESTABLISHED"),
+    ("TCP", "[2001:db8::1]:40005", "[::207.175.44.10]:80", "[::192.168.10.1]:80", "ESTABLISHED"),
+    ("SCTP", "10.0.0.7:40006", "207.175.44.40:80", "192.168.10.1:80", "COOKIE_ECHOED"),
+]
+
+IP_VS = """IP Virtual Server version 1.2.1 (size=4096)
+Prot LocalAddress:Port Scheduler Flags
+  -> RemoteAddress:Port Forward Weight ActiveConn InActConn
+TCP  CFAF2C0A:0050 rr 
+  -> C0A80A01:0051      Masq    1      0          0         
+  -> C0A80A02:0051      Masq    1      0          0         
+UDP  CFAF2C0A:0050 rr 
+  -> C0A80A01:0050      Route   10     0          0         
+TCP  CFAF2C1E:0050 wlc persistent 30000 FFFFFFE0
+  -> C0A80A01:0051      Masq    1      0          0         
+FWM  00000001 rr 
+  -> C0A80A01:0050      Route   1      0          0         
+TCP  [0000:0000:0000:0000:0000:0000:cfaf:2c0a]:0050 rr 
+  -> [0000:0000:0000:0000:0000:0000:c0a8:0a01]:0050      Tunnel  1      0          0         
+"""
+
+DUMP = """-A -t 207.175.44.30:80 -s wlc -p 120 -M 255.255.255.224
+-a -t 207.175.44.30:80 -r 192.168.10.1:81 -m -w 1
+"""
+
+
+class ProcBackend(pylvs.IpvsadmBackend):
+    """backend for the table in IP_VS, counting dumps
+    """
+
+    def __init__(self):
+        self.dumps = 0
+
+    def output(self, args):
+        self.dumps += 1
+        return DUMP
+
+    def stream(self, args):
+        return iter(self.output(args).splitlines())
+
+
+def _line(proto, client, service, dest, state, sync=False):
+    """render a connection the way the kernel does
+    """
+    addrs = " ".join(procfs._encode_addr(addr) for addr in (client, service, dest))
+    if sync:
+        return "{0:<3} {1} {2:<11} {3:<6} {4:>7}\n".format(proto, addrs, state,
+                                                        "Local", 899)
+    return "{0:<3} {1} {2:<11} {3:>7}\n".format(proto, addrs, state, 899)
+
+
+@pytest.fixture
+def proc_root(tmp_path):
+    net = tmp_path / "net"
+    net.mkdir()
+    (net / "ip_vs_conn").write_text(
+        HEADER + "".join(_line(*conn) for conn in CONNS))
+    (net / "ip_vs").write_text(IP_VS)
+    (net / "ip_vs_conn_sync").write_text(
+        HEADER_SYNC + "".join(_line(*conn, sync=True) for conn in CONNS))
+    return str(tmp_path)
+
+
+class Test_procfs:
+
+    def test_line_format(self):
+        assert _line(*CONNS[0]) == ("TCP 0A000001 9C40 CFAF2C0A 0050 C0A80A01 "
+                                    "0051 ESTABLISHED     899\n")
+
+    def test_iter_connections(self, proc_root):
+        conns = list(procfs.iter_connections(proc_root))
+        assert [(conn.proto, conn.client, conn.service_addr, conn.real_server,
+                 conn.state) for conn in conns] == CONNS
+        assert conns[0].expires == 899
+        assert conns[0].origin is None
+
+    def test_iter_connections_sync(self, proc_root):
+        conns = list(procfs.iter_connections(proc_root, sync=True))
+        assert [conn.state for conn in conns] == [conn[4] for conn in CONNS]
+        assert set(conn.origin for conn in conns) == set(["Local"])
+        assert conns[-1].expires == 899
+
+    def test_aggregate_all(self, proc_root):
+        servers, states = procfs.aggregate_connections(proc_root=proc_root)
+        assert servers["192.168.10.1:81"] == {"ESTABLISHED": 3}
+        assert servers["192.168.10.1:80"] == {"UDP": 1, "COOKIE_ECHOED": 1}
+        assert states["ESTABLISHED"] == 4
+        assert sum(states.values()) == len(CONNS)
+
+    def test_aggregate_service(self, proc_root):
+        servers, states = procfs.aggregate_connections("tcp", "207.175.44.10:80",
+                                                       proc_root=proc_root)
+        assert servers == {"192.168.10.1:81": {"ESTABLISHED": 2},
+                           "192.168.10.2:81": {"FIN_WAIT": 1, "TIME_WAIT": 1}}
+        assert states == {"ESTABLISHED": 2, "FIN_WAIT": 1, "TIME_WAIT": 1}
+
+    def test_aggregate_ipv6(self, proc_root):
+        servers, states = procfs.aggregate_connections("tcp", "[::207.175.44.10]:80",
+                                                       proc_root=proc_root, sync=True)
+        assert servers == {"[::192.168.10.1]:80": {"ESTABLISHED": 1}}
+
+    def test_instance(self, proc_root):
+        manager = pylvs.LVSManager(proc_root=proc_root)
+        instance = pylvs.LVSInstance("207.175.44.10:80", "udp", manager)
+        assert instance.get_conn_distribution() == (
+            {"192.168.10.1:80": {"UDP": 1}}, {"UDP": 1})
+
+    def test_missing_file(self, tmp_path):
+        manager = pylvs.LVSManager(proc_root=str(tmp_path))
+        instance = pylvs.LVSInstance("207.175.44.10:80", "tcp", manager)
+        with pytest.raises(ValueError):
+            instance.get_conn_distribution()
+
+    def test_dump_services(self, proc_root):
+        assert procfs.dump_services(proc_root) == (
+            "-A -t 207.175.44.10:80 -s rr\n"
+            "-a -t 207.175.44.10:80 -r 192.168.10.1:81 -m -w 1\n"
+            "-a -t 207.175.44.10:80 -r 192.168.10.2:81 -m -w 1\n"
+            "-A -u 207.175.44.10:80 -s rr\n"
+            "-a -u 207.175.44.10:80 -r 192.168.10.1:80 -g -w 10\n"
+            "-A -t 207.175.44.30:80 -s wlc -p 30000 -M 255.255.255.224\n"
+            "-a -t 207.175.44.30:80 -r 192.168.10.1:81 -m -w 1\n"
+            "-A -f 1 -s rr\n"
+            "-a -f 1 -r 192.168.10.1:80 -g -w 1\n"
+            "-A -t [::207.175.44.10]:80 -s rr\n"
+            "-a -t [::207.175.44.10]:80 -r [::192.168.10.1]:80 -i -w 1\n")
+
+    def test_dump_local(self, tmp_path):
+        # ipvsadm shows services of this host as gatewaying
+        net = tmp_path / "net"
+        net.mkdir()
+        (net / "ip_vs").write_text(IP_VS.split("TCP  ")[0] +
+            "TCP  CFAF2C0A:0050 rr \n"
+            "  -> 7F000001:0050      Local   1      0          0         \n")
+        dump = procfs.dump_services(str(tmp_path))
+        assert dump == ("-A -t 207.175.44.10:80 -s rr\n"
+                        "-a -t 207.175.44.10:80 -r 127.0.0.1:80 -g -w 1\n")
+        assert pylvs.LVSSnapshot(dump, partial=True).list_servers(
+            "tcp", "207.175.44.10:80") == [("127.0.0.1:80", "route", "1")]
+
+
+class Test_LVSManager_procfs:
+
+    def test_list_without_dump(self, proc_root):
+        backend = ProcBackend()
+        manager = pylvs.LVSManager(backend=backend, proc_root=proc_root)
+        assert [str(instance) for instance in manager.list_lvs_instances()] == [
+            "tcp_207.175.44.10:80", "udp_207.175.44.10:80",
+            "tcp_207.175.44.30:80", "fwm_1", "tcp_[::207.175.44.10]:80"]
+        instance = manager.get_lvs_instance("udp_207.175.44.10:80")
+        assert instance.list_servers() == [("192.168.10.1:80", "route", "10")]
+        assert instance.get_opts() == ("rr", None, None)
+        assert backend.dumps == 0
+
+    def test_persistence_needs_dump(self, proc_root):
+        backend = ProcBackend()
+        manager = pylvs.LVSManager(backend=backend, proc_root=proc_root)
+        instance = manager.get_lvs_instance("tcp_207.175.44.30:80")
+        assert instance.get_opts() == ("wlc", "120", "255.255.255.224")
+        assert backend.dumps == 1
+
+    def test_full_snapshot_needs_dump(self, proc_root):
+        backend = ProcBackend()
+        manager = pylvs.LVSManager(backend=backend, ttl=60, proc_root=proc_root)
+        manager.list_lvs_instances()
+        assert manager.snapshot().list_services() == [("tcp", "207.175.44.30:80")]
+        assert backend.dumps == 1
+
+    def test_missing_ip_vs(self, tmp_path):
+        backend = ProcBackend()
+        manager = pylvs.LVSManager(backend=backend, proc_root=str(tmp_path))
+        assert len(manager.list_lvs_instances()) == 1
+        assert backend.dumps == 1
+
+    def test_fwmark_family_unknown(self, proc_root, tmp_path):
+        (tmp_path / "net" / "ip_vs").write_text(IP_VS + "FWM  00000002 rr \n")
+        with pytest.raises(ValueError):
+            procfs.dump_services(proc_root)
+        backend = ProcBackend()
+        manager = pylvs.LVSManager(backend=backend, proc_root=proc_root)
+        manager.list_lvs_instances()
+        assert backend.dumps == 1
@@ -0,0 +1,122 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+import pytest
+import pylvs
+from pylvs import procfs
+from pylvs.simulator import SimulatedBackend
+
+DUMP = """-A -t 207.175.44.10:80 -s sh -b sh-fallback,sh-port
+-a -t 207.175.44.10:80 -r 192.168.10.1:80 -g -w 1
+"""
+
+MODULES = """ip_vs_sh 12288 2 - Live 0x0000000000000000
+ip_vs 200704 4 ip_vs_sh, Live 0x0000000000000000
+nf_conntrack 196608 1 ip_vs, Live 0x0000000000000000
+"""
+
+MODULES_DEP = """kernel/net/netfilter/ipvs/ip_vs.ko.zst: kernel/net/netfilter/nf_conntrack.ko.zst
+kernel/net/netfilter/ipvs/ip_vs_mh.ko.zst: kernel/net/netfilter/ipvs/ip_vs.ko.zst
+kernel/net/netfilter/ipvs/ip_vs_ftp.ko.zst: kernel/net/netfilter/ipvs/ip_vs.ko.zst
+kernel/net/netfilter/ipvs/ip_vs_pe_sip.ko.zst: kernel/net/netfilter/ipvs/ip_vs.ko.zst
+kernel/net/netfilter/ipvs/ip_vs_twos.ko.zst: kernel/net/netfilter/ipvs/ip_vs.ko.zst
+"""
+
+
+class Test_schedulers:
+
+    def setup_method(self, method):
+        self.backend = SimulatedBackend(DUMP)
+        self.manager = pylvs.LVSManager(backend=self.backend)
+        self.instance = self.manager.get_lvs_instance("tcp_207.175.44.10:80")
+
+    def test_get_opts(self):
+        assert self.instance.get_opts() == ("sh", None, None)
+        assert self.instance.get_opts(flags=True) == (
+            "sh", None, None, ("sh-fallback", "sh-port"))
+        assert self.instance.get_service().flags == ("sh-fallback", "sh-port")
+        assert "TCP  207.175.44.10:80 sh (sh-fallback,sh-port)" in \
+            self.backend.output(["-Ln"])
+
+    def test_set_opts(self):
+        self.instance.set_opts("mh", persistence=60, flags="mh-port,mh-fallback")
+        assert self.instance.get_opts(flags=True) == (
+            "mh", "60", None, ("mh-fallback", "mh-port"))
+        assert "-s mh -b mh-fallback,mh-port -p 60" in self.backend.output(["-Sn"])
+        self.instance.set_opts("mh")
+        assert self.instance.get_opts(flags=True) == ("mh", None, None, ())
+
+    def test_add_lvs_instance(self):
+        for index, scheduler in enumerate(("fo", "ovf", "mh")):
+            instance = self.manager.add_lvs_instance(
+                "207.175.44.{0}:80".format(20 + index), "tcp", scheduler)
+            assert instance.get_opts() == (scheduler, None, None)
+        instance = self.manager.add_lvs_instance("207.175.44.30:80", "tcp",
+                                                 "sh", flags=["sh-port"])
+        assert instance.get_opts(flags=True)[3] == ("sh-port",)
+        with pytest.raises(ValueError):
+            self.manager.add_lvs_instance("207.175.44.31:80", "tcp",
+                                          flags=["sh-port"])
+
+    def test_invalid_flags(self):
+        with pytest.raises(ValueError) as error:
+            self.instance.set_opts("rr", flags=["sh-port"])
+        assert str(error.value) == ("incompatible scheduler flag sh-port for "
+                                    "scheduler rr")
+        with pytest.raises(ValueError):
+            self.instance.set_opts("mh", flags=["mh-sticky"])
+        violations = pylvs.validate_state({
+            "tcp_207.175.44.10:80": {"scheduler": "mh", "flags": ["sh-port"]}})[1]
+        assert [violation.message for violation in violations] == [
+            "incompatible scheduler flag sh-port for scheduler mh"]
+
+    def test_apply(self):
+        state = {"tcp_207.175.44.10:80": {
+            "scheduler": "sh", "flags": ["sh-port", "sh-fallback"],
+            "servers": [("192.168.10.1:80", "route", 1)]}}
+        assert self.manager.apply(state, dry_run=True) == []
+        state["tcp_207.175.44.10:80"]["flags"] = ["sh-port"]
+        assert self.manager.apply(state) == [
+            "-E -t 207.175.44.10:80 -s sh -b sh-port"]
+        assert self.instance.get_opts(flags=True)[3] == ("sh-port",)
+
+    def test_unsupported_scheduler(self):
+        backend = SimulatedBackend(schedulers=("rr", "wrr"))
+        manager = pylvs.LVSManager(backend=backend)
+        assert manager.get_schedulers() == ("rr", "wrr")
+        with pytest.raises(ValueError):
+            manager.add_lvs_instance("207.175.44.10:80", "tcp", "mh")
+
+
+class Test_probe_schedulers:
+
+    def make_tree(self, tmp_path):
+        proc = tmp_path / "proc"
+        (proc / "sys" / "kernel").mkdir(parents=True)
+        (proc / "sys" / "kernel" / "osrelease").write_text("6.1.0-test\n")
+        (proc / "modules").write_text(MODULES)
+        release = tmp_path / "modules" / "6.1.0-test"
+        release.mkdir(parents=True)
+        (release / "modules.dep").write_text(MODULES_DEP)
+        (release / "modules.builtin").write_text(
+            "kernel/net/netfilter/ipvs/ip_vs_rr.ko\n")
+        return str(proc), str(tmp_path / "modules")
+
+    def test_probe(self, tmp_path):
+        proc_root, modules_root = self.make_tree(tmp_path)
+        assert procfs.probe_schedulers(proc_root, modules_root) == frozenset(
+            ("sh", "mh", "twos", "rr"))
+
+    def test_get_schedulers(self, tmp_path, monkeypatch):
+        proc_root, modules_root = self.make_tree(tmp_path)
+        monkeypatch.setattr(procfs, "MODULES_ROOT", modules_root)
+        manager = pylvs.LVSManager(proc_root=proc_root)
+        assert manager.get_schedulers() == ("rr", "sh", "mh")
+
+    def test_nothing_to_probe(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(procfs, "MODULES_ROOT", str(tmp_path))
+        manager = pylvs.LVSManager(proc_root=str(tmp_path))
+        with pytest.raises(ValueError):
+            manager.get_schedulers()
@@ -0,0 +1,150 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+import os
+
+import pytest
+import pylvs
+from pylvs.simulator import SimulatedBackend
+
+
+def _fixture():
+    """the table set up by ipvsadm.sh, as ipvsadm arguments
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ipvsadm.sh")
+    with open(path) as script:
+        return "".join(line.replace("ipvsadm ", "", 1) for line in script
+                       if line.startswith("ipvsadm -") and "-C" not in line)
+
+
+class Test_SimulatedBackend:
+
+    def setup_method(self, method):
+        self.backend = SimulatedBackend(_fixture())
+        self.manager = pylvs.LVSManager(backend=self.backend)
+
+    def test_load(self):
+        assert len(self.manager.list_lvs_instances()) == 12
+        instance = self.manager.get_lvs_instance("tcp_207.175.44.30:80")
+        assert instance.get_opts() == ("wlc", "120", "255.255.255.224")
+        assert len(instance.list_servers()) == 5
+        instance = self.manager.get_lvs_instance("udp_[::207.175.44.30]:80")
+        assert instance.get_opts() == ("wlc", "120", "64")
+
+    def test_kernel_errors(self):
+        execute = self.backend.execute
+        with pytest.raises(ValueError, match="Service already exists"):
+            execute(["-A", "-t", "207.175.44.10:80", "-s", "rr"])
+        with pytest.raises(ValueError, match="Scheduler not found"):
+            execute(["-A", "-t", "207.175.44.11:80", "-s", "xyz"])
+        with pytest.raises(ValueError, match="No such service"):
+            execute(["-D", "-t", "207.175.44.11:80"])
+        with pytest.raises(ValueError, match="Destination already exists"):
+            execute(["-a", "-t", "207.175.44.10:80", "-r", "192.168.10.1:81", "-m"])
+        with pytest.raises(ValueError, match="No such destination"):
+            execute(["-d", "-t", "207.175.44.10:80", "-r", "192.168.10.9:81"])
+        with pytest.raises(ValueError, match="Service not defined"):
+            execute(["-a", "-t", "207.175.44.11:80", "-r", "192.168.10.1:81", "-m"])
+        with pytest.raises(ValueError):
+            execute(["-a", "-t", "207.175.44.10:80", "-r", "192.168.10.9:81", "-m",
+                     "-x", "10", "-y", "20"])
+        with pytest.raises(ValueError):
+            execute(["-a", "-t", "207.175.44.10:80", "-r", "[::1]:81", "-m"])
+        with pytest.raises(ValueError):
+            execute(["--start-daemon", "master"])
+
+    def test_manager_errors(self):
+        with pytest.raises(ValueError):
+            self.manager.add_lvs_instance("207.175.44.10:80", "tcp")
+        instance = self.manager.get_lvs_instance("tcp_207.175.44.10:80")
+        with pytest.raises(ValueError):
+            instance.add_server("192.168.10.1:81", "masq")
+        with pytest.raises(ValueError):
+            instance.edit_server("192.168.10.9:81", "masq")
+        assert instance.del_server("192.168.10.1:81")
+        assert len(instance.list_servers()) == 4
+
+    def test_forwarding_and_ports(self):
+        self.manager.add_lvs_instance("207.175.44.40:80", "tcp", "wrr",
+                                      persistence=60)
+        self.backend.execute(["-a", "-t", "207.175.44.40:80", "-r", "192.168.10.1:8080"])
+        instance = self.manager.get_lvs_instance("tcp_207.175.44.40:80")
+        instance.add_server("192.168.10.2:8080", "masq", weight=3, upper=100, lower=10)
+        # ipvsadm uses the service port for direct routing
+        assert instance.list_servers() == [("192.168.10.1:80", "route", "1"),
+                                           ("192.168.10.2:8080", "masq", "3")]
+        assert self.manager.snapshot().get_thresholds(
+            "tcp", "207.175.44.40:80", "192.168.10.2:8080") == (100, 10)
+
+        # -e without -w resets the weight like ipvsadm does
+        instance.edit_server("192.168.10.2:8080", "masq")
+        assert instance.list_servers()[1] == ("192.168.10.2:8080", "masq", "1")
+        # -E without persistence drops it
+        instance.set_opts("rr")
+        assert instance.get_opts() == ("rr", None, None)
+
+    def test_fwmark(self):
+        self.backend.execute(["-A", "-f", "1", "-s", "rr", "-p"])
+        self.backend.execute(["-a", "-f", "1", "-r", "192.168.10.1:8080", "-g", "-w", "2"])
+        self.backend.execute(["-A", "-f", "1", "-6", "-s", "sh"])
+        with pytest.raises(ValueError):
+            self.backend.execute(["-A", "-f", "1", "-s", "rr"])
+        dump = self.backend.output(["-Sn"]).splitlines()
+        assert dump[-3:] == ["-A -f 1 -s rr -p 300",
+                             "-a -f 1 -r 192.168.10.1:8080 -g -w 2",
+                             "-A -f 1 -6 -s sh"]
+        assert [str(i) for i in self.manager.list_lvs_instances()][-2:] == [
+            "fwm_1", "fwm6_1"]
+        instance = self.manager.get_lvs_instance("fwm6_1")
+        instance.add_server("[::192.168.10.1]:80", "route")
+        assert instance.list_servers() == [("[::192.168.10.1]:80", "route", "1")]
+        assert self.manager.get_lvs_instance("fwm_1").get_opts() == ("rr", "300", None)
+
+    def test_restore(self):
+        failed = self.backend.restore([
+            ["-a", "-t", "207.175.44.10:80", "-r", "192.168.10.6:81", "-m"],
+            ["-a", "-t", "207.175.44.10:80", "-r", "192.168.10.6:81", "-m"],
+            ["-D", "-t", "207.175.44.11:80"],
+            ["-d", "-t", "207.175.44.10:80", "-r", "192.168.10.1:81"]])
+        assert failed == [(1, "Destination already exists"),
+                          (2, "No such service")]
+        servers = [server for server, method, weight in self.manager.get_lvs_instance(
+                   "tcp_207.175.44.10:80").list_servers()]
+        assert "192.168.10.6:81" in servers
+        assert "192.168.10.1:81" not in servers
+
+    def test_transaction(self):
+        with self.manager.transaction() as txn:
+            instance = txn.add_lvs_instance("207.175.44.40:80", "tcp", "rr")
+            instance.add_server("192.168.10.1:80", "route", weight=10)
+        assert self.manager.get_lvs_instance("tcp_207.175.44.40:80").list_servers() == [
+            ("192.168.10.1:80", "route", "10")]
+
+    def test_copy_and_apply(self):
+        planned = self.backend.copy()
+        manager = pylvs.LVSManager(backend=planned)
+        state = {"tcp_207.175.44.10:80": {"scheduler": "wrr",
+                                          "servers": [("192.168.10.1:81", "masq", 5)]}}
+        plan = manager.apply(state)
+        assert "-E -t 207.175.44.10:80 -s wrr" in plan
+        assert [str(i) for i in manager.list_lvs_instances()] == ["tcp_207.175.44.10:80"]
+        assert manager.apply(state) == []
+        # the original table is untouched
+        assert len(self.manager.list_lvs_instances()) == 12
+
+    def test_stats_and_timeouts(self):
+        instance = self.manager.get_lvs_instance("udp_207.175.44.10:80")
+        stats, servers = instance.get_stats()
+        assert stats.conns == 0
+        assert len(servers) == 5
+        self.manager.set_timeouts(600, 0, 60)
+        assert self.backend.get_timeouts() == (600, 120, 60)
+        assert self.manager.clear_ipvs()
+        assert self.manager.list_lvs_instances() == []
+
+    def test_load_error(self):
+        with pytest.raises(ValueError, match="line 2"):
+            SimulatedBackend("-A -t 207.175.44.10:80 -s rr\n"
+                             "-A -t 207.175.44.10:80 -s rr\n")
@@ -0,0 +1,205 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+import pytest
+import pylvs
+
+DUMP = """-A -t 207.175.44.10:80 -s rr
+-a -t 207.175.44.10:80 -r 192.168.10.1:81 -m -w 1
+-a -t 207.175.44.10:80 -r 192.168.10.2:81 -m -w 1
+-A -u 207.175.44.10:80 -s rr
+-a -u 207.175.44.10:80 -r 192.168.10.1:80 -g -w 10
+-A -t 207.175.44.30:80 -s wlc -p 120 -M 255.255.255.224
+-a -t 207.175.44.30:80 -r 192.168.10.1:81 -m -w 1
+-A -t [::207.175.44.10]:80 -s rr
+-a -t [::207.175.44.10]:80 -r [::192.168.10.1]:80 -g -w 1
+"""
+
+
+class DumpBackend(object):
+    """backend returning a fixed dump and counting calls
+    """
+
+    def __init__(self, dump):
+        self.dump = dump
+        self.dumps = 0
+        self.executed = []
+
+    def execute(self, args):
+        self.executed.append(args)
+        return True
+
+    def output(self, args):
+        assert args == ["-Sn"]
+        self.dumps += 1
+        return self.dump
+
+    def restore(self, commands):
+        self.executed.extend(commands)
+        return []
+
+
+class Test_LVSSnapshot:
+
+    def setup_method(self, method):
+        self.snapshot = pylvs.LVSSnapshot(DUMP)
+
+    def test_list_services(self):
+        assert self.snapshot.list_services() == [("tcp", "207.175.44.10:80"),
+                                                 ("udp", "207.175.44.10:80"),
+                                                 ("tcp", "207.175.44.30:80"),
+                                                 ("tcp", "[::207.175.44.10]:80")]
+
+    def test_has_service(self):
+        assert self.snapshot.has_service("tcp", "207.175.44.10:80")
+        assert self.snapshot.has_service("tcp", "[0::207.175.44.10]:80")
+        assert not self.snapshot.has_service("udp", "207.175.44.30:80")
+
+    def test_get_opts(self):
+        assert self.snapshot.get_opts("tcp", "207.175.44.10:80") == ("rr", None, None)
+        assert self.snapshot.get_opts("tcp", "207.175.44.30:80") == ("wlc", "120", "255.255.255.224")
+        assert self.snapshot.get_opts("tcp", "207.175.44.40:80") is None
+
+    def test_list_servers(self):
+        assert self.snapshot.list_servers("tcp", "207.175.44.10:80") == [
+            ("192.168.10.1:81", "masq", "1"), ("192.168.10.2:81", "masq", "1")]
+        assert self.snapshot.list_servers("udp", "207.175.44.10:80") == [
+            ("192.168.10.1:80", "route", "10")]
+        assert self.snapshot.list_servers("udp", "207.175.44.40:80") == []
+
+    def test_get_server(self):
+        assert self.snapshot.get_server("tcp", "[::207.175.44.10]:80", "[::192.168.10.1]:80") == (
+            "[::192.168.10.1]:80", "route", "1")
+        assert self.snapshot.get_server("tcp", "207.175.44.10:80", "192.168.10.3:81") is None
+
+
+class Test_LVSManager_snapshot:
+
+    def test_ttl_reuses_snapshot(self):
+        backend = DumpBackend(DUMP)
+        manager = pylvs.LVSManager(backend=backend, ttl=60)
+        for instance in manager.list_lvs_instances():
+            instance.get_opts()
+            instance.list_servers()
+        manager.get_lvs_instance("tcp_207.175.44.30:80")
+        assert backend.dumps == 1
+
+    def test_no_ttl_dumps_every_time(self):
+        backend = DumpBackend(DUMP)
+        manager = pylvs.LVSManager(backend=backend)
+        instance = manager.get_lvs_instance("tcp_207.175.44.30:80")
+        instance.list_servers()
+        assert backend.dumps == 2
+
+    def test_write_invalidates(self):
+        backend = DumpBackend(DUMP)
+        manager = pylvs.LVSManager(backend=backend, ttl=60)
+        instance = manager.get_lvs_instance("tcp_207.175.44.10:80")
+        instance.add_server("192.168.10.3:81", "masq")
+        instance.list_servers()
+        assert backend.dumps == 2
+
+    def test_explicit_invalidate(self):
+        backend = DumpBackend(DUMP)
+        manager = pylvs.LVSManager(backend=backend, ttl=60)
+        manager.list_lvs_instances()
+        manager.invalidate()
+        manager.list_lvs_instances()
+        assert backend.dumps == 2
+
+    def test_transaction_invalidates_parent(self):
+        backend = DumpBackend(DUMP)
+        manager = pylvs.LVSManager(backend=backend, ttl=60)
+        manager.list_lvs_instances()
+        with manager.transaction() as txn:
+            txn.get_lvs_instance("tcp_207.175.44.10:80").del_server("192.168.10.1:81")
+        manager.list_lvs_instances()
+        # one cached read, one for the transaction check, one after the commit
+        assert backend.dumps == 3
+
+    def test_get_lvs_instance_missing(self):
+        manager = pylvs.LVSManager(backend=DumpBackend(DUMP))
+        with pytest.raises(ValueError):
+            manager.get_lvs_instance("udp_207.175.44.30:80")
+
+
+class Test_model:
+
+    def setup_method(self, method):
+        self.snapshot = pylvs.LVSSnapshot(DUMP + 
+            "-a -t 207.175.44.30:80 -r 192.168.10.2:81 -m -w 2 -x 100 -y 50\n")
+
+    def test_address(self):
+        address = pylvs.Address.parse("[0::207.175.44.10]:80")
+        assert str(address) == "[::207.175.44.10]:80"
+        assert address.port == 80
+        assert address == pylvs.Address.parse("[::207.175.44.10]:80")
+        assert len(set([address, pylvs.Address.parse("[::cfaf:2c0a]:80")])) == 1
+        with pytest.raises(ValueError):
+            pylvs.Address.parse("207.175.44:80")
+
+    def test_service(self):
+        service = self.snapshot.get_service("tcp", "207.175.44.30:80")
+        assert service == pylvs.VirtualService("tcp", "207.175.44.30:80", "wlc",
+                                               120, "255.255.255.224")
+        assert service.name == "tcp_207.175.44.30:80"
+        assert service.persistence == 120
+        assert service.opts() == ("wlc", "120", "255.255.255.224")
+
+    def test_servers(self):
+        servers = self.snapshot.get_servers("tcp", "207.175.44.30:80")
+        assert servers == [pylvs.RealServer("192.168.10.1:81", "masq", 1),
+                           pylvs.RealServer("192.168.10.2:81", "masq", 2, 100, 50)]
+        assert servers[1].weight == 2
+        assert servers[1].address.host == "192.168.10.2"
+        assert self.snapshot.get_thresholds("tcp", "207.175.44.30:80",
+                                            "192.168.10.2:81") == (100, 50)
+        assert len(set(servers + [pylvs.RealServer("192.168.10.1:81", "masq", 1)])) == 2
+
+    def test_slots(self):
+        server = self.snapshot.get_real_server("tcp", "207.175.44.30:80",
+                                               "192.168.10.1:81")
+        with pytest.raises(AttributeError):
+            server.extra = 1
+
+    def test_instance_hash(self):
+        manager = pylvs.LVSManager(backend=DumpBackend(DUMP))
+        instances = set(manager.list_lvs_instances())
+        assert "tcp_207.175.44.30:80" in instances
+        assert pylvs.LVSInstance("207.175.44.30:80", "tcp", manager) in instances
+        assert len(instances) == 4
+
+
+class Test_parse_dump:
+
+    def test_tokens(self):
+        records = list(pylvs.pylvs.parse_dump(
+            "-A -t 207.175.44.30:80 -s wlc -p 120 -M 255.255.255.224\n"
+            "-a -t 207.175.44.30:80 -r 192.168.10.1:81 -i -w 1 -x 10 -y 5 "
+            "--tun-type gue --tun-port 6080 --tun-nocsum\n\n"))
+        assert records == [
+            ("-A", "-t", "207.175.44.30:80", {"-s": "wlc", "-p": "120",
+                                              "-M": "255.255.255.224"}),
+            ("-a", "-t", "207.175.44.30:80", {"-r": "192.168.10.1:81", "-i": True,
+                                              "-w": "1", "-x": "10", "-y": "5",
+                                              "--tun-type": "gue",
+                                              "--tun-port": "6080",
+                                              "--tun-nocsum": True})]
+
+    def test_stream(self, tmp_path, monkeypatch):
+        script = tmp_path / "ipvsadm"
+        script.write_text("#!/bin/sh\ncat <<EOF\n{0}EOF\n".format(DUMP))
+        script.chmod(0o755)
+        monkeypatch.setattr(pylvs.pylvs, "IPVSADM", str(script))
+        manager = pylvs.LVSManager()
+        assert manager.snapshot().list_services() == pylvs.LVSSnapshot(DUMP).list_services()
+
+    def test_stream_failure(self, tmp_path, monkeypatch):
+        script = tmp_path / "ipvsadm"
+        script.write_text("#!/bin/sh\nexit 2\n")
+        script.chmod(0o755)
+        monkeypatch.setattr(pylvs.pylvs, "IPVSADM", str(script))
+        with pytest.raises(ValueError):
+            pylvs.LVSManager().snapshot()
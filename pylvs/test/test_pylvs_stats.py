@@ -0,0 +1,92 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+import pytest
+import pylvs
+
+OUTPUT = {
+    "--stats": """IP Virtual Server version 1.2.1 (size=4096)
+Prot LocalAddress:Port               Conns   InPkts  OutPkts  InBytes OutBytes
+  -> RemoteAddress:Port
+TCP  207.175.44.10:80                  120     4000     3900   560000 12000000
+  -> 192.168.10.1:81                    70     2500     2400   350000  8000000
+  -> 192.168.10.2:81                    50     1500     1500   210000  4000000
+UDP  [::207.175.44.10]:80                3        9        0     1200        0
+  -> [::192.168.10.1]:80                 3        9        0     1200        0
+""",
+    "--rate": """IP Virtual Server version 1.2.1 (size=4096)
+Prot LocalAddress:Port                 CPS    InPPS   OutPPS    InBPS   OutBPS
+  -> RemoteAddress:Port
+TCP  207.175.44.10:80                    4       30       29     4100    90000
+  -> 192.168.10.1:81                     3       20       19     3000    60000
+  -> 192.168.10.2:81                     1       10       10     1100    30000
+UDP  [::207.175.44.10]:80                0        1        0      100        0
+  -> [::192.168.10.1]:80                 0        1        0      100        0
+""",
+    None: """IP Virtual Server version 1.2.1 (size=4096)
+Prot LocalAddress:Port Scheduler Flags
+  -> RemoteAddress:Port           Forward Weight ActiveConn InActConn
+TCP  207.175.44.10:80 rr
+  -> 192.168.10.1:81              Masq    1      7          12
+  -> 192.168.10.2:81              Masq    1      5          3
+UDP  [::207.175.44.10]:80 rr
+  -> [::192.168.10.1]:80          Route   1      0          1
+""",
+}
+
+
+class ListingBackend(object):
+    """backend returning canned ipvsadm -Ln output
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def execute(self, args):
+        self.calls.append(args)
+        return True
+
+    def output(self, args):
+        self.calls.append(args)
+        assert args[0] == "-Ln"
+        for fmt in ("--stats", "--rate"):
+            if fmt in args:
+                assert "--exact" in args
+                return OUTPUT[fmt]
+        return OUTPUT[None]
+
+
+class Test_get_stats:
+
+    def test_manager_get_stats(self):
+        backend = ListingBackend()
+        manager = pylvs.LVSManager(backend=backend)
+        stats = manager.get_stats()
+        assert sorted(stats) == ["tcp_207.175.44.10:80", "udp_[::207.175.44.10]:80"]
+        service, servers = stats["tcp_207.175.44.10:80"]
+        assert service == pylvs.LVSStats(conns=120, inpkts=4000, outpkts=3900, inbytes=560000,
+                                         outbytes=12000000, cps=4, inpps=30, outpps=29, inbps=4100,
+                                         outbps=90000, activeconns=12, inactconns=15)
+        assert servers["192.168.10.2:81"] == pylvs.LVSStats(50, 1500, 1500, 210000, 4000000,
+                                                            1, 10, 10, 1100, 30000, 5, 3)
+        assert stats["udp_[::207.175.44.10]:80"][1]["[::192.168.10.1]:80"].inactconns == 1
+        # one call for each format, no matter how many services
+        assert len(backend.calls) == 3
+
+    def test_manager_get_stats_zero(self):
+        backend = ListingBackend()
+        manager = pylvs.LVSManager(backend=backend)
+        manager.get_stats(zero=True)
+        assert backend.calls[-1] == ["-Z"]
+
+    def test_instance_get_stats(self):
+        backend = ListingBackend()
+        manager = pylvs.LVSManager(backend=backend)
+        instance = pylvs.LVSInstance("207.175.44.10:80", "tcp", manager)
+        service, servers = instance.get_stats(zero=True)
+        assert service.conns == 120
+        assert sorted(servers) == ["192.168.10.1:81", "192.168.10.2:81"]
+        assert backend.calls[0][-2:] == ["-t", "207.175.44.10:80"]
+        assert backend.calls[-1] == ["-Z", "-t", "207.175.44.10:80"]
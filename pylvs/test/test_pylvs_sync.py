@@ -0,0 +1,106 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+import pytest
+import pylvs
+from pylvs import netlink
+from pylvs.simulator import SimulatedBackend
+
+CONN_SYNC = """Pro FromIP   FPrt ToIP     TPrt DestIP   DPrt State       Origin Expires
+TCP 0A000001 9C40 CFAF2C0A 0050 C0A80A01 0051 ESTABLISHED Local      899
+TCP 0A000002 9C41 CFAF2C0A 0050 C0A80A01 0051 ESTABLISHED Sync       899
+TCP 0A000003 9C42 CFAF2C0A 0050 C0A80A02 0051 FIN_WAIT    Sync        60
+"""
+
+SYSCTLS = {"sync_threshold": "3\t50\n", "sync_version": "1\n",
+           "sync_ports": "1\n", "sync_qlen_max": "124958\n",
+           "conntrack": "0\n"}
+
+
+@pytest.fixture
+def proc_root(tmp_path):
+    net = tmp_path / "net"
+    net.mkdir()
+    (net / "ip_vs_conn_sync").write_text(CONN_SYNC)
+    vs = tmp_path / "sys" / "net" / "ipv4" / "vs"
+    vs.mkdir(parents=True)
+    for name, value in SYSCTLS.items():
+        (vs / name).write_text(value)
+    return str(tmp_path)
+
+
+class Test_sync:
+
+    def setup_method(self, method):
+        self.backend = SimulatedBackend()
+        self.manager = pylvs.LVSManager(backend=self.backend)
+
+    def test_daemons(self):
+        assert self.manager.list_daemons() == []
+        self.manager.start_daemon("master", "eth0", 1, mcast_ttl=2)
+        self.manager.start_daemon("backup", "eth1", 2, sync_maxlen=1400,
+                                  mcast_group="239.0.0.1", mcast_port=9000)
+        assert self.backend.output(["-L", "--daemon"]) == (
+            "master sync daemon (mcast=eth0, syncid=1, maxlen=1472, "
+            "group=224.0.0.81, port=8848, ttl=2)\n"
+            "backup sync daemon (mcast=eth1, syncid=2, maxlen=1400, "
+            "group=239.0.0.1, port=9000, ttl=1)\n")
+        assert self.manager.list_daemons() == [
+            pylvs.LVSDaemon("master", "eth0", 1, 1472, "224.0.0.81", 8848, 2),
+            pylvs.LVSDaemon("backup", "eth1", 2, 1400, "239.0.0.1", 9000, 1)]
+        with pytest.raises(ValueError):
+            self.manager.start_daemon("master", "eth0")
+        assert self.manager.stop_daemon("master")
+        with pytest.raises(ValueError):
+            self.manager.stop_daemon("master")
+        assert [daemon.state for daemon in self.manager.list_daemons()] == [
+            "backup"]
+
+    def test_validation(self):
+        for args, kwargs in ((("primary", "eth0"), {}),
+                             (("master", "eth0", 256), {}),
+                             (("master", "eth0"), {"mcast_port": 0}),
+                             (("master", "eth0"), {"mcast_ttl": 256}),
+                             (("master", "eth0"), {"mcast_group": "224.0.0"})):
+            with pytest.raises(ValueError):
+                self.manager.start_daemon(*args, **kwargs)
+        with pytest.raises(ValueError):
+            self.manager.stop_daemon("primary")
+        assert self.backend.get_daemons() == []
+
+    def test_parse_command(self):
+        cmd, attrs = netlink.parse_command(["--start-daemon", "backup",
+            "--mcast-interface", "eth0", "--mcast-group", "ff02::81"])
+        assert cmd == netlink.IPVS_CMD_NEW_DAEMON
+        daemon = netlink.decode_daemon(netlink.parse_attrs(
+            b"".join(attrs))[netlink.IPVS_CMD_ATTR_DAEMON])
+        assert daemon == {"state": netlink.IP_VS_STATE_BACKUP,
+                          "mcast_ifn": "eth0", "syncid": 0,
+                          "mcast_group": "ff02::81"}
+        with pytest.raises(NotImplementedError):
+            netlink.parse_command(["--start-daemon", "master",
+                                   "--mcast-interface", "eth0", "--unknown"])
+
+    def test_parse_daemons(self):
+        # older kernels only report interface and syncid
+        assert pylvs.pylvs._parse_daemons(
+            "master sync daemon (mcast=eth0, syncid=0)\n") == [
+            pylvs.LVSDaemon("master", "eth0", 0, None, None, None, None)]
+
+    def test_sync_stats(self, proc_root):
+        manager = pylvs.LVSManager(backend=self.backend, proc_root=proc_root)
+        assert manager.get_sync_stats() == {"Local": 1, "Sync": 2}
+        assert manager.get_sync_tunables() == {"sync_threshold": (3, 50),
+                                               "sync_version": 1,
+                                               "sync_ports": 1,
+                                               "sync_qlen_max": 124958}
+
+    def test_sync_missing(self, tmp_path):
+        manager = pylvs.LVSManager(backend=self.backend,
+                                   proc_root=str(tmp_path))
+        with pytest.raises(ValueError):
+            manager.get_sync_stats()
+        with pytest.raises(ValueError):
+            manager.get_sync_tunables()
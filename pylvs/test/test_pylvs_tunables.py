@@ -0,0 +1,130 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+import os
+import pytest
+import pylvs
+from pylvs import procfs
+from pylvs.simulator import SimulatedBackend
+
+SYSCTLS = {"am_droprate": "10\n", "amemthresh": "1024\n",
+           "conn_reuse_mode": "1\n", "conntrack": "0\n", "drop_entry": "0\n",
+           "drop_packet": "0\n", "expire_nodest_conn": "0\n",
+           "expire_quiescent_template": "0\n", "schedule_icmp": "0\n",
+           "secure_tcp": "0\n", "sloppy_tcp": "0\n",
+           "sync_threshold": "3\t50\n", "sync_ports": "1\n",
+           "lblc_expiration": "86400\n"}
+
+IP_VS = """IP Virtual Server version 1.2.1 (size=1048576)
+Prot LocalAddress:Port Scheduler Flags
+  -> RemoteAddress:Port Forward Weight ActiveConn InActConn
+"""
+
+
+class ProcfsBackend(SimulatedBackend):
+    """simulator pretending to manage the table of this host
+    """
+
+    procfs = True
+
+
+@pytest.fixture
+def proc_root(tmp_path):
+    vs = tmp_path / "sys" / "net" / "ipv4" / "vs"
+    vs.mkdir(parents=True)
+    for name, value in SYSCTLS.items():
+        (vs / name).write_text(value)
+    return str(tmp_path)
+
+
+class Test_tunables:
+
+    def setup_method(self, method):
+        self.backend = SimulatedBackend()
+
+    def manager(self, proc_root):
+        return pylvs.LVSManager(backend=self.backend, proc_root=proc_root)
+
+    def test_get_tunables(self, proc_root):
+        tunables = self.manager(proc_root).get_tunables()
+        assert tunables["sync_threshold"] == (3, 50)
+        assert tunables["lblc_expiration"] == 86400
+        assert len(tunables) == len(SYSCTLS)
+
+    def test_defaults(self, proc_root):
+        assert self.manager(proc_root).diff_tunables("defaults") == {}
+
+    def test_set_profile(self, proc_root):
+        manager = self.manager(proc_root)
+        diff = {"drop_entry": (0, 1), "drop_packet": (0, 1),
+                "secure_tcp": (0, 1)}
+        assert manager.set_tunables("defense", dry_run=True) == diff
+        assert manager.get_tunables()["drop_entry"] == 0
+        assert manager.set_tunables("defense") == diff
+        assert manager.diff_tunables("defense") == {}
+        assert manager.diff_tunables("defaults") == dict(
+            (name, (new, old)) for name, (old, new) in diff.items())
+
+    def test_set_dict(self, proc_root):
+        manager = self.manager(proc_root)
+        manager.set_tunables({"sync_threshold": [10, 100], "amemthresh": "2048"})
+        path = os.path.join(proc_root, "sys", "net", "ipv4", "vs")
+        with open(os.path.join(path, "sync_threshold")) as sysctl:
+            assert sysctl.read() == "10 100\n"
+        assert manager.get_tunables()["amemthresh"] == 2048
+
+    def test_invalid(self, proc_root):
+        manager = self.manager(proc_root)
+        with pytest.raises(ValueError) as error:
+            manager.set_tunables({"conntrack": 2, "sync_threshold": (50, 3),
+                                  "sync_ports": 3, "drop_entry": "x",
+                                  "sync_window": 1})
+        assert str(error.value) == (
+            "invalid tunables: conntrack: invalid value 2; drop_entry: invalid "
+            "value 'x'; sync_ports: invalid value 3; sync_threshold: invalid "
+            "value (50, 3); sync_window: unknown tunable")
+        with pytest.raises(ValueError):
+            manager.diff_tunables("fast")
+        with pytest.raises(ValueError) as error:
+            manager.diff_tunables({"sloppy_sctp": 1})
+        assert str(error.value).endswith("sloppy_sctp")
+        assert manager.get_tunables()["conntrack"] == 0
+
+    def test_rollback(self, proc_root, monkeypatch):
+        write = procfs.write_sysctl
+
+        def failing(name, value, proc_root=None):
+            if name == "secure_tcp" and value == 1:
+                raise IOError(13, "Permission denied")
+            write(name, value, proc_root)
+
+        monkeypatch.setattr(procfs, "write_sysctl", failing)
+        manager = self.manager(proc_root)
+        with pytest.raises(ValueError) as error:
+            manager.set_tunables("defense")
+        assert str(error.value).startswith("could not set secure_tcp")
+        assert manager.diff_tunables("defaults") == {}
+
+
+class Test_info:
+
+    def test_timeouts(self):
+        manager = pylvs.LVSManager(backend=SimulatedBackend())
+        assert manager.get_timeouts() == (900, 120, 300)
+        manager.set_timeouts(3600, 0, 60)
+        assert manager.get_timeouts() == (3600, 120, 60)
+
+    def test_info_from_listing(self):
+        manager = pylvs.LVSManager(backend=SimulatedBackend(version="1.2.0"))
+        assert manager.get_info() == {"version": "1.2.0",
+                                      "conn_tab_size": 4096,
+                                      "conn_tab_bits": 12}
+
+    def test_info_from_procfs(self, tmp_path):
+        (tmp_path / "net").mkdir()
+        (tmp_path / "net" / "ip_vs").write_text(IP_VS)
+        manager = pylvs.LVSManager(backend=ProcfsBackend(),
+                                   proc_root=str(tmp_path))
+        assert manager.get_info()["conn_tab_bits"] == 20
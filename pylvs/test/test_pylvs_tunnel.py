@@ -0,0 +1,108 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+import socket
+import pytest
+import pylvs
+from pylvs import netlink
+from pylvs.simulator import SimulatedBackend
+
+DUMP = """-A -t 207.175.44.10:80 -s rr
+-a -t 207.175.44.10:80 -r 192.168.10.1:80 -i -w 1 --tun-type gue --tun-port 6080 --tun-remcsum
+-a -t 207.175.44.10:80 -r 192.168.10.2:80 -i -w 1 --tun-type gre --tun-nocsum
+-a -t 207.175.44.10:80 -r 192.168.10.3:80 -i -w 1
+"""
+
+
+class Test_tunnel:
+
+    def setup_method(self, method):
+        self.backend = SimulatedBackend()
+        self.manager = pylvs.LVSManager(backend=self.backend)
+        self.instance = self.manager.add_lvs_instance("207.175.44.10:80", "tcp", "rr")
+
+    def test_snapshot(self):
+        servers = pylvs.LVSSnapshot(DUMP).get_servers("tcp", "207.175.44.10:80")
+        assert [(server.tun_type, server.tun_port, server.tun_csum)
+                for server in servers] == [("gue", 6080, "remcsum"),
+                                           ("gre", None, "nocsum"),
+                                           (None, None, None)]
+        assert repr(servers[0]) == ("RealServer('192.168.10.1:80', 'ipip', 1, None, "
+                                    "None, 'gue', 6080, 'remcsum')")
+        assert repr(servers[2]) == "RealServer('192.168.10.3:80', 'ipip', 1, None, None)"
+
+    def test_add_and_edit(self):
+        self.instance.add_server("192.168.10.1:80", "ipip", tun_type="gue",
+                                 tun_port=6080)
+        assert "-i -w 1 --tun-type gue --tun-port 6080 --tun-nocsum" in \
+            self.backend.output(["-Sn"])
+        self.instance.edit_server("192.168.10.1:80", "ipip", tun_type="gre",
+                                  tun_csum="csum")
+        server = self.instance.get_servers()[0]
+        assert (server.tun_type, server.tun_port, server.tun_csum) == ("gre", None, "csum")
+        self.instance.edit_server("192.168.10.1:80", "ipip")
+        assert self.instance.get_servers()[0] == pylvs.RealServer("192.168.10.1:80", "ipip")
+        # the listing keeps the three columns
+        assert self.instance.list_servers() == [("192.168.10.1:80", "ipip", "1")]
+
+    def test_invalid(self):
+        for kwargs, message in (
+                ({"tun_type": "gue"}, "gue needs a tun_port"),
+                ({"tun_type": "vxlan"}, "invalid tunnel type: vxlan"),
+                ({"tun_type": "gre", "tun_port": 6080}, "tun_port is only allowed with gue"),
+                ({"tun_type": "gre", "tun_csum": "remcsum"}, "remcsum is only allowed with gue"),
+                ({"tun_type": "ipip", "tun_csum": "csum"}, "tun_csum is only allowed"),
+                ({"tun_csum": "csum"}, "tun_port and tun_csum cannot appear")):
+            with pytest.raises(ValueError) as error:
+                self.instance.add_server("192.168.10.1:80", "ipip", **kwargs)
+            assert str(error.value).startswith(message)
+        with pytest.raises(ValueError) as error:
+            self.instance.add_server("192.168.10.1:81", "masq", tun_type="gre")
+        assert str(error.value) == "tunnel options need the ipip method"
+        assert self.instance.list_servers() == []
+
+    def test_simulator_checks(self):
+        failed = self.backend.restore([
+            ["-a", "-t", "207.175.44.10:80", "-r", "192.168.10.1:80", "-i",
+             "--tun-type", "gue"],
+            ["-a", "-t", "207.175.44.10:80", "-r", "192.168.10.2:80", "-i",
+             "--tun-type", "gre", "--tun-remcsum"]])
+        assert [index for index, message in failed] == [0, 1]
+
+    def test_validate_and_apply(self):
+        state = {"tcp_207.175.44.10:80": {"scheduler": "rr", "servers": {
+            "192.168.10.1:80": {"method": "ipip", "tun_type": "gue",
+                                "tun_port": 6080},
+            "192.168.10.2:80": {"method": "ipip", "tun_type": "ipip"}}}}
+        canonical, violations = pylvs.validate_state(state)
+        assert violations == []
+        assert canonical["tcp_207.175.44.10:80"]["servers"] == {
+            "192.168.10.1:80": {"method": "ipip", "weight": 1, "upper": None,
+                                "lower": None, "tun_type": "gue",
+                                "tun_port": 6080, "tun_csum": "nocsum"},
+            "192.168.10.2:80": {"method": "ipip", "weight": 1, "upper": None,
+                                "lower": None}}
+        assert len(self.manager.apply(state)) == 2
+        assert self.manager.apply(state) == []
+        state["tcp_207.175.44.10:80"]["servers"]["192.168.10.1:80"]["tun_csum"] = "csum"
+        assert self.manager.apply(state) == [
+            "-e -t 207.175.44.10:80 -r 192.168.10.1:80 -i -w 1 --tun-type gue "
+            "--tun-port 6080 --tun-csum"]
+
+        violations = pylvs.validate_state({"tcp_207.175.44.10:80": {"servers": [
+            ("192.168.10.1:80", "route", 1, None, None, "gre")]}})[1]
+        assert [violation.message for violation in violations] == [
+            "tunnel options need the ipip method"]
+
+    def test_netlink_attributes(self):
+        cmd, attrs = netlink.parse_command(["-a", "-t", "207.175.44.10:80", "-r",
+                                            "192.168.10.1:80", "-i", "--tun-type",
+                                            "gue", "--tun-port", "6080",
+                                            "--tun-csum"])
+        dest = netlink.decode_dest(netlink.parse_attrs(b"".join(attrs))[
+            netlink.IPVS_CMD_ATTR_DEST], socket.AF_INET)
+        assert (dest["tun_type"], dest["tun_port"], dest["tun_flags"]) == (
+            netlink.IP_VS_CONN_F_TUNNEL_TYPE_GUE, 6080,
+            netlink.IP_VS_TUNNEL_ENCAP_FLAG_CSUM)
@@ -0,0 +1,105 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+import pytest
+import pylvs
+from pylvs.simulator import SimulatedBackend
+
+
+class Test_validate_state:
+
+    def test_valid(self):
+        canonical, violations = pylvs.validate_state({
+            "tcp_[::0:207.175.44.10]:80": {
+                "scheduler": "wrr", "persistence": 60,
+                "servers": [("[::192.168.10.1]:81", "masq", 5)]},
+            "fwm_0001": {"servers": {"192.168.10.1:0": {"method": "route"}}}})
+        assert violations == []
+        assert canonical == {
+            "tcp_[::207.175.44.10]:80": {
+                "scheduler": "wrr", "persistence": 60,
+                "servers": {"[::192.168.10.1]:81": {"method": "masq", "weight": 5,
+                                                     "upper": None, "lower": None}}},
+            "fwm_1": {"servers": {"192.168.10.1:0": {"method": "route", "weight": 1,
+                                                     "upper": None, "lower": None}}}}
+
+    def test_all_violations(self):
+        canonical, violations = pylvs.validate_state({
+            "http_207.175.44.10:80": {},
+            "fwm_0": {},
+            "tcp_207.175.44.300:80": {},
+            "tcp_207.175.44.10:70000": {},
+            "udp_207.175.44.10:80": {"scheduler": "xyz", "netmask": "255.255.255.0"},
+            "tcp_207.175.44.10:80": {"persistence": 0, "servers": [
+                ("[::192.168.10.1]:80", "masq"),
+                ("192.168.10.2:81", "route"),
+                ("207.175.44.10:81", "masq"),
+                ("192.168.10.3:80", "nat"),
+                ("192.168.10.4:80", "masq", 70000, None, 10),
+                ("192.168.10.5", "masq"),
+                ("192.168.10.6:80", "masq"),
+                ("192.168.010.6:80", "masq")]},
+            "fwm6_1": {"servers": [("192.168.10.1:80", "route")]}})
+        assert canonical == {"fwm6_1": {"servers": {}}}
+        assert [(violation.service, violation.real_server)
+                for violation in violations] == [
+            ("fwm6_1", "192.168.10.1:80"),
+            ("fwm_0", None),
+            ("http_207.175.44.10:80", None),
+            ("tcp_207.175.44.10:70000", None),
+            ("tcp_207.175.44.10:80", None),
+            ("tcp_207.175.44.10:80", "[::192.168.10.1]:80"),
+            ("tcp_207.175.44.10:80", "192.168.10.2:81"),
+            ("tcp_207.175.44.10:80", "207.175.44.10:81"),
+            ("tcp_207.175.44.10:80", "192.168.10.3:80"),
+            ("tcp_207.175.44.10:80", "192.168.10.4:80"),
+            ("tcp_207.175.44.10:80", "192.168.10.4:80"),
+            ("tcp_207.175.44.10:80", "192.168.10.5"),
+            ("tcp_207.175.44.10:80", "192.168.010.6:80"),
+            ("tcp_207.175.44.300:80", None),
+            ("udp_207.175.44.10:80", None),
+            ("udp_207.175.44.10:80", None)]
+        messages = [violation.message for violation in violations]
+        assert messages[0] == "IPv4 RealServer not allowed with IPv6 Service"
+        assert messages[3] == "port outside range"
+        assert messages[6].startswith("service_addr and RealServer port do not match")
+        assert messages[7] == "service_addr & RealServer are the same, this is not allowed"
+        assert messages[-2:] == ["selected scheduler is invalid",
+                                 "netmask cannot appear without persistence"]
+
+    def test_duplicates(self):
+        canonical, violations = pylvs.validate_state({
+            "tcp_[0::1]:80": {"servers": [("[::2]:80", "route"),
+                                          ("[0::2]:80", "route")]},
+            "tcp_[::1]:80": {}})
+        assert list(canonical) == ["tcp_[::1]:80"]
+        assert [violation.message for violation in violations] == [
+            "duplicate RealServer", "same service as tcp_[::1]:80"]
+
+    def test_addresses_parsed_once(self, monkeypatch):
+        parsed = []
+        parse = pylvs.Address.parse
+
+        def counting(addr):
+            parsed.append(addr)
+            return parse(addr)
+
+        monkeypatch.setattr(pylvs.Address, "parse", staticmethod(counting))
+        state = dict(("tcp_10.0.0.{0}:80".format(index),
+                      {"servers": [("192.168.10.1:80", "route"),
+                                   ("192.168.10.2:80", "route")]})
+                     for index in range(1, 101))
+        assert pylvs.validate_state(state)[1] == []
+        assert len(parsed) == 102
+
+    def test_apply(self):
+        manager = pylvs.LVSManager(backend=SimulatedBackend())
+        with pytest.raises(pylvs.LVSValidationError) as error:
+            manager.apply({"tcp_207.175.44.10:80": {"servers": [
+                ("192.168.10.1:81", "route"), ("192.168.10.2:80", "ipip", -1)]}})
+        assert len(error.value.violations) == 2
+        assert str(error.value).startswith(
+            "2 violations: tcp_207.175.44.10:80 192.168.10.1:81: service_addr")
+        assert manager.list_lvs_instances() == []
@@ -0,0 +1,137 @@
+# -*- coding: utf8 -*-
+"""this Software is released under the MIT License
+Copyright (c) 2012 Stephan Schultchen
+"""
+
+import pytest
+import pylvs
+from pylvs.simulator import SimulatedBackend
+
+DUMP = """-A -t 207.175.44.10:80 -s rr
+-a -t 207.175.44.10:80 -r 192.168.10.1:81 -m -w 1
+-a -t 207.175.44.10:80 -r 192.168.10.2:81 -m -w 1
+-A -u 207.175.44.10:53 -s rr
+-a -u 207.175.44.10:53 -r 192.168.10.1:53 -m -w 1
+"""
+
+IP_VS = """IP Virtual Server version 1.2.1 (size=4096)
+Prot LocalAddress:Port Scheduler Flags
+  -> RemoteAddress:Port Forward Weight ActiveConn InActConn
+TCP  CFAF2C0A:0050 rr
+  -> C0A80A01:0051      Masq    1      {0}          0
+"""
+
+
+class CountingBackend(SimulatedBackend):
+    """simulator counting the dumps, pretending to manage this host
+    """
+
+    procfs = True
+
+    def __init__(self, dump):
+        SimulatedBackend.__init__(self, dump)
+        self.dumps = 0
+
+    def output(self, args):
+        if args == ["-Sn"]:
+            self.dumps += 1
+        return SimulatedBackend.output(self, args)
+
+
+class Test_watch:
+
+    def setup_method(self, method):
+        self.backend = SimulatedBackend(DUMP)
+        self.manager = pylvs.LVSManager(backend=self.backend)
+
+    def test_changes(self):
+        watcher = pylvs.LVSWatcher(self.manager)
+        assert watcher.poll() == []
+        assert watcher.poll() == []
+        instance = self.manager.get_lvs_instance("tcp_207.175.44.10:80")
+        instance.edit_server("192.168.10.1:81", "masq", weight=5)
+        instance.del_server("192.168.10.2:81")
+        instance.set_opts("wrr")
+        self.manager.del_lvs_instance("207.175.44.10:53", "udp")
+        added = self.manager.add_lvs_instance("207.175.44.20:80", "tcp", "rr")
+        added.add_server("192.168.10.3:80", "route")
+        changes = watcher.poll()
+        assert [(change.kind, change.service, change.real_server)
+                for change in changes] == [
+            ("service_changed", "tcp_207.175.44.10:80", None),
+            ("server_changed", "tcp_207.175.44.10:80", "192.168.10.1:81"),
+            ("server_removed", "tcp_207.175.44.10:80", "192.168.10.2:81"),
+            ("service_added", "tcp_207.175.44.20:80", None),
+            ("server_added", "tcp_207.175.44.20:80", "192.168.10.3:80"),
+            ("server_removed", "udp_207.175.44.10:53", "192.168.10.1:53"),
+            ("service_removed", "udp_207.175.44.10:53", None)]
+        assert (changes[0].old.scheduler, changes[0].new.scheduler) == ("rr", "wrr")
+        assert (changes[1].old.weight, changes[1].new.weight) == (1, 5)
+        assert changes[2].new is None
+        assert watcher.poll() == []
+
+    def test_unchanged_services_are_not_parsed(self):
+        watcher = pylvs.LVSWatcher(self.manager)
+        watcher.poll()
+        udp = watcher.services["-A -u 207.175.44.10:53"]
+        self.backend.execute(["-e", "-t", "207.175.44.10:80", "-r",
+                              "192.168.10.1:81", "-m", "-w", "3"])
+        assert len(watcher.poll()) == 1
+        assert watcher.services["-A -u 207.175.44.10:53"] is udp
+
+    def test_procfs_skips_dump(self, tmp_path):
+        net = tmp_path / "net"
+        net.mkdir()
+        (net / "ip_vs").write_text(IP_VS.format(0))
+        backend = CountingBackend(DUMP)
+        manager = pylvs.LVSManager(backend=backend, proc_root=str(tmp_path))
+        watcher = pylvs.LVSWatcher(manager)
+        watcher.poll()
+        # the connection counters do not count as a change
+        (net / "ip_vs").write_text(IP_VS.format(12))
+        assert watcher.poll() == []
+        assert backend.dumps == 1
+        (net / "ip_vs").write_text(IP_VS.format(0).replace("Masq    1",
+                                                           "Masq    2"))
+        backend.execute(["-e", "-t", "207.175.44.10:80", "-r",
+                         "192.168.10.1:81", "-m", "-w", "2"])
+        assert [change.kind for change in watcher.poll()] == ["server_changed"]
+        assert backend.dumps == 2
+
+    def test_option_change_behind_procfs(self, tmp_path):
+        net = tmp_path / "net"
+        net.mkdir()
+        (net / "ip_vs").write_text(IP_VS.format(0))
+        backend = CountingBackend(DUMP)
+        manager = pylvs.LVSManager(backend=backend, proc_root=str(tmp_path))
+        watcher = pylvs.LVSWatcher(manager, full_every=3)
+        watcher.poll()
+        # thresholds are not in procfs
+        backend.execute(["-e", "-t", "207.175.44.10:80", "-r",
+                         "192.168.10.1:81", "-m", "-w", "1", "-x", "100"])
+        assert watcher.poll() == []
+        assert backend.dumps == 1
+        changes = watcher.poll()
+        assert [(change.kind, change.real_server) for change in changes] == [
+            ("server_changed", "192.168.10.1:81")]
+        assert (changes[0].old.upper, changes[0].new.upper) == (None, 100)
+        assert backend.dumps == 2
+
+    def test_watch(self, monkeypatch):
+        polls = []
+
+        def sleep(seconds):
+            polls.append(seconds)
+            self.manager.add_lvs_instance("207.175.44.{0}:80".format(
+                                          len(polls) + 20), "tcp")
+
+        monkeypatch.setattr(pylvs.pylvs.time, "sleep", sleep)
+        changes = self.manager.watch(interval=5)
+        assert next(changes).service == "tcp_207.175.44.21:80"
+        assert next(changes).service == "tcp_207.175.44.22:80"
+        assert polls == [5, 5]
+
+        seen = []
+        assert self.manager.watch(callback=lambda change:
+                                  seen.append(change) or len(seen) < 2) is None
+        assert [change.kind for change in seen] == ["service_added"] * 2
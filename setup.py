@@ -12,4 +12,5 @@ setup(
     author_email = "schlitzered@gmail.com",
     url = "https://github.com/schlitzered/pylvs",
     packages=['pylvs'],
+    scripts=['bin/pylvs-exporter'],
 ) 